@@ -2,11 +2,10 @@ import os
 from dotenv import load_dotenv, find_dotenv
 _ = load_dotenv(find_dotenv())
 
-from langchain_google_genai import ChatGoogleGenerativeAI # Import the ChatGoogleGenerativeAI classP from langchain_google_genai
 from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.prebuilt import ToolNode
 
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -18,23 +17,42 @@ token_path = os.getenv("GMAIL_TOKEN_PATH")
 
 # region AGENT DEFINITION
 from agent.utils.tools.gmail_tools import GmailToolkit
+from agent.utils.tools.tool_scheduler import ToolScheduler
+from agent.utils.response_cache import ResponseCache
+from agent.utils.token_accounting import TokenAccountant, compact_tool_descriptions
+from agent.utils.intent_router import IntentRouter
 from agent.utils.states.base_state import AgentState
+from gmail_api.client_pool import GmailClientPool, use_account
+from telemetry.tracing import tracer
     
 
 class Agent:
-    def __init__(self, model, system = "", checkpointer = None):
+    def __init__(self, model, system = "", checkpointer = None, max_parallel_tools = 4, response_cache: ResponseCache = None,
+                 client_pool: GmailClientPool = None, compact_schemas = False, fast_path = False):
         self.system = system
+        self.response_cache = response_cache
+        # Tokens of every model call, by thread and by part of the prompt
+        self.token_accountant = TokenAccountant()
         graph = StateGraph(AgentState)  # Create a state graph with the AgentState class
         
         # Bind tools to the agent using GmailToolkit
-        toolkit = GmailToolkit()
+        # One agent serves every account: the tools use the account of the thread ("account" in the configurable)
+        self.toolkit = toolkit = GmailToolkit(client_pool)
         tools = toolkit.get_tools()
-        self.tool_node = ToolNode(tools)
+        if compact_schemas:
+            # Long lists repeated in several tool descriptions (e.g. the label colors) are sent once, in the system prompt
+            references = compact_tool_descriptions(tools)
+            if references:
+                self.system = f"{system}\n\n{references}" if system else references
         self.tools = {t.name: t for t in tools if hasattr(t, "name")}
+        # Trivial commands ("list my labels", "delete label Foo") are answered without the model
+        self.router = IntentRouter(toolkit) if fast_path else None
+        # Independent tool calls of the same step run concurrently
+        self.scheduler = ToolScheduler(toolkit.resource_access, max_workers=max_parallel_tools)
         
         # Construct graph
         graph.add_node("execute", self.execute)
-        graph.add_node("tools", self.tool_node)
+        graph.add_node("tools", self.take_action)
         graph.add_conditional_edges(
             "execute",
             self.exists_action,
@@ -46,44 +64,102 @@ class Agent:
         # Compile the graph
         self.graph = graph.compile(checkpointer=checkpointer)
         self.model = model.bind_tools(self.tools.values())
+        self.tool_schemas = [convert_to_openai_tool(t) for t in self.tools.values()]
         
-    def execute(self, state: AgentState):
+    def execute(self, state: AgentState, config: RunnableConfig):
         """
         Aexecute the agent with the user query
+        Trivial commands are answered by the intent router, without calling the model.
+        Identical calls (same system prompt, tools and messages) are served from the response cache.
+        The tokens of every call are recorded by the token accountant.
         """
         messages = state["messages"]
-        if(self.system):
-            messages = [SystemMessage(content=self.system)] + messages
-        message = self.model.invoke(messages)
-        return {'messages': [message]}
+        thread_id = config.get("configurable", {}).get("thread_id")
+        if self.router is not None and isinstance(messages[-1], HumanMessage):
+            with tracer.span("router", "route", thread_id=thread_id) as span, \
+                    use_account(config.get("configurable", {}).get("account")):
+                routed = self.router.handle(messages[-1].content, state.get("pending_action"), self.call_tool)
+                span.set(fast_path=routed is not None)
+            if routed is not None:
+                return routed
+        # A pending action of the router is dropped once the user answers something else
+        update = {'pending_action': None} if state.get("pending_action") is not None else {}
+        with tracer.span("node", "execute", thread_id=thread_id, messages=len(messages)) as span:
+            key = None
+            if self.response_cache is not None:
+                key = self.response_cache.key(self.system, self.tool_schemas, messages)
+                cached = self.response_cache.get(key)
+                if cached is not None:
+                    self.token_accountant.record(thread_id, self.system, self.tool_schemas, messages, cached, cached=True)
+                    span.set(cached=True)
+                    return {'messages': [cached], **update}
+            prompt = [SystemMessage(content=self.system)] + messages if self.system else messages
+            with tracer.span("llm", "model.invoke") as llm_span:
+                message = self.model.invoke(prompt)
+                tokens = self.token_accountant.record(thread_id, self.system, self.tool_schemas, messages, message)
+                llm_span.set_payload(message.content)
+                llm_span.set(tool_calls=len(getattr(message, "tool_calls", None) or []),
+                             input_tokens=tokens["input"], output_tokens=tokens["output"])
+            if key is not None and (message.content or getattr(message, "tool_calls", None)):
+                self.response_cache.put(key, message)
+            return {'messages': [message], **update}
     
 
-    def take_action(self, state: AgentState):
+    def take_action(self, state: AgentState, config: RunnableConfig):
         """
         Take an action based on the user query.
-        Only execute tool calls that were confirmed.
+        Independent tool calls run concurrently, results keep the order of the calls.
+        The tools act on the Gmail account of the thread.
         """
         tool_calls = state["messages"][-1].tool_calls 
-        results = []
-        for t in tool_calls:
-            print(f"Calling: {t}")
+        with tracer.span("node", "tools", tool_calls=len(tool_calls)), \
+                use_account(config.get("configurable", {}).get("account")):
+            results = self.scheduler.run(tool_calls, self.call_tool)
+        return {'messages': results}
+    
+    def call_tool(self, t: dict) -> ToolMessage:
+        """
+        Run a single tool call and wrap its result in a ToolMessage.
+        """
+        print(f"Calling: {t}")
+        with tracer.span("tool", t['name']) as span:
             if t['name'] not in self.tools:
                 print(f"Unknown tool name: {t['name']}")
                 result = "Bad tool name, retry ......../n"
+                span.fail("unknown tool")
             else:
-                result = self.tools[t['name']].invoke(t['args'])
-            results.append(ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result)))
-        return {'messages': results}
+                try:
+                    result = self.tools[t['name']].invoke(t['args'])
+                except Exception as error:
+                    result = f"Error: {error}"
+                    span.fail(error)
+            span.set_payload(str(result))
+        return ToolMessage(tool_call_id=t['id'], name=t['name'], content=str(result))
 
     def exists_action(self, state: AgentState):
         """
         Check if there is a tool call in the last message
         """
-        return len(state["messages"][-1].tool_calls) > 0
+        return len(getattr(state["messages"][-1], "tool_calls", None) or []) > 0
+    
+    def stream_reply(self, state: AgentState, thread: dict):
+        """
+        Run the graph and yield the text of the agent messages token by token as it is generated.
+        """
+        for chunk, metadata in self.graph.stream(state, thread, stream_mode="messages"):
+            if metadata.get("langgraph_node") == "execute" and isinstance(chunk, AIMessage):
+                content = chunk.content
+                if isinstance(content, list):
+                    content = "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+                if content:
+                    yield content
             
 
 if __name__ == '__main__':
     # region TEST_AGENT
+    from langchain_google_genai import ChatGoogleGenerativeAI # Import the ChatGoogleGenerativeAI classP from langchain_google_genai
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    
     with open(os.path.join(os.path.dirname(__file__), "prompts/agent_prompt.yaml"), "r") as f:
         config_yaml = yaml.safe_load(f)
     prompt = config_yaml.get("prompt", "")
@@ -97,20 +173,16 @@ if __name__ == '__main__':
         
         # Initial greeting from the agent
         init_state = {"messages": [HumanMessage(content="Hello what can you do?")]}
-        for event in agent.graph.stream(init_state, thread):
-            for v in event.values():
-                msg = v["messages"][-1]
-                if isinstance(msg, AIMessage) and msg.content:
-                    print(f"Agent: {msg.content}")
+        print("Agent: ", end="", flush=True)
+        for token in agent.stream_reply(init_state, thread):
+            print(token, end="", flush=True)
         print("\n")
         
         while True:
             user_message = input("You: ")
             messages = [HumanMessage(content=user_message)]
-            for event in agent.graph.stream({"messages": messages}, thread):
-                for v in event.values():
-                    msg = v["messages"][-1]
-                    if isinstance(msg, AIMessage) and msg.content:
-                        print(f"Agent: {msg.content}")
+            print("Agent: ", end="", flush=True)
+            for token in agent.stream_reply({"messages": messages}, thread):
+                print(token, end="", flush=True)
             print("\n")
     # endregion
\ No newline at end of file
@@ -0,0 +1,223 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """
+    In-memory checkpointer that keeps a bounded number of conversation threads.
+
+    Every page load and Clear Chat starts a new thread, and a plain MemorySaver keeps each of them,
+    with its whole checkpoint history, for the life of the process. This saver:
+        - keeps only the `max_checkpoints` most recent checkpoints of a thread, older ones are only
+          needed to travel back in time, which the agent never does;
+        - evicts whole threads, least recently used first, beyond `max_threads`, and threads idle for
+          more than `idle_ttl` seconds;
+        - optionally spills evicted threads to SQLite and reloads them transparently when they are
+          used again. Threads stay there for `spill_ttl` seconds.
+
+    Checkpoints are stored as the serialized blobs InMemorySaver already holds, so spilling and
+    reloading a thread does not serialize anything again.
+    """
+
+    def __init__(self, max_threads: int = 500, idle_ttl: float = 6 * 3600.0, max_checkpoints: int = 10,
+                 spill_path: Optional[str] = None, spill_ttl: float = 7 * 24 * 3600.0, **kwargs):
+        """
+        Initializes the BoundedMemorySaver object.
+
+        Args:
+            max_threads (int): Maximum number of threads kept in memory.
+            idle_ttl (float): Seconds after its last use before a thread is evicted.
+            max_checkpoints (int): Checkpoints kept per thread (and namespace), the latest ones.
+            spill_path (str): Optional SQLite database receiving the evicted threads.
+            spill_ttl (float): Seconds a spilled thread is kept in the database.
+            **kwargs: Passed to InMemorySaver (e.g. serde).
+        """
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        # The latest checkpoint and its parent are needed to resume a run
+        self.max_checkpoints = max(2, max_checkpoints)
+        self.spill_ttl = spill_ttl
+        self.evictions = 0
+        self.spilled = 0
+        self.reloaded = 0
+        self.trimmed = 0
+        self._last_used: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.RLock()
+        self._db: Optional[sqlite3.Connection] = None
+        if spill_path:
+            self._db = sqlite3.connect(spill_path, check_same_thread=False, timeout=30)
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS checkpoints (thread_id TEXT NOT NULL, '
+                                 'checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_id TEXT, '
+                                 'checkpoint_type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB, '
+                                 'spilled_at REAL NOT NULL, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))')
+                self._db.execute('CREATE TABLE IF NOT EXISTS writes (thread_id TEXT NOT NULL, '
+                                 'checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, '
+                                 'idx INTEGER NOT NULL, channel TEXT NOT NULL, value_type TEXT, value BLOB, '
+                                 'task_path TEXT, PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))')
+
+    # region CHECKPOINTER
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            # Unknown threads are not looked up in the storage, which would create an empty entry for them
+            if not self._use(config['configurable']['thread_id']):
+                return None
+            return super().get_tuple(config)
+
+    def list(self, config: Optional[RunnableConfig], **kwargs) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config is not None and not self._use(config['configurable']['thread_id']):
+                return iter(())
+            # Materialized under the lock, the storage may change as soon as it is released
+            return iter(list(super().list(config, **kwargs)))
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config['configurable']['thread_id']
+        with self._lock:
+            self._use(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            self._touch(thread_id)
+            self._trim(thread_id, config['configurable']['checkpoint_ns'])
+            self._evict()
+            return result
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = '') -> None:
+        thread_id = config['configurable']['thread_id']
+        with self._lock:
+            self._use(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+            self._touch(thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Forget a thread, in memory and in the spill database."""
+        with self._lock:
+            self._drop(thread_id)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('DELETE FROM checkpoints WHERE thread_id = ?', (thread_id,))
+                    self._db.execute('DELETE FROM writes WHERE thread_id = ?', (thread_id,))
+    # endregion
+
+    # region EVICTION
+    def _use(self, thread_id: str) -> bool:
+        """Mark a thread as used, reloading it from the spill database if needed. Return whether it exists."""
+        if thread_id not in self.storage and not self._reload(thread_id):
+            return False
+        self._touch(thread_id)
+        return True
+
+    def _touch(self, thread_id: str) -> None:
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+
+    def _trim(self, thread_id: str, checkpoint_ns: str) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.max_checkpoints:
+            return
+        # Checkpoint IDs sort in creation order
+        for checkpoint_id in sorted(checkpoints)[:-self.max_checkpoints]:
+            _, _, parent_id = checkpoints.pop(checkpoint_id)
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            self.writes.pop((thread_id, checkpoint_ns, parent_id), None)
+            self.trimmed += 1
+
+    def _evict(self) -> None:
+        expired = time.monotonic() - self.idle_ttl
+        while self._last_used:
+            thread_id, last_used = next(iter(self._last_used.items()))
+            if len(self._last_used) <= self.max_threads and last_used > expired:
+                break
+            if self._db is not None:
+                self._spill(thread_id)
+            self._drop(thread_id)
+            self.evictions += 1
+
+    def _drop(self, thread_id: str) -> None:
+        self._last_used.pop(thread_id, None)
+        for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id, (_, _, parent_id) in checkpoints.items():
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+                self.writes.pop((thread_id, checkpoint_ns, parent_id), None)
+    # endregion
+
+    # region SPILL
+    def _spill(self, thread_id: str) -> None:
+        now = time.time()
+        checkpoint_rows, write_rows = [], []
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            for checkpoint_id, (checkpoint, metadata, parent_id) in checkpoints.items():
+                checkpoint_rows.append((thread_id, checkpoint_ns, checkpoint_id, parent_id, checkpoint[0],
+                                        checkpoint[1], metadata[0], metadata[1], now))
+                for (task_id, idx), (_, channel, value, task_path) in \
+                        self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {}).items():
+                    write_rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel,
+                                       value[0], value[1], task_path))
+        if not checkpoint_rows:
+            return
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 checkpoint_rows)
+            self._db.executemany('INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', write_rows)
+            # Threads not reloaded within the spill TTL are forgotten
+            stale = [row[0] for row in self._db.execute(
+                'SELECT DISTINCT thread_id FROM checkpoints WHERE spilled_at < ?', (now - self.spill_ttl,))]
+            self._db.executemany('DELETE FROM checkpoints WHERE thread_id = ?', [(stale_id,) for stale_id in stale])
+            self._db.executemany('DELETE FROM writes WHERE thread_id = ?', [(stale_id,) for stale_id in stale])
+        self.spilled += 1
+
+    def _reload(self, thread_id: str) -> bool:
+        if self._db is None:
+            return False
+        rows = self._db.execute('SELECT checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, '
+                                'metadata_type, metadata FROM checkpoints WHERE thread_id = ?', (thread_id,)).fetchall()
+        if not rows:
+            return False
+        for checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata in rows:
+            self.storage[thread_id][checkpoint_ns][checkpoint_id] = (
+                (checkpoint_type, checkpoint), (metadata_type, metadata), parent_id)
+        for checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path in self._db.execute(
+                'SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, value, task_path '
+                'FROM writes WHERE thread_id = ?', (thread_id,)):
+            self.writes.setdefault((thread_id, checkpoint_ns, checkpoint_id), {})[(task_id, idx)] = (
+                task_id, channel, (value_type, value), task_path)
+        with self._db:
+            self._db.execute('DELETE FROM checkpoints WHERE thread_id = ?', (thread_id,))
+            self._db.execute('DELETE FROM writes WHERE thread_id = ?', (thread_id,))
+        self.reloaded += 1
+        return True
+    # endregion
+
+    def stats(self) -> Dict:
+        """Threads, checkpoints and serialized bytes held in memory, and the eviction counters."""
+        with self._lock:
+            checkpoints = 0
+            size = 0
+            for namespaces in self.storage.values():
+                for entries in namespaces.values():
+                    checkpoints += len(entries)
+                    size += sum(len(checkpoint[1] or b'') + len(metadata[1] or b'')
+                                for checkpoint, metadata, _ in entries.values())
+            size += sum(len(value[1] or b'') for writes in self.writes.values() for _, _, value, _ in writes.values())
+            stats = {
+                'threads': len(self.storage),
+                'checkpoints': checkpoints,
+                'bytes': size,
+                'evictions': self.evictions,
+                'trimmed_checkpoints': self.trimmed,
+                'spilled': self.spilled,
+                'reloaded': self.reloaded
+            }
+            if self._db is not None:
+                stats['spilled_threads'] = self._db.execute(
+                    'SELECT COUNT(DISTINCT thread_id) FROM checkpoints').fetchone()[0]
+            return stats
@@ -0,0 +1,288 @@
+import re
+import threading
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.gmail_api import GmailError
+
+# Closest label color of the Gmail palette for the color names users type
+COLORS = {
+    'black': '#000000', 'grey': '#999999', 'gray': '#999999', 'white': '#ffffff', 'red': '#fb4c2f',
+    'orange': '#ffad47', 'yellow': '#fad165', 'green': '#16a766', 'teal': '#43d692', 'blue': '#4a86e8',
+    'purple': '#a479e2', 'pink': '#f691b3', 'brown': '#a46a21'
+}
+# Text color of a label given a background color only
+DEFAULT_TEXT_COLOR = '#000000'
+
+_NAME = r'(?P<name>"[^"]+"|\'[^\']+\'|.+?)'
+_COLOR = r'(?P<color>#[0-9a-fA-F]{6}|[a-zA-Z]+)'
+_LIST = r'(?:list|show|display|get|see)(?: me)?(?: all)?(?: of)?(?: my| the)?'
+
+# Intent, tool and full match pattern of every command, tried in order
+PATTERNS = [
+    ('list_labels', 'list_labels', rf'{_LIST} labels|what labels do i have|my labels'),
+    ('list_filters', 'list_filters', rf'{_LIST} filters|what filters do i have|my filters'),
+    ('search_messages', 'search_messages',
+     rf'(?:{_LIST}|find|search(?: for)?)(?: the)? (?:emails|mails|messages) from (?P<sender>[\w.@+-]+)'),
+    ('create_label', 'create_label',
+     rf'(?:create|add|make)(?: a)?(?: new)? label(?: called| named)? {_NAME}'
+     rf'(?: (?:in|colou?red|with(?: the)?(?: background)? colou?r)(?: colou?r)? {_COLOR})?'),
+    ('delete_label', 'delete_label', rf'(?:delete|remove)(?: the)? label(?: called| named)? {_NAME}'),
+    ('rename_label', 'update_label', rf'rename(?: the)? label {_NAME} (?:to|as) (?P<new_name>.+)'),
+    ('color_label', 'update_label', rf'(?:colou?r|paint)(?: the)? label {_NAME}(?: in)? {_COLOR}'),
+    ('color_label', 'update_label', rf'change the colou?r of(?: the)? label {_NAME} to {_COLOR}'),
+]
+
+# Prefixes and suffixes that do not change a command
+_POLITE = re.compile(r'^(?:(?:please|can you|could you|would you|kindly)\s+)+|\s+please$', re.IGNORECASE)
+_YES = re.compile(r'(?:yes|y|yep|yeah|sure|ok|okay|confirm(?:ed)?|do it|go ahead|please do)', re.IGNORECASE)
+_NO = re.compile(r'(?:no|n|nope|cancel|stop|don\'t|do not|never ?mind)', re.IGNORECASE)
+
+# Replies of the commands, filled with the slots of the command; a failed tool call is answered with its result
+REPLIES = {
+    'create_label': 'Label **{label}** created.',
+    'delete_label': 'Label **{label}** deleted.',
+    'rename_label': 'Label **{label}** renamed to **{new_name}**.',
+    'color_label': 'Label **{label}** is now {color}.'
+}
+QUESTIONS = {
+    'create_label': 'Create the label **{label}**{color_suffix}?',
+    'delete_label': 'Delete the label **{label}**? Its messages are kept, without the label.',
+    'rename_label': 'Rename the label **{label}** to **{new_name}**?',
+    'color_label': 'Color the label **{label}** {color}?'
+}
+CONFIRMATION_HINT = ' Reply **yes** to confirm or **no** to cancel.'
+# Prefix of the IDs of the messages and tool calls made by the router, see is_routed
+ID_PREFIX = 'fast_'
+
+
+@dataclass
+class Command:
+    """A request recognized by the router, and the tool call answering it."""
+    intent: str
+    tool: str
+    args: Dict
+    slots: Dict
+
+    @property
+    def changes_data(self) -> bool:
+        return self.intent in QUESTIONS
+
+
+class IntentRouter:
+    """
+    Answers the trivial commands, such as "list my labels" or "delete label Foo", without the LLM.
+
+    A message is routed only when the whole of it matches one of the PATTERNS and its slots
+    resolve without doubt (the label exists, the color is known). The command then runs its
+    GmailToolkit tool and its reply is rendered from a template. Anything else, and any failure,
+    falls back to the LLM.
+
+    Following the system prompt, commands changing data are not run at once: the router asks
+    for a confirmation, keeps the command as the pending action of the thread, and runs it on the
+    next message if that is a yes. Any other message drops the pending action.
+
+    The tool calls are added to the history like the ones of the LLM, so later turns see them.
+    """
+
+    def __init__(self, toolkit):
+        """
+        Initializes the IntentRouter object.
+
+        Args:
+            toolkit (GmailToolkit): The toolkit of the agent, used to resolve label names.
+        """
+        self.toolkit = toolkit
+        self.patterns = [(intent, tool, re.compile(pattern, re.IGNORECASE)) for intent, tool, pattern in PATTERNS]
+        self._counts = {'messages': 0, 'fast_path': 0, 'confirmed': 0, 'cancelled': 0}
+        self._intents: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def handle(self, text: str, pending_action: Optional[Dict], call_tool: Callable[[Dict], ToolMessage]) -> Optional[Dict]:
+        """
+        Answer a user message without the LLM if possible.
+
+        Args:
+            text (str): The user message.
+            pending_action (Dict): The command waiting for a confirmation, if any.
+            call_tool (Callable[[Dict], ToolMessage]): Runs a tool call, e.g. Agent.call_tool.
+
+        Returns:
+            The state update answering the message (messages and pending action), or None if the
+            LLM must answer it.
+        """
+        text = _POLITE.sub('', text.strip().rstrip('.!?').strip())
+        if pending_action is not None:
+            if _YES.fullmatch(text):
+                self._count('confirmed', pending_action['intent'])
+                return {'messages': self.run(Command(**pending_action), call_tool), 'pending_action': None}
+            if _NO.fullmatch(text):
+                self._count('cancelled', pending_action['intent'])
+                return {'messages': [_reply('Cancelled, nothing was changed.')], 'pending_action': None}
+
+        command = self.parse(text)
+        if command is None:
+            self._count(None)
+            return None
+        self._count('fast_path', command.intent)
+        if command.changes_data:
+            question = QUESTIONS[command.intent].format(**command.slots) + CONFIRMATION_HINT
+            return {'messages': [_reply(question)], 'pending_action': asdict(command)}
+        return {'messages': self.run(command, call_tool), 'pending_action': None}
+
+    def parse(self, text: str) -> Optional[Command]:
+        """The command of a message, None if no pattern matches it or its slots are uncertain."""
+        for intent, tool, pattern in self.patterns:
+            match = pattern.fullmatch(text)
+            if match is not None:
+                values = {key: value for key, value in match.groupdict().items() if value}
+                try:
+                    return getattr(self, f'_{intent}')(intent, tool, values)
+                except LookupError:
+                    return None
+        return None
+
+    def run(self, command: Command, call_tool: Callable[[Dict], ToolMessage]) -> List:
+        """Run the tool call of a command, return the messages of the call, its result and the reply."""
+        tool_call = {'name': command.tool, 'args': command.args, 'id': f'{ID_PREFIX}{uuid.uuid4().hex[:12]}'}
+        result = call_tool(tool_call)
+        return [_reply('', tool_calls=[tool_call]), result, _reply(self.render(command, result.content))]
+
+    @staticmethod
+    def render(command: Command, result: str) -> str:
+        """The reply to a command given the result of its tool."""
+        if command.intent in REPLIES:
+            if 'could not' in result or result.startswith('Error'):
+                return result
+            return REPLIES[command.intent].format(**command.slots)
+        return markdown_table(result)
+
+    def stats(self) -> Dict:
+        """Messages seen, the ones answered without the LLM (the fast path), and the commands by intent."""
+        with self._lock:
+            stats = dict(self._counts, by_intent=dict(self._intents))
+        answered = stats['fast_path'] + stats['confirmed'] + stats['cancelled']
+        stats['hit_rate'] = answered / stats['messages'] if stats['messages'] else 0.0
+        return stats
+
+    def _count(self, outcome: Optional[str], intent: Optional[str] = None) -> None:
+        with self._lock:
+            self._counts['messages'] += 1
+            if outcome is not None:
+                self._counts[outcome] += 1
+            if outcome == 'fast_path':
+                self._intents[intent] = self._intents.get(intent, 0) + 1
+
+    # region SLOTS
+    # Every intent builds its command from the matched slots, raising LookupError when a slot is uncertain
+    def _list_labels(self, intent: str, tool: str, values: Dict) -> Command:
+        return Command(intent, tool, {}, {})
+
+    def _list_filters(self, intent: str, tool: str, values: Dict) -> Command:
+        return Command(intent, tool, {}, {})
+
+    def _search_messages(self, intent: str, tool: str, values: Dict) -> Command:
+        return Command(intent, tool, {'query': f"from:{values['sender']}"}, {})
+
+    def _create_label(self, intent: str, tool: str, values: Dict) -> Command:
+        name = _unquote(values['name'])
+        label_content = {'name': name}
+        slots = {'label': name, 'color_suffix': ''}
+        if values.get('color'):
+            color = _color(values['color'])
+            label_content['color'] = {'backgroundColor': color, 'textColor': DEFAULT_TEXT_COLOR}
+            slots['color_suffix'] = f" in {values['color'].lower()}"
+        return Command(intent, tool, {'label_content': label_content}, slots)
+
+    def _delete_label(self, intent: str, tool: str, values: Dict) -> Command:
+        label = self._user_label(values['name'])
+        return Command(intent, tool, {'label_id': label['id']}, {'label': label['name']})
+
+    def _rename_label(self, intent: str, tool: str, values: Dict) -> Command:
+        label = self._user_label(values['name'])
+        new_name = _unquote(values['new_name'])
+        return Command(intent, tool, {'label_id': label['id'], 'label_content': {'name': new_name}},
+                       {'label': label['name'], 'new_name': new_name})
+
+    def _color_label(self, intent: str, tool: str, values: Dict) -> Command:
+        label = self._user_label(values['name'])
+        color = _color(values['color'])
+        return Command(intent, tool, {'label_id': label['id'], 'label_content': {
+            'color': {'backgroundColor': color, 'textColor': DEFAULT_TEXT_COLOR}}},
+                       {'label': label['name'], 'color': values['color'].lower()})
+
+    def _user_label(self, name: str) -> Dict:
+        """The user label with this name (case insensitive); system labels cannot be changed."""
+        labels = self.toolkit.gmail_api.list_labels()
+        if isinstance(labels, GmailError):
+            raise LookupError(str(labels))
+        name = _unquote(name).casefold()
+        matches = [label for label in labels if label['name'].casefold() == name and label.get('type') != 'system']
+        if len(matches) != 1:
+            raise LookupError(name)
+        return matches[0]
+    # endregion
+
+
+def is_routed(message) -> bool:
+    """
+    Whether a message was written by the router rather than by the model. The router returns its
+    messages at once, so a streaming client must show them from the node update, not token by token.
+    """
+    return (message.id or '').startswith(ID_PREFIX)
+
+
+def _reply(content: str, **kwargs) -> AIMessage:
+    return AIMessage(content=content, id=f'{ID_PREFIX}{uuid.uuid4().hex[:12]}', **kwargs)
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+
+def _color(value: str) -> str:
+    """The palette color of a color name or hex code; unknown names are uncertain, e.g. "Made in Italy"."""
+    if value.startswith('#'):
+        return value.lower()
+    try:
+        return COLORS[value.lower()]
+    except KeyError:
+        raise LookupError(value) from None
+
+
+def markdown_table(result: str) -> str:
+    """
+    Render a listing of the tools (see format_table) as a markdown table, without the ID column.
+    Lines before the table, such as the count of a search, are kept. Other results, such as errors
+    and empty listings, are returned as they are.
+    """
+    lines = result.split('\n')
+    for position, line in enumerate(lines):
+        header = re.fullmatch(r'(.+?) (\d+)-(\d+) of (\d+) \((.+)\)', line)
+        if header is not None:
+            break
+    else:
+        return result
+    title, _, end, total, columns = header.groups()
+    columns = re.split(r'(?<!\\)\|', columns)
+    kept = [index for index, column in enumerate(columns) if column != 'id']
+    table = lines[:position] + [''] * bool(position) + [f"**{title}** ({total})", '',
+                                '| ' + ' | '.join(columns[index].capitalize() for index in kept) + ' |',
+                                '|' + '---|' * len(kept)]
+    for line in lines[position + 1:]:
+        if line.startswith('[') and line.endswith(']'):
+            continue
+        cells = re.split(r'(?<!\\)\|', line)
+        table.append('| ' + ' | '.join(cells[index] if index < len(cells) else '' for index in kept) + ' |')
+    if int(end) < int(total):
+        table.append(f"\n{int(total) - int(end)} more, ask to see the next ones.")
+    return '\n'.join(table)
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from langchain_core.messages import AIMessage, BaseMessage
+
+
+class ResponseCache:
+    """
+    Cache of model responses keyed on everything the model sees: the system prompt, the tool
+    schemas and the messages.
+
+    Keys are normalized before hashing (whitespace, tool call IDs), so a conversation that is
+    replayed identically, such as the greeting sent on every page load, maps to the same key.
+    Entries live in an in-memory LRU with a TTL, optionally backed by SQLite so they survive
+    restarts and are shared between worker processes.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0, sqlite_path: Optional[str] = None):
+        """
+        Initializes the ResponseCache object.
+
+        Args:
+            max_entries (int): Maximum number of responses kept in memory.
+            ttl (float): Seconds a response is served from the cache.
+            sqlite_path (str): Optional SQLite database backing the in-memory entries.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=30)
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS responses '
+                                 '(key TEXT PRIMARY KEY, created REAL NOT NULL, message TEXT NOT NULL)')
+
+    # region KEYS
+    @staticmethod
+    def key(system: str, tool_schemas: Iterable[Dict], messages: List['BaseMessage']) -> str:
+        """Return the normalized hash of a model call."""
+        call_ids: Dict[str, int] = {}
+        normalized = []
+        for message in messages:
+            entry = {'type': message.type, 'content': _normalize_text(message.content)}
+            for tool_call in getattr(message, 'tool_calls', None) or []:
+                # Tool call IDs are random, replace them with their position in the conversation
+                call_ids.setdefault(tool_call.get('id'), len(call_ids))
+                entry.setdefault('tool_calls', []).append({'name': tool_call['name'], 'args': tool_call['args']})
+            if getattr(message, 'tool_call_id', None) is not None:
+                entry['tool_call'] = call_ids.get(message.tool_call_id, -1)
+            normalized.append(entry)
+        payload = {
+            'system': _normalize_text(system),
+            'tools': sorted(json.dumps(schema, sort_keys=True) for schema in tool_schemas),
+            'messages': normalized
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    # endregion
+
+    # region STORE
+    def get(self, key: str) -> Optional['AIMessage']:
+        """Return a copy of the cached response, or None on a miss or an expired entry."""
+        from langchain_core.messages import messages_from_dict
+        
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None and self._db is not None:
+                row = self._db.execute('SELECT created, message FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None and now - row[0] < self.ttl:
+                    entry = (row[0], json.loads(row[1]))
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        message = messages_from_dict([entry[1]])[0]
+        # Every served copy is a new message of the conversation
+        message.id = f'run-{uuid.uuid4()}'
+        return message
+
+    def put(self, key: str, message: 'BaseMessage') -> None:
+        """Cache a response."""
+        from langchain_core.messages import message_to_dict
+        
+        entry = (time.time(), message_to_dict(message))
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('INSERT OR REPLACE INTO responses (key, created, message) VALUES (?, ?, ?)',
+                                     (key, entry[0], json.dumps(entry[1])))
+                    self._db.execute('DELETE FROM responses WHERE created < ?', (entry[0] - self.ttl,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('DELETE FROM responses')
+
+    def stats(self) -> Dict:
+        """Hit and miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries)
+            }
+
+    def _remember(self, key: str, entry: Tuple[float, Dict]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    # endregion
+
+
+def _normalize_text(content) -> str:
+    if isinstance(content, list):
+        content = ''.join(part if isinstance(part, str) else part.get('text', '') for part in content)
+    return re.sub(r'\s+', ' ', str(content or '')).strip()
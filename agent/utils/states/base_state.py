@@ -7,5 +7,7 @@ class AgentState(TypedDict):
     """
     Messages history of the agent. The Annotation operator.add is used to concatenate the list of messages.
     withouth the annotation, the list of messages would be replaced by the new list of messages.
+    The pending action is a command of the intent router waiting for the user's confirmation, it is replaced.
     """
-    messages: Annotated[list[AnyMessage], operator.add]
\ No newline at end of file
+    messages: Annotated[list[AnyMessage], operator.add]
+    pending_action: Optional[Dict]
\ No newline at end of file
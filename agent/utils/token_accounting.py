@@ -0,0 +1,171 @@
+import json
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from agent.utils.tools.result_format import estimate_tokens
+
+COMPONENTS = ('system', 'tools', 'history', 'tool_results')
+
+
+class TokenAccountant:
+    """
+    Records the tokens of every model call, broken down by what the prompt is made of: the system
+    prompt, the tool schemas, the conversation history and the tool results it contains.
+
+    The breakdown is estimated from the text of each part, and scaled to the input tokens reported
+    by the model when it reports them. Totals are kept per thread (the most recent `max_threads`),
+    per tool (the results of a tool count every time they are sent again) and overall.
+    """
+
+    def __init__(self, max_threads: int = 1000):
+        """
+        Initializes the TokenAccountant object.
+
+        Args:
+            max_threads (int): Number of threads whose totals are kept, the least recent are dropped.
+        """
+        self.max_threads = max_threads
+        self.calls = 0
+        self.cached_calls = 0
+        self.totals: Counter = Counter()
+        self.tool_results: Counter = Counter()
+        self.threads: 'OrderedDict[str, Counter]' = OrderedDict()
+        self.schema_sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    # region RECORDING
+    @staticmethod
+    def breakdown(system: str, tool_schemas: Sequence[Dict], messages: List) -> Tuple[Counter, Counter]:
+        """
+        Estimate the tokens of every part of a prompt.
+
+        Returns:
+            The tokens by component, and the tokens of the tool results by tool name.
+        """
+        parts = Counter(system=estimate_tokens(system or ''),
+                        tools=sum(estimate_tokens(json.dumps(schema)) for schema in tool_schemas))
+        per_tool = Counter()
+        for message in messages:
+            text = _content_text(message.content)
+            if message.type == 'tool':
+                tokens = estimate_tokens(text)
+                parts['tool_results'] += tokens
+                per_tool[getattr(message, 'name', None) or 'unknown'] += tokens
+            else:
+                calls = getattr(message, 'tool_calls', None)
+                parts['history'] += estimate_tokens(text) + (estimate_tokens(json.dumps(calls, default=str)) if calls else 0)
+        return parts, per_tool
+
+    def record(self, thread_id: Optional[str], system: str, tool_schemas: Sequence[Dict], messages: List,
+               response=None, cached: bool = False) -> Dict:
+        """
+        Record a model call.
+
+        Args:
+            thread_id (str): The conversation thread of the call.
+            system (str): The system prompt sent.
+            tool_schemas (Sequence[Dict]): The tool schemas sent.
+            messages (List): The conversation messages sent (without the system message).
+            response: The AIMessage returned, its usage metadata gives the actual token counts.
+            cached (bool): Whether the response was served from the response cache (no tokens spent).
+
+        Returns:
+            The tokens of the call: input, output and input by component.
+        """
+        parts, per_tool = self.breakdown(system, tool_schemas, messages)
+        estimated = sum(parts.values())
+        usage = getattr(response, 'usage_metadata', None) or {}
+        input_tokens = usage.get('input_tokens') or estimated
+        output_tokens = usage.get('output_tokens')
+        if output_tokens is None and response is not None:
+            output_tokens = estimate_tokens(_content_text(response.content))
+        # The estimates only give the shares of the components, the total is the one reported by the model
+        scale = input_tokens / estimated if estimated else 0.0
+        call = Counter({component: round(parts[component] * scale) for component in COMPONENTS})
+        call['input'] = input_tokens
+        call['output'] = output_tokens or 0
+        if cached:
+            call = Counter({key: 0 for key in call})
+
+        with self._lock:
+            self.calls += 1
+            self.cached_calls += cached
+            if not cached:
+                self.totals.update(call)
+                self.tool_results.update({name: round(tokens * scale) for name, tokens in per_tool.items()})
+            if thread_id is not None:
+                thread = self.threads.pop(thread_id, Counter())
+                thread.update(call)
+                thread['calls'] += 1
+                self.threads[thread_id] = thread
+                while len(self.threads) > self.max_threads:
+                    self.threads.popitem(last=False)
+            if not self.schema_sizes:
+                self.schema_sizes = {schema.get('function', {}).get('name', '?'): estimate_tokens(json.dumps(schema))
+                                     for schema in tool_schemas}
+        return dict(call)
+    # endregion
+
+    def report(self, top: int = 10) -> Dict:
+        """The totals, and the top consumers: threads, tool results and tool schemas."""
+        with self._lock:
+            input_tokens = self.totals['input']
+            return {
+                'calls': self.calls,
+                'cached_calls': self.cached_calls,
+                'input_tokens': input_tokens,
+                'output_tokens': self.totals['output'],
+                'input_by_component': {
+                    component: {'tokens': self.totals[component],
+                                'share': self.totals[component] / input_tokens if input_tokens else 0.0}
+                    for component in COMPONENTS
+                },
+                'top_threads': [
+                    {'thread_id': thread_id, 'input_tokens': totals['input'], 'output_tokens': totals['output'],
+                     'calls': totals['calls']}
+                    for thread_id, totals in sorted(self.threads.items(), key=lambda item: -item[1]['input'])[:top]
+                ],
+                'top_tool_results': [{'tool': name, 'tokens': tokens}
+                                     for name, tokens in self.tool_results.most_common(top)],
+                'largest_tool_schemas': [{'tool': name, 'tokens': tokens}
+                                         for name, tokens in Counter(self.schema_sizes).most_common(top)]
+            }
+
+
+def compact_tool_descriptions(tools: List, min_length: int = 200) -> str:
+    """
+    Factor the long lines repeated in several tool descriptions (e.g. the list of label colors)
+    out of the descriptions, in place, so they are sent once instead of once per tool.
+
+    A repeated line `- Available colors are: #000000, ...` becomes `- Available colors are: see [R1]`
+    in every description, and the returned text, to add to the system prompt, lists `[R1] #000000, ...`.
+
+    Args:
+        tools (List): The LangChain tools, their descriptions are modified.
+        min_length (int): Minimum length of a line to be factored out.
+
+    Returns:
+        The reference section for the system prompt, empty if nothing was factored out.
+    """
+    counts = Counter(line.strip() for tool in tools for line in set(tool.description.splitlines())
+                     if len(line.strip()) >= min_length)
+    references = []
+    for line, count in counts.items():
+        if count < 2:
+            continue
+        name = f"[R{len(references) + 1}]"
+        label, separator, value = line.partition(': ')
+        replacement = f"{label}: see {name}" if separator else f"see {name}"
+        references.append(f"{name} {value if separator else line}")
+        for tool in tools:
+            tool.description = tool.description.replace(line, replacement)
+    if not references:
+        return ""
+    return "Reference lists used by the tool descriptions:\n" + "\n".join(references)
+
+
+def _content_text(content) -> str:
+    if isinstance(content, list):
+        return ''.join(part if isinstance(part, str) else part.get('text', '') for part in content)
+    return str(content or '')
@@ -1,15 +1,58 @@
 from langchain_core.tools.convert import tool
-from typing import Dict, Union, List, Optional
+from langgraph.config import get_stream_writer
+from typing import Dict, Union, List, Optional, Set, Tuple
+import json
+import threading
+import time
 
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from gmail_api.gmail_api import GmailAPI
+from gmail_api.gmail_api import GmailAPI, GmailError
+from gmail_api.client_pool import DEFAULT_ACCOUNT, GmailClientPool, current_account
+from gmail_api.filter_matcher import FilterMatcher, MessageMetadata, MessageStore
+from gmail_api.mailbox_mirror import MailboxMirror
+from gmail_api.search_index import SearchIndex, UnsupportedQueryError
+from gmail_api.label_classifier import LabelClassifier, criteria_from_features
+from gmail_api.search_query import criteria_to_query
+from gmail_api.mailbox_config import MailboxConfig
+from agent.utils.tools.result_format import format_table, page
+from agent.utils.tools.tool_scheduler import EVERYTHING
+
+class _LocalMail:
+    """The local copy of an account's mail used by the preview, search and suggestion tools."""
+    
+    def __init__(self, gmail_api: GmailAPI, mirror: Optional[MailboxMirror]):
+        self.gmail_api = gmail_api
+        self.mirror = mirror
+        self.matcher: Optional[FilterMatcher] = None
+        self.index: Optional[SearchIndex] = None
+        self.lock = threading.Lock()
+
+
+def _stream_writer():
+    """The writer of the graph's custom stream, a no-op when the tool is called outside of the graph."""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
+
 
 class GmailToolkit:
-    def __init__(self):
-        self.gmail_api = GmailAPI(credentials_path=os.getenv("GMAIL_CREDENTIALS_PATH"), token_path=os.getenv("GMAIL_TOKEN_PATH"))
-        self.gmail_api() #Initialize API
+    def __init__(self, pool: Optional[GmailClientPool] = None, result_token_budget: Optional[int] = None):
+        # One client per account, the tools use the account bound to the current thread with use_account
+        if pool is None:
+            pool = GmailClientPool(credentials_path=os.getenv("GMAIL_CREDENTIALS_PATH"),
+                                   token_path=os.getenv("GMAIL_TOKEN_PATH"),
+                                   token_directory=os.getenv("GMAIL_TOKEN_DIR"))
+        self.pool = pool
+        # Approximate maximum number of tokens of a listing, longer ones are cut and continued with a cursor
+        self.result_token_budget = result_token_budget or int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", "2000"))
+        # The clients authenticate on first use, so building the toolkit does not block on the OAuth flow
+        self.mirror_path = os.getenv("GMAIL_MIRROR_PATH")
+        # Local mail of every account, dropped once the pool has evicted the account's client
+        self._local_mail: Dict[str, _LocalMail] = {}
+        self._local_mail_lock = threading.Lock()
         
         self._tools = [
             self.list_labels,
@@ -19,39 +62,138 @@ class GmailToolkit:
             self.list_filters,
             self.create_filter,
             self.delete_filter,
-            self.update_filter
+            self.update_filter,
+            self.apply_filter_to_existing_mail,
+            self.preview_filter,
+            self.search_messages,
+            self.suggest_labels,
+            self.create_labels,
+            self.update_labels,
+            self.delete_labels,
+            self.create_filters,
+            self.delete_filters,
+            self.export_mailbox_config,
+            self.apply_mailbox_config
         ]
 
     def get_tools(self):
         """Return the list of tools."""
         return [tool()(t.__get__(self, self.__class__)) for t in self._tools]
-
-    def list_labels(self) -> str:
+    
+    @property
+    def gmail_api(self) -> GmailAPI:
+        """The client of the account bound to the current thread."""
+        return self.pool.get()
+    
+    def _local(self) -> _LocalMail:
+        """The local mail of the account bound to the current thread."""
+        gmail_api = self.gmail_api
+        account = current_account.get()
+        with self._local_mail_lock:
+            local = self._local_mail.get(account)
+            if local is None or local.gmail_api is not gmail_api:
+                for evicted in [name for name in self._local_mail if name not in self.pool]:
+                    del self._local_mail[evicted]
+                mirror = None
+                if self.mirror_path:
+                    path = self.mirror_path
+                    if account != DEFAULT_ACCOUNT:
+                        # One database per account, e.g. mailbox.db -> mailbox.jane@example.com.db
+                        root, extension = os.path.splitext(self.mirror_path)
+                        path = f"{root}.{account}{extension}"
+                    mirror = MailboxMirror(gmail_api, path)
+                local = self._local_mail[account] = _LocalMail(gmail_api, mirror)
+            return local
+    
+    # region RESOURCE ACCESS
+    SYSTEM_LABEL_PREFIXES = ('INBOX', 'SPAM', 'TRASH', 'UNREAD', 'STARRED', 'IMPORTANT', 'SENT', 'DRAFT', 'CATEGORY_')
+    
+    def resource_access(self, name: str, args: Dict) -> Set[Tuple[str, str]]:
+        """
+        Return the Gmail resources a tool call reads ("r") and writes ("w"), used to decide which
+        tool calls of the same step can run concurrently (see ToolScheduler).
+        
+        Labels and filters are keyed by ID under "labels/" and "filters/". Objects that do not exist
+        yet are keyed under "labels/+new/" and "filters/+new/", so creations do not conflict with
+        each other but do conflict with a listing or with a filter that may use the new label.
         """
-        List all the labels in the user's gmail account.
+        if name == 'list_labels':
+            return {('labels', 'r')}
+        if name == 'create_label':
+            return {(f"labels/+new/{args['label_content'].get('name')}", 'w')}
+        if name in ('update_label', 'delete_label'):
+            return {(f"labels/{args['label_id']}", 'w')}
+        if name == 'list_filters':
+            return {('filters', 'r'), ('labels', 'r')}
+        if name == 'create_filter':
+            return ({(f"filters/+new/{json.dumps(args['criteria'], sort_keys=True)}", 'w')}
+                    | self._label_reads(args.get('actions') or {}))
+        if name in ('update_filter', 'delete_filter'):
+            return {(f"filters/{args['filter_id']}", 'w')}
+        if name == 'apply_filter_to_existing_mail':
+            return {(f"filters/{args['filter_id']}", 'r'), ('labels', 'r'), ('messages', 'w')}
+        if name in ('preview_filter', 'search_messages', 'suggest_labels'):
+            return {('labels', 'r'), ('messages', 'r')}
+        if name == 'create_labels':
+            return {('labels/+new', 'w')}
+        if name == 'update_labels':
+            return {(f"labels/{update['label_id']}", 'w') for update in args['updates']}
+        if name == 'delete_labels':
+            return {(f"labels/{label_id}", 'w') for label_id in args['label_ids']}
+        if name == 'create_filters':
+            accesses = {('filters/+new', 'w')}
+            for filter_content in args['filters']:
+                accesses |= self._label_reads(filter_content.get('actions') or {})
+            return accesses
+        if name == 'delete_filters':
+            return {(f"filters/{filter_id}", 'w') for filter_id in args['filter_ids']}
+        if name == 'export_mailbox_config':
+            return {('labels', 'r'), ('filters', 'r')}
+        return EVERYTHING
+    
+    def _label_reads(self, actions: Dict) -> Set[Tuple[str, str]]:
+        """Labels read by a filter action, including any label being created in the same step."""
+        reads = set()
+        for key in ('addLabelIds', 'removeLabelIds'):
+            for label_id in GmailAPI._split_label_ids(actions.get(key)):
+                reads.add((f"labels/{label_id}", 'r'))
+                if not label_id.startswith(self.SYSTEM_LABEL_PREFIXES):
+                    reads.add(('labels/+new', 'r'))
+        return reads
+    # endregion
+
+    def list_labels(self, limit: int = 100, cursor: Optional[str] = None) -> str:
+        """List the labels in the user's gmail account, system labels first, then user labels by name.
         
+        Args:
+            limit (int): Maximum number of labels listed.
+            cursor (str): The cursor given at the end of the previous listing, to list the next labels.
+            
         Returns:
-            A list of dictionaries containing the label information.
-            {
-                "id": string,
-                "name": string,
-                "messageListVisibility": enum (MessageListVisibility),
-                "labelListVisibility": enum (LabelListVisibility),
-                "type": enum (Type),
-                "messagesTotal": integer,
-                "messagesUnread": integer,
-                "threadsTotal": integer,
-                "threadsUnread": integer,
-                "color": {
-                    object (Color)
-                }
-            }
+            A compact table with one label per line: id|name|type|color (background/text)|visibility.
+            Empty columns are left out. When labels are left, the last line gives the cursor of the next ones.
+            
+        Tips:
+            - Label IDs are needed by the other tools, label names are what the user knows.
         """
         labels = self.gmail_api.list_labels()
         
+        if isinstance(labels, GmailError):
+            return f"Labels could not be listed. {labels}"
         if not labels:
             return "No labels found."
-        return labels
+        labels = sorted(labels, key=lambda label: (label.get('type') != 'system', label['name'].casefold()))
+        offset, labels_page = page(labels, limit, cursor)
+        rows = []
+        for label in labels_page:
+            color = label.get('color') or {}
+            colors = '/'.join(filter(None, (color.get('backgroundColor'), color.get('textColor'))))
+            # Only the non default visibility settings
+            visibility = ','.join(value for value in (label.get('labelListVisibility'), label.get('messageListVisibility'))
+                                  if value not in (None, 'labelShow', 'show'))
+            rows.append([label['id'], label['name'], label.get('type'), colors, visibility])
+        return format_table("Labels", ["id", "name", "type", "color", "visibility"], rows, len(labels), offset,
+                            self.result_token_budget)
 
     def create_label(self, label_content: Dict) -> str:
         """Create a new label in the user's gmail account.
@@ -78,8 +220,8 @@ class GmailToolkit:
             - If the user provides one color, that one will be the background color and you should set the other color to the default value.
         """
         label = self.gmail_api.create_label(label_content)
-        if not label:
-            return "Label could not be created."
+        if isinstance(label, GmailError):
+            return f"Label could not be created. {label}"
         return f"Label {label['name']} created successfully."
 
     def delete_label(self, label_id: str) -> str:
@@ -96,11 +238,10 @@ class GmailToolkit:
             - After deleting the label, list labels to check that it has been correctly deleted.
 
         """
-        try:
-            self.gmail_api.delete_label(label_id)
-            return f"Label with ID {label_id} deleted successfully."
-        except Exception as error:
-            return f"An error occurred: {error}"
+        error = self.gmail_api.delete_label(label_id)
+        if error is not None:
+            return f"Label with ID {label_id} could not be deleted. {error}"
+        return f"Label with ID {label_id} deleted successfully."
 
     def update_label(self, label_id: str, label_content: Dict) -> str:
         """Update an existing label in the user's gmail account.
@@ -130,30 +271,54 @@ class GmailToolkit:
             - If the user does not provide the label_id you can find it by listing all labels and finding the label by name.
         """        
         label = self.gmail_api.update_label(label_id, label_content)
-        if not label:
-            return "Label could not be updated."
+        if isinstance(label, GmailError):
+            return f"Label could not be updated. {label}"
         return f"Label {label['name']} updated successfully."
 
-    def list_filters(self) -> str:
-        """List all the filters in the user's gmail account.
+    def list_filters(self, limit: int = 50, cursor: Optional[str] = None) -> str:
+        """List the filters in the user's gmail account.
         
+        Args:
+            limit (int): Maximum number of filters listed.
+            cursor (str): The cursor given at the end of the previous listing, to list the next filters.
+            
         Returns:
-            A list of dictionaries containing the filter information.
-            {
-                "id": string,
-                "criteria": {
-                    object (FilterCriteria)
-                },
-                "action": {
-                    object (FilterAction)
-                }
-            }
+            A compact table with one filter per line: id|criteria|actions.
+            The criteria are written as a Gmail search query, e.g. from:shop.com subject:invoice.
+            The actions use label names: +Name adds a label, -Name removes it, forward:address forwards.
+            When filters are left, the last line gives the cursor of the next ones.
             
         Formatting:
             - Display the filter criteria and actions in a human-readable format.
-            - The user does not know the Label IDs, so you should display the label names instead.
+            - The user does not know the Label IDs, display the label names.
         """
-        return self.gmail_api.list_filters()
+        filters = self.gmail_api.list_filters()
+        if isinstance(filters, GmailError):
+            return f"Filters could not be listed. {filters}"
+        if not filters:
+            return "No filters found."
+        label_names = self._label_names()
+        offset, filters_page = page(filters, limit, cursor)
+        rows = []
+        for gmail_filter in filters_page:
+            action = gmail_filter.get('action') or {}
+            # Label IDs may come back as a comma separated string, as they are sent (see normalize_filter_actions)
+            actions = [f"+{label_names.get(label_id, label_id)}"
+                       for label_id in GmailAPI._split_label_ids(action.get('addLabelIds'))]
+            actions += [f"-{label_names.get(label_id, label_id)}"
+                        for label_id in GmailAPI._split_label_ids(action.get('removeLabelIds'))]
+            if action.get('forward'):
+                actions.append(f"forward:{action['forward']}")
+            rows.append([gmail_filter['id'], criteria_to_query(gmail_filter.get('criteria') or {}), ' '.join(actions)])
+        return format_table("Filters", ["id", "criteria", "actions"], rows, len(filters), offset,
+                            self.result_token_budget)
+
+    def _label_names(self) -> Dict[str, str]:
+        """Names of the labels by ID, empty if they cannot be listed."""
+        labels = self.gmail_api.list_labels()
+        if isinstance(labels, GmailError):
+            return {}
+        return {label['id']: label['name'] for label in labels}
 
     def create_filter(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> str:
         """Create a new filter in the user's gmail account.
@@ -184,7 +349,10 @@ class GmailToolkit:
             actions['addLabelIds'] = ','.join(actions['addLabelIds'])
         if 'removeLabelIds' in actions and isinstance(actions['removeLabelIds'], list):
             actions['removeLabelIds'] = ','.join(actions['removeLabelIds'])
-        return self.gmail_api.create_filter(criteria, actions)
+        gmail_filter = self.gmail_api.create_filter(criteria, actions)
+        if isinstance(gmail_filter, GmailError):
+            return f"Filter could not be created. {gmail_filter}"
+        return gmail_filter
     
     def delete_filter(self, filter_id: str) -> str:
         """Delete a filter from the user's gmail account.
@@ -199,11 +367,10 @@ class GmailToolkit:
             - If the user does not provide the filter_id you can find it by listing all filters and finding the filter by criteria.
             - After deleting the filter, list filters to check that it has been correctly deleted.
         """
-        try:
-            self.gmail_api.delete_filter(filter_id)
-            return f"Filter with ID {filter_id} deleted successfully."
-        except Exception as error:
-            return f"An error occurred: {error}"
+        error = self.gmail_api.delete_filter(filter_id)
+        if error is not None:
+            return f"Filter with ID {filter_id} could not be deleted. {error}"
+        return f"Filter with ID {filter_id} deleted successfully."
         
     def update_filter(self, filter_id: str, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> str:
         """
@@ -225,3 +392,360 @@ class GmailToolkit:
             Updated filter resource if successful, None otherwise.
         """
         return "To update a filter you need to delete the existing filter and create a new one with the updated criteria and actions."
+
+    def apply_filter_to_existing_mail(self, filter_id: str) -> str:
+        """Apply the label actions of an existing filter to the mail already in the user's gmail account.
+        
+        Filters only affect new incoming mail. Use this tool when the user wants a filter to also
+        label, archive or otherwise classify the messages they already have.
+        
+        Args:
+            filter_id (str): The ID of the filter to apply.
+            
+        Returns:
+            A message with the number of matching and modified messages.
+            
+        Tips:
+            - If the user does not provide the filter_id you can find it by listing all filters and finding the filter by criteria.
+            - This can modify thousands of messages, so confirm with the user before calling it.
+            - Forwarding actions are never applied to existing mail.
+        """
+        gmail_filter = self.gmail_api.get_filter(filter_id)
+        if isinstance(gmail_filter, GmailError):
+            return f"Filter with ID {filter_id} could not be found. {gmail_filter}"
+        
+        # The progress goes to the "custom" stream of the graph, shown by the frontend as a tool event.
+        # The writer is taken here, the callback runs in the worker threads of apply_filter_to_existing
+        write = _stream_writer()
+        
+        def report(progress: Dict) -> None:
+            write({'tool': 'apply_filter_to_existing_mail',
+                   'progress': f"{progress['modified']} modified, {progress['failed']} failed "
+                               f"of {progress['matched']} matched"})
+        
+        result = self.gmail_api.apply_filter_to_existing(
+            gmail_filter.get('criteria', {}), gmail_filter.get('action', {}), progress_callback=report)
+        if isinstance(result, GmailError):
+            return f"The filter could not be applied to the existing mail. {result}"
+        summary = f"Filter applied to existing mail: {result['modified']} of {result['matched']} matching messages modified."
+        if result['failed']:
+            summary += f" {result['failed']} messages could not be modified."
+        return summary
+
+    # region LOCAL MAIL
+    PREVIEW_MESSAGES = 2000  # Number of recent messages the previews are evaluated against
+    PREVIEW_TTL = 600.0  # Seconds before the recent messages are fetched again
+
+    def preview_filter(self, criteria: Dict[str, str], sample_size: int = 5) -> str:
+        """Preview which of the user's recent messages a filter would catch, without creating it.
+        
+        Args:
+            criteria (Dict[str, str]): Filter criteria dictionary with the same keys as in create_filter.
+            sample_size (int): Number of matching messages to show.
+            
+        Returns:
+            The number of matching recent messages and a sample of them (date, sender and subject).
+            
+        Tips:
+            - Use this tool before create_filter to check that the criteria catch the intended messages.
+            - Compare several candidate criteria by calling it once per candidate; previews are cheap.
+            - Unless a local mirror of the mailbox is configured, the preview covers recent mail only.
+        """
+        matcher = self._preview_matcher()
+        if isinstance(matcher, GmailError):
+            return f"The filter could not be previewed. {matcher}"
+        
+        preview = matcher.preview(criteria, sample_size=sample_size)
+        summary = (f"The filter ({preview['query']}) matches {preview['matches']} of the "
+                   f"{preview['total']} messages checked.")
+        if preview['unsupported']:
+            summary += (" These operators cannot be checked locally: " + ", ".join(preview['unsupported'])
+                        + f"; {preview['uncertain']} more message(s) depending on them may also match.")
+        for message in preview['samples']:
+            date = time.strftime('%Y-%m-%d', time.localtime(message.date))
+            summary += f"\n- {date} | {message.sender} | {message.subject}"
+        return summary
+
+    def _preview_matcher(self) -> Union[FilterMatcher, GmailError]:
+        """Return the matcher over the recent messages, fetching them when missing or stale."""
+        local = self._local()
+        with local.lock:
+            if local.matcher is not None and time.monotonic() - local.matcher.store.loaded_at < self.PREVIEW_TTL:
+                return local.matcher
+            if local.mirror is not None:
+                # The local mirror is kept up to date with a couple of history calls
+                synced = local.mirror.sync()
+                if isinstance(synced, GmailError):
+                    return synced
+                store = local.mirror.load_store()
+            else:
+                messages = self.gmail_api.fetch_message_metadata(max_messages=self.PREVIEW_MESSAGES)
+                if isinstance(messages, GmailError):
+                    return messages
+                store = MessageStore(MessageMetadata.from_gmail(message) for message in messages)
+            labels = self.gmail_api.list_labels()
+            if not isinstance(labels, GmailError):
+                store.set_labels(labels)
+            local.matcher = FilterMatcher(store)
+            return local.matcher
+
+    def search_messages(self, query: str, max_results: int = 10, cursor: Optional[str] = None) -> str:
+        """Count and list the user's messages matching a Gmail search query, answered from a local index.
+        
+        Args:
+            query (str): Gmail search query. Supported operators: from:, to:, cc:, subject:, label:, in:, is:,
+                category:, after:, before:, older_than:, newer_than:, free words, quoted phrases, -, OR, {} and ().
+            max_results (int): Number of matching messages to list, newest first.
+            cursor (str): The cursor given at the end of the previous listing, to list the next messages.
+            
+        Returns:
+            The number of matching messages and a compact table of the newest ones: date|sender|subject|labels.
+            
+        Tips:
+            - Use this tool to answer questions such as "how many mails from newsletters@ did I get last month".
+            - from:newsletters@ matches the local part of the address, from:@shop.com or from:shop.com the domain.
+            - Unless a local mirror of the mailbox is configured, only recent mail is searched.
+        """
+        index = self._search_index()
+        if isinstance(index, GmailError):
+            return f"The messages could not be searched. {index}"
+        
+        offset, _ = page((), max_results, cursor)
+        try:
+            count, messages = index.search(query, limit=max(1, max_results), offset=offset)
+        except UnsupportedQueryError as error:
+            return f"The query cannot be answered locally: {error}."
+        summary = f"{count} of the {len(index)} messages searched match {query!r}."
+        if not messages:
+            return summary
+        label_names = self._label_names()
+        rows = [[time.strftime('%Y-%m-%d', time.localtime(message.date)), message.sender, message.subject,
+                 ','.join(label_names.get(label_id, label_id) for label_id in message.label_ids)]
+                for message in messages]
+        return summary + "\n" + format_table("Messages", ["date", "sender", "subject", "labels"], rows, count, offset,
+                                             self.result_token_budget)
+
+    def _search_index(self) -> Union[SearchIndex, GmailError]:
+        """Return the inverted index over the local messages, rebuilt when they are refreshed."""
+        matcher = self._preview_matcher()
+        if isinstance(matcher, GmailError):
+            return matcher
+        local = self._local()
+        with local.lock:
+            if local.index is None or local.index.built_at < matcher.store.loaded_at:
+                labels = self.gmail_api.list_labels()
+                local.index = SearchIndex(matcher.store.messages, None if isinstance(labels, GmailError) else labels)
+            return local.index
+
+    def suggest_labels(self, min_confidence: float = 0.8, samples_per_label: int = 3) -> str:
+        """Suggest user labels for the messages that have none, with a local classifier trained on the already labeled mail.
+        
+        No LLM call is made per message: a naive Bayes model learns each user label from the senders and
+        subject words of the messages carrying it, and scores every unlabeled message.
+        
+        Args:
+            min_confidence (float): Minimum probability (0 to 1) for a message to be suggested a label.
+            samples_per_label (int): Number of example subjects shown per suggested label.
+            
+        Returns:
+            For every label: the number of unlabeled messages it fits, example subjects, the senders and
+            words that characterize it, and filter criteria that would label such messages automatically.
+            
+        Tips:
+            - Show the suggestions to the user and ask which ones to apply before creating filters.
+            - Check a proposed filter with preview_filter, then create it with create_filter and
+              apply it with apply_filter_to_existing_mail.
+            - Labels need at least 5 labeled messages to be learned.
+        """
+        matcher = self._preview_matcher()
+        if isinstance(matcher, GmailError):
+            return f"Labels could not be suggested. {matcher}"
+        labels = self.gmail_api.list_labels()
+        if isinstance(labels, GmailError):
+            return f"Labels could not be suggested. {labels}"
+        label_names = {label['id']: label['name'] for label in labels if label.get('type') != 'system'}
+        
+        messages = matcher.store.messages
+        # The mail without user labels is the background, so messages unlike every label get none
+        classifier = LabelClassifier().fit(messages, list(label_names), background=True)
+        if not classifier.labels:
+            return "There are not enough labeled messages to learn from. Each label needs at least 5 messages."
+        unlabeled = [message for message in messages if not any(label in label_names for label in message.label_ids)]
+        predictions = classifier.predict(unlabeled, min_confidence=min_confidence)
+        
+        suggestions: Dict[str, List] = {}
+        for message, prediction in zip(unlabeled, predictions):
+            if prediction is not None:
+                suggestions.setdefault(prediction[0], []).append(message)
+        if not suggestions:
+            return f"None of the {len(unlabeled)} unlabeled messages fits a label with {min_confidence:.0%} confidence."
+        
+        summary = f"Suggestions for {sum(map(len, suggestions.values()))} of the {len(unlabeled)} unlabeled messages:"
+        for label_id, matched in sorted(suggestions.items(), key=lambda item: -len(item[1])):
+            features = classifier.top_features(label_id)
+            summary += f"\n\nLabel '{label_names[label_id]}' (ID {label_id}): {len(matched)} messages"
+            summary += "\n  Characterized by: " + ", ".join(features)
+            criteria = criteria_from_features(features)
+            if criteria:
+                summary += f"\n  Proposed filter criteria: {json.dumps(criteria)}"
+            for message in matched[:samples_per_label]:
+                summary += f"\n  - {message.sender} | {message.subject}"
+        return summary
+    # endregion
+
+    # region BULK OPERATIONS
+    def create_labels(self, labels: List[Dict]) -> str:
+        """Create several labels in the user's gmail account with a single batched call.
+        
+        Args:
+            labels (List[Dict]): List of label content dictionaries, each one with the same keys as in create_label.
+            
+        Returns:
+            A summary of the labels created and the ones that failed.
+            
+        Tips:
+            - Use this tool instead of calling create_label repeatedly when the user asks for more than one label.
+            - The same color and naming rules as in create_label apply.
+        """
+        batch = self.gmail_api.batch()
+        for label_content in labels:
+            batch.create_label(label_content)
+        return self._summarize_batch("Created", "labels", batch.execute())
+    
+    def update_labels(self, updates: List[Dict]) -> str:
+        """Update several labels in the user's gmail account with a single batched call.
+        
+        Args:
+            updates (List[Dict]): List of dictionaries with the keys:
+                - label_id: The ID of the label to update.
+                - label_content: Label content dictionary with the same keys as in update_label.
+                
+        Returns:
+            A summary of the labels updated and the ones that failed.
+        """
+        batch = self.gmail_api.batch()
+        for update in updates:
+            batch.update_label(update['label_id'], update['label_content'])
+        return self._summarize_batch("Updated", "labels", batch.execute())
+    
+    def delete_labels(self, label_ids: List[str]) -> str:
+        """Delete several labels from the user's gmail account with a single batched call.
+        
+        Args:
+            label_ids (List[str]): The IDs of the labels to delete.
+            
+        Returns:
+            A summary of the labels deleted and the ones that failed.
+        """
+        batch = self.gmail_api.batch()
+        for label_id in label_ids:
+            batch.delete_label(label_id)
+        return self._summarize_batch("Deleted", "labels", batch.execute())
+    
+    def create_filters(self, filters: List[Dict]) -> str:
+        """Create several filters in the user's gmail account with a single batched call.
+        
+        Args:
+            filters (List[Dict]): List of dictionaries with the keys:
+                - criteria: Filter criteria dictionary with the same keys as in create_filter.
+                - actions: Filter actions dictionary with the same keys as in create_filter.
+                
+        Returns:
+            A summary of the filters created and the ones that failed.
+        """
+        batch = self.gmail_api.batch()
+        for filter_content in filters:
+            batch.create_filter(filter_content['criteria'], filter_content['actions'])
+        return self._summarize_batch("Created", "filters", batch.execute())
+    
+    def delete_filters(self, filter_ids: List[str]) -> str:
+        """Delete several filters from the user's gmail account with a single batched call.
+        
+        Args:
+            filter_ids (List[str]): The IDs of the filters to delete.
+            
+        Returns:
+            A summary of the filters deleted and the ones that failed.
+            
+        Tips:
+            - If the user does not provide the filter IDs you can find them by listing all filters and matching the criteria.
+        """
+        batch = self.gmail_api.batch()
+        for filter_id in filter_ids:
+            batch.delete_filter(filter_id)
+        return self._summarize_batch("Deleted", "filters", batch.execute())
+    
+    @staticmethod
+    def _summarize_batch(verb: str, kind: str, results: List[Dict]) -> str:
+        succeeded = [r for r in results if r['ok']]
+        summary = f"{verb} {len(succeeded)} of {len(results)} {kind}."
+        failed = [f"- {r['target']}: {r['error']}" for r in results if not r['ok']]
+        if failed:
+            summary += "\nFailed:\n" + "\n".join(failed)
+        return summary
+    # endregion
+
+    # region MAILBOX CONFIG
+    def export_mailbox_config(self) -> str:
+        """Export the user labels and the filters of the user's gmail account as a YAML config.
+        
+        Returns:
+            The YAML config, in the format read by apply_mailbox_config: the labels with their name and
+            non default settings, the filters with their criteria and their actions using label names.
+            
+        Tips:
+            - To reorganize the mailbox, export the config, edit it and apply it instead of calling the label and filter tools one by one.
+        """
+        labels = self.gmail_api.list_labels()
+        if isinstance(labels, GmailError):
+            return f"Labels could not be listed. {labels}"
+        filters = self.gmail_api.list_filters()
+        if isinstance(filters, GmailError):
+            return f"Filters could not be listed. {filters}"
+        return MailboxConfig.export(labels, filters).to_yaml()
+    
+    def apply_mailbox_config(self, config: str, dry_run: bool = True) -> str:
+        """Make the labels and filters of the user's gmail account match a YAML config, with the fewest changes.
+        
+        Args:
+            config (str): The YAML config:
+                prune: false  # true deletes the user labels and the filters missing from the config
+                labels:
+                  - name: Work
+                    color: {backgroundColor: '#4a86e8', textColor: '#000000'}  # [Optional]
+                    labelListVisibility: labelShow  # [Optional]
+                    messageListVisibility: show  # [Optional]
+                  - name: Travel
+                    renamed_from: Trips  # [Optional] renames an existing label
+                filters:
+                  - criteria: {from: boss@example.com, subject: report}
+                    action: {addLabels: [Work], removeLabels: [INBOX], forward: me@example.com}
+            dry_run (bool): Only return the plan of the changes, without making them.
+            
+        Returns:
+            The plan (labels and filters to create +, update ~ and delete -), or the result of applying it.
+            
+        Tips:
+            - Always call it with dry_run=True first, show the plan to the user and ask for confirmation before applying it with dry_run=False.
+            - Labels and filters already as in the config are left unchanged, only the differences are sent, in a few batched requests.
+            - Filters refer to labels by name, labels created by the config can be used by its filters.
+            - The same color rules as in create_label apply.
+        """
+        try:
+            desired = MailboxConfig.from_yaml(config)
+        except ValueError as error:
+            return f"The config is invalid. {error}"
+        labels = self.gmail_api.list_labels(refresh=True)
+        if isinstance(labels, GmailError):
+            return f"Labels could not be listed. {labels}"
+        filters = self.gmail_api.list_filters()
+        if isinstance(filters, GmailError):
+            return f"Filters could not be listed. {filters}"
+        
+        plan = desired.plan(labels, filters)
+        if dry_run or plan.errors or not len(plan):
+            prefix = "Plan (not applied):" if dry_run else ("Nothing to change." if not plan.errors else
+                                                              "The config was not applied, fix these errors first:")
+            return f"{prefix}\n{plan.summary()}"
+        return self._summarize_batch("Applied", "changes", plan.apply(self.gmail_api))
+    # endregion
\ No newline at end of file
@@ -0,0 +1,77 @@
+from typing import List, Optional, Sequence, Tuple
+
+# Rough number of characters per token of the model, used to keep tool results within a budget
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens of a text."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def page(items: Sequence, limit: int, cursor: Optional[str]) -> Tuple[int, Sequence]:
+    """
+    Return the offset and the items of a page.
+
+    Args:
+        items (Sequence): Every item, in a stable order.
+        limit (int): Maximum number of items of the page.
+        cursor (str): The cursor returned with the previous page, None for the first one.
+    """
+    try:
+        offset = max(0, int(cursor)) if cursor else 0
+    except ValueError:
+        offset = 0
+    return offset, items[offset:offset + max(1, limit)]
+
+
+def _cell(value) -> str:
+    text = '' if value is None else str(value)
+    return text.replace('\n', ' ').replace('|', '\\|')
+
+
+def format_table(title: str, columns: List[str], rows: List[List], total: int, offset: int = 0,
+                 token_budget: Optional[int] = None) -> str:
+    """
+    Encode rows as a compact table: a header line, then one `|` separated line per row.
+
+    Columns empty in every row are left out. Rows beyond the token budget are cut, and the result
+    ends with a marker giving the cursor of the next page whenever rows are left.
+
+    Args:
+        title (str): What the rows are, e.g. 'Labels'.
+        columns (List[str]): The column names.
+        rows (List[List]): The rows of the page.
+        total (int): Number of rows of every page together.
+        offset (int): Position of the first row among all the rows.
+        token_budget (int): Approximate maximum number of tokens of the result, None for no limit.
+
+    Returns:
+        e.g.
+            Labels 1-2 of 2 (id|name|type)
+            INBOX|INBOX|system
+            Label_1|Work|user
+    """
+    kept = [index for index in range(len(columns)) if any(row[index] not in (None, '') for row in rows)]
+    header = f"({'|'.join(columns[index] for index in kept)})"
+    lines = ['|'.join(_cell(row[index]) for index in kept) for row in rows]
+
+    budget = None if token_budget is None else token_budget * CHARS_PER_TOKEN - len(title) - len(header) - 80
+    shown = len(lines)
+    if budget is not None:
+        used = 0
+        for position, line in enumerate(lines):
+            used += len(line) + 1
+            # At least one row is always shown
+            if used > budget and position > 0:
+                shown = position
+                break
+
+    end = offset + shown
+    result = [f"{title} {offset + 1}-{end} of {total} {header}" if shown else f"{title}: none of {total}"]
+    result.extend(lines[:shown])
+    if shown < len(lines):
+        result.append(f'[truncated: {total - end} more, past the token budget; call again with cursor="{end}"]')
+    elif end < total:
+        result.append(f'[{total - end} more; call again with cursor="{end}"]')
+    return '\n'.join(result)
@@ -0,0 +1,100 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+# A resource access is a (key, mode) pair. Keys are '/' separated paths such as
+# "labels", "labels/Label_12" or "filters/+new/..." and mode is "r" (read) or "w" (write).
+# A key covers every key below it, so reading "labels" conflicts with writing "labels/Label_12".
+# The empty key covers everything, which is how unknown tools are serialized.
+Access = Tuple[str, str]
+EVERYTHING: Set[Access] = {("", "w")}
+
+
+def _overlaps(key_a: str, key_b: str) -> bool:
+    if not key_a or not key_b or key_a == key_b:
+        return True
+    return key_a.startswith(key_b + "/") or key_b.startswith(key_a + "/")
+
+
+def conflicts(accesses_a: Set[Access], accesses_b: Set[Access]) -> bool:
+    """Return True if two sets of accesses touch the same resource and at least one of them writes it."""
+    return any(
+        _overlaps(key_a, key_b) and "w" in (mode_a, mode_b)
+        for key_a, mode_a in accesses_a
+        for key_b, mode_b in accesses_b
+    )
+
+
+class ToolScheduler:
+    """
+    Runs the tool calls of one agent step concurrently where it is safe to do so.
+
+    Every call is given the resources it reads and writes. A call waits for every earlier call
+    it conflicts with (read/write or write/write on overlapping resources), which splits the
+    calls in waves: the calls of a wave run at the same time on a bounded thread pool, and the
+    waves run one after another. Results are always returned in the order of the calls.
+    """
+
+    def __init__(self, access: Callable[[str, Dict], Set[Access]], max_workers: int = 4):
+        """
+        Initializes the ToolScheduler object.
+
+        Args:
+            access (Callable[[str, Dict], Set[Access]]): Returns the resources a tool call reads and
+                writes, given the tool name and its arguments.
+            max_workers (int): Maximum number of tool calls running at the same time.
+        """
+        self.access = access
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def plan(self, tool_calls: List[Dict]) -> List[List[int]]:
+        """
+        Split the tool calls in waves of independent calls.
+
+        Returns:
+            The indices of the calls of every wave, in execution order.
+        """
+        accesses = []
+        waves: List[int] = []
+        for index, tool_call in enumerate(tool_calls):
+            try:
+                call_accesses = self.access(tool_call["name"], tool_call.get("args") or {})
+            except Exception:
+                call_accesses = EVERYTHING
+            accesses.append(call_accesses)
+            waves.append(max(
+                (waves[previous] + 1 for previous in range(index) if conflicts(accesses[previous], call_accesses)),
+                default=0
+            ))
+        plan: List[List[int]] = [[] for _ in range(max(waves, default=-1) + 1)]
+        for index, wave in enumerate(waves):
+            plan[wave].append(index)
+        return plan
+
+    def run(self, tool_calls: List[Dict], invoke: Callable[[Dict], Any]) -> List[Any]:
+        """
+        Invoke every tool call, concurrently within each wave.
+
+        Args:
+            tool_calls (List[Dict]): The tool calls of the AI message.
+            invoke (Callable[[Dict], Any]): Runs a single tool call and returns its result.
+
+        Returns:
+            The results, in the same order as the tool calls.
+        """
+        results: List[Any] = [None] * len(tool_calls)
+        for wave in self.plan(tool_calls):
+            if len(wave) == 1 or self.max_workers <= 1:
+                for index in wave:
+                    results[index] = invoke(tool_calls[index])
+                continue
+            # Each call runs in a copy of the caller's context so context variables
+            # (run configuration, callbacks, bound account) reach the worker threads
+            futures = {
+                index: self._executor.submit(contextvars.copy_context().run, invoke, tool_calls[index])
+                for index in wave
+            }
+            for index, future in futures.items():
+                results[index] = future.result()
+        return results
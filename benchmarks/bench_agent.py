@@ -0,0 +1,127 @@
+"""
+Benchmark turns of the agent graph with a scripted model and a local fake Gmail server.
+
+No LLM is called: the model replays a fixed conversation (see ScriptedChatModel), so the numbers
+measure the agent itself, i.e. the graph, the tools, the Gmail round trips and the checkpointer,
+and the counts (model calls, tool calls, round trips, tokens, checkpoint bytes) are deterministic.
+
+Run with:
+    python benchmarks/bench_agent.py --threads 10 --latency 0.005
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+from langchain_core.messages import HumanMessage
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.agent_langgraph import Agent
+from agent.utils.checkpoint_store import BoundedMemorySaver
+from benchmarks.bench_gmail_api import percentile
+from benchmarks.fake_gmail_server import FakeGmailServer
+from benchmarks.scripted_model import ScriptedChatModel
+from gmail_api.client_pool import GmailClientPool
+
+# The user message of every turn, and the steps the model plays for it
+CONVERSATION = [
+    ("Hello, what can you do?",
+     ["I can list, create and update your labels and filters, search your mail and suggest labels."]),
+    ("Show me my labels and filters.",
+     [[{'name': 'list_labels', 'args': {}}, {'name': 'list_filters', 'args': {}}],
+      "Here are your labels and filters."]),
+    ("How many GitHub notifications did I get?",
+     [[{'name': 'search_messages', 'args': {'query': 'from:github.com', 'max_results': 5}}],
+      "You got GitHub notifications, the latest are listed above."]),
+    ("Put invoices under a Receipts label.",
+     [[{'name': 'preview_filter', 'args': {'criteria': {'from': 'billing@invoices.example'}}},
+       {'name': 'create_label', 'args': {'label_content': {'name': 'Receipts'}}}],
+      [{'name': 'create_filter', 'args': {'criteria': {'from': 'billing@invoices.example'},
+                                          'actions': {'addLabelIds': ['STARRED']}}}],
+      "Done, invoices are now starred and labeled."]),
+    ("Create labels for travel, family and work.",
+     [[{'name': 'create_labels', 'args': {'labels': [{'name': 'Travel'}, {'name': 'Family'}, {'name': 'Work'}]}}],
+      "The three labels are created."]),
+]
+
+
+def run(threads: int = 10, latency: float = 0.005, messages: int = 1000, model_latency: float = 0.0) -> Dict[str, Dict]:
+    """Play the conversation in `threads` threads, return the measures."""
+    # The tools read the local mail from Gmail, not from a mirror configured for the live account
+    os.environ.pop('GMAIL_MIRROR_PATH', None)
+    model = ScriptedChatModel(turns=[steps for _, steps in CONVERSATION], latency=model_latency)
+    checkpointer = BoundedMemorySaver(max_threads=threads + 1)
+    with FakeGmailServer(latency=latency, messages=messages) as server:
+        pool = GmailClientPool(credentials_path=None, factory=lambda account: server.client())
+        agent = Agent(model, checkpointer=checkpointer, client_pool=pool)
+        turns: List[List[float]] = [[] for _ in CONVERSATION]
+        tool_calls = 0
+        round_trips = server.round_trips
+        checkpoint_bytes = []
+        # The agent logs every tool call and model call, which would dominate the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in range(threads):
+                config = {"configurable": {"thread_id": f"bench-{thread}"}}
+                for turn, (text, _) in enumerate(CONVERSATION):
+                    start = time.perf_counter()
+                    agent.graph.invoke({"messages": [HumanMessage(content=text)]}, config)
+                    turns[turn].append(time.perf_counter() - start)
+                state = agent.graph.get_state(config)
+                tool_calls += sum(1 for message in state.values["messages"] if message.type == "tool")
+                latest = checkpointer.get_tuple(config).checkpoint
+                checkpoint_bytes.append(len(checkpointer.serde.dumps_typed(latest)[1]))
+        round_trips = server.round_trips - round_trips
+
+    all_turns = [duration for durations in turns for duration in durations]
+    report = agent.token_accountant.report()
+    count = threads * len(CONVERSATION)
+    results = {
+        'turn': {
+            'median_ms': statistics.median(all_turns) * 1000,
+            'p95_ms': percentile(all_turns, 0.95) * 1000,
+            # The first thread builds the local message index, later ones reuse it
+            'first_search_ms': turns[2][0] * 1000
+        },
+        'per_turn': {
+            'model_calls': report['calls'] / count,
+            'tool_calls': tool_calls / count,
+            'gmail_round_trips': round_trips / count,
+            'input_tokens': report['input_tokens'] / count,
+            'output_tokens': report['output_tokens'] / count
+        },
+        'checkpoint': {
+            'latest_bytes': statistics.median(checkpoint_bytes),
+            'stored_bytes_per_thread': checkpointer.stats()['bytes'] / threads
+        }
+    }
+    for turn, (text, _) in enumerate(CONVERSATION):
+        results['turn'][f'turn_{turn + 1}_median_ms'] = statistics.median(turns[turn]) * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=10, help='Conversations played, one thread each.')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds of latency added by the fake server.')
+    parser.add_argument('--messages', type=int, default=1000, help='Messages in the fake mailbox.')
+    parser.add_argument('--model-latency', type=float, default=0.0, help='Seconds spent in every model call.')
+    parser.add_argument('--output', help='Optional path of a JSON file to write the results to.')
+    args = parser.parse_args()
+
+    results = run(args.threads, args.latency, args.messages, args.model_latency)
+    for group, measures in results.items():
+        for name, value in measures.items():
+            print(f"{group + '.' + name:<36}{value:>12.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark the blocking GmailAPI against AsyncGmailAPI on a local fake Gmail server.
+
+Run with:
+    python benchmarks/bench_async_client.py --operations 100 --latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.fake_gmail_server import FakeGmailServer
+from gmail_api.async_gmail_api import AsyncGmailAPI
+
+
+def bench_sync(server: FakeGmailServer, operations: int) -> dict:
+    gmail_api = server.client()
+    results = {}
+
+    start = time.perf_counter()
+    for index in range(operations):
+        gmail_api.create_label({'name': f'sync-{index}'})
+    results['create_label'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(operations):
+        gmail_api.list_labels(refresh=True)
+    results['list_labels'] = time.perf_counter() - start
+    return results
+
+
+async def bench_async(server: FakeGmailServer, operations: int, max_connections: int) -> dict:
+    results = {}
+    # The fake server does not check authorization, so the client is used without authenticating
+    gmail_api = AsyncGmailAPI(credentials_path=None, token_path=None, base_url=server.url + '/gmail/v1',
+                              max_connections=max_connections, max_keepalive_connections=max_connections)
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(gmail_api.create_label({'name': f'async-{index}'}) for index in range(operations)))
+        results['create_label'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(*(gmail_api.list_labels(refresh=True) for _ in range(operations)))
+        results['list_labels'] = time.perf_counter() - start
+    finally:
+        await gmail_api.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=100, help='Calls per operation and client.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds of latency added by the fake server.')
+    parser.add_argument('--max-connections', type=int, default=20, help='Connection pool size of the async client.')
+    parser.add_argument('--output', help='Optional path of a JSON file to write the results to.')
+    args = parser.parse_args()
+
+    with FakeGmailServer(latency=args.latency) as server:
+        sync_results = bench_sync(server, args.operations)
+    with FakeGmailServer(latency=args.latency) as server:
+        async_results = asyncio.run(bench_async(server, args.operations, args.max_connections))
+
+    report = {'operations': args.operations, 'latency': args.latency,
+              'max_connections': args.max_connections, 'results': {}}
+    print(f"{'operation':<14}{'sync (s)':>10}{'async (s)':>11}{'speedup':>9}")
+    for operation, sync_seconds in sync_results.items():
+        async_seconds = async_results[operation]
+        report['results'][operation] = {'sync': sync_seconds, 'async': async_seconds}
+        print(f"{operation:<14}{sync_seconds:>10.3f}{async_seconds:>11.3f}{sync_seconds / async_seconds:>8.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
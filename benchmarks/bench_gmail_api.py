@@ -0,0 +1,114 @@
+"""
+Benchmark the GmailAPI calls used by the agent on a local fake Gmail server.
+
+Every operation is repeated and timed call by call; the report gives the median and 95th
+percentile latency of each, and the number of HTTP round trips it took (a batch request is one).
+With --error-rate, a fraction of the requests fail with a transient error, to measure the retries.
+
+Run with:
+    python benchmarks/bench_gmail_api.py --repeat 20 --latency 0.005 --messages 1000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.fake_gmail_server import FakeGmailServer
+from gmail_api.gmail_api import GmailAPI, GmailError, RetryPolicy
+from gmail_api.mailbox_mirror import MailboxMirror
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(server: FakeGmailServer, operation: Callable[[int], object], repeat: int) -> Dict[str, float]:
+    """Time `repeat` calls of an operation (given the index of the call) and count the round trips they made."""
+    durations = []
+    round_trips = server.round_trips
+    for index in range(repeat):
+        start = time.perf_counter()
+        result = operation(index)
+        durations.append(time.perf_counter() - start)
+        if isinstance(result, GmailError):
+            raise RuntimeError(f'The benchmarked call failed: {result}')
+    return {
+        'median_ms': statistics.median(durations) * 1000,
+        'p95_ms': percentile(durations, 0.95) * 1000,
+        'round_trips_per_call': (server.round_trips - round_trips) / repeat
+    }
+
+
+def run(repeat: int = 20, latency: float = 0.005, messages: int = 1000, error_rate: float = 0.0) -> Dict[str, Dict]:
+    """Run every operation, return the measures by operation."""
+    results = {}
+    with FakeGmailServer(latency=latency, messages=messages, error_rate=error_rate) as server:
+        # Retries wait a few milliseconds instead of seconds, the benchmark measures their number, not the backoff
+        gmail_api: GmailAPI = server.client(retry_policy=RetryPolicy(base_delay=0.002, max_delay=0.02),
+                                            label_cache_ttl=0)
+        created = [gmail_api.create_label({'name': f'bench-{index}'}) for index in range(5)]
+        label_ids = [label['id'] for label in created if not isinstance(label, GmailError)]
+
+        results['list_labels'] = measure(server, lambda index: gmail_api.list_labels(refresh=True), repeat)
+        results['create_delete_label'] = measure(server, lambda index: gmail_api.delete_label(
+            gmail_api.create_label({'name': f'temporary-{index}'})['id']), repeat)
+        results['update_label'] = measure(server, lambda index: gmail_api.update_label(
+            label_ids[index % len(label_ids)], {'messageListVisibility': 'show'}), repeat)
+        results['create_filter'] = measure(server, lambda index: gmail_api.create_filter(
+            {'from': f'sender{index}@example.com'}, {'addLabelIds': [label_ids[0]]}), repeat)
+        results['list_filters'] = measure(server, lambda index: gmail_api.list_filters(), repeat)
+        results['get_profile'] = measure(server, lambda index: gmail_api.get_profile(), repeat)
+
+        def batch_create(index: int):
+            with gmail_api.batch() as batch:
+                for number in range(20):
+                    batch.create_label({'name': f'batch-{index}-{number}'})
+            return None if all(entry['ok'] for entry in batch.results) else GmailError('batch', 'failed')
+        results['batch_create_20_labels'] = measure(server, batch_create, max(1, repeat // 4))
+
+        results['fetch_message_metadata_200'] = measure(
+            server, lambda index: gmail_api.fetch_message_metadata(max_messages=200), max(1, repeat // 4))
+        results['batch_modify_100'] = measure(server, lambda index: gmail_api.batch_modify_messages(
+            sorted(server.messages)[:100], add_label_ids=[label_ids[index % len(label_ids)]]), repeat)
+
+        with tempfile.TemporaryDirectory() as directory:
+            mirror = MailboxMirror(gmail_api, os.path.join(directory, 'mirror.db'))
+            results['mirror_full_sync'] = measure(server, lambda index: mirror.sync(), 1)
+
+            def incremental_sync(index: int):
+                server.add_message(f'new{index}@example.com', f'New message {index}')
+                return mirror.sync()
+            results['mirror_incremental_sync'] = measure(server, incremental_sync, repeat)
+        results['server'] = {'errors_injected': server.error_count}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20, help='Calls per operation.')
+    parser.add_argument('--latency', type=float, default=0.005, help='Seconds of latency added by the fake server.')
+    parser.add_argument('--messages', type=int, default=1000, help='Messages in the fake mailbox.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of the requests failing with a 503.')
+    parser.add_argument('--output', help='Optional path of a JSON file to write the results to.')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.latency, args.messages, args.error_rate)
+    print(f"{'operation':<28}{'median (ms)':>12}{'p95 (ms)':>10}{'round trips':>13}")
+    for operation, measures in results.items():
+        if 'median_ms' in measures:
+            print(f"{operation:<28}{measures['median_ms']:>12.1f}{measures['p95_ms']:>10.1f}"
+                  f"{measures['round_trips_per_call']:>13.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark the cold start of the web frontend: importing frontend.app and serving the first page.
+
+Every run is a fresh interpreter, so nothing is cached in memory between runs. The agent warm-up
+is disabled (AGENT_WARMUP=0), so the numbers are the time before the server can answer, not the
+time to authenticate with Gmail.
+
+Run with:
+    python benchmarks/bench_startup.py --runs 10 --importtime
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import frontend.app as app
+imported = time.perf_counter()
+response = app.app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'first_request': served - imported,
+    'status': response.status_code,
+    'langgraph_loaded': 'langgraph.graph' in sys.modules,
+    'genai_loaded': 'langchain_google_genai' in sys.modules,
+    'discovery_loaded': 'googleapiclient.discovery' in sys.modules
+}))
+"""
+
+
+def run_probe(extra_args=()) -> subprocess.CompletedProcess:
+    env = dict(os.environ, AGENT_WARMUP='0', PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, *extra_args, '-c', PROBE], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def top_imports(count: int) -> list:
+    """The slowest modules imported by frontend.app, from `python -X importtime` (cumulative microseconds)."""
+    stderr = run_probe(['-X', 'importtime']).stderr
+    modules = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            modules.append({'module': match.group(4), 'cumulative_us': int(match.group(2)),
+                            'depth': len(match.group(3)) // 2})
+    # Direct imports only, their cumulative time includes their own dependencies
+    modules = [module for module in modules if module['depth'] == 1]
+    return sorted(modules, key=lambda module: -module['cumulative_us'])[:count]
+
+
+def run(count: int = 10) -> dict:
+    """Start the frontend `count` times, return the median timings and the heavy modules loaded."""
+    runs = [json.loads(run_probe().stdout.strip().splitlines()[-1]) for _ in range(count)]
+    results = {
+        'runs': count,
+        'import_median': statistics.median(run['import'] for run in runs),
+        'first_request_median': statistics.median(run['first_request'] for run in runs),
+        'status': runs[-1]['status'],
+        'langgraph_loaded': runs[-1]['langgraph_loaded'],
+        'genai_loaded': runs[-1]['genai_loaded'],
+        'discovery_loaded': runs[-1]['discovery_loaded']
+    }
+    results['total_median'] = results['import_median'] + results['first_request_median']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='Number of cold starts')
+    parser.add_argument('--importtime', action='store_true', help='Also list the slowest imports of frontend.app')
+    parser.add_argument('--top', type=int, default=15, help='Number of modules listed with --importtime')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+
+    print(f"{'import frontend.app':<24}{results['import_median'] * 1000:>10.1f} ms")
+    print(f"{'first GET /':<24}{results['first_request_median'] * 1000:>10.1f} ms")
+    print(f"{'total':<24}{results['total_median'] * 1000:>10.1f} ms  (median of {args.runs} runs)")
+    print(f"heavy modules loaded: langgraph={results['langgraph_loaded']} "
+          f"langchain_google_genai={results['genai_loaded']} "
+          f"googleapiclient.discovery={results['discovery_loaded']}")
+
+    if args.importtime:
+        results['top_imports'] = top_imports(args.top)
+        print('\nslowest imports:')
+        for module in results['top_imports']:
+            print(f"{module['module']:<48}{module['cumulative_us'] / 1000:>10.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
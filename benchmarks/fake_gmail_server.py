@@ -0,0 +1,439 @@
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from typing import Dict, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.filter_matcher import FilterMatcher, MessageMetadata, MessageStore
+
+SENDERS = ['alice@example.com', 'bob@shop.example', 'news@newsletter.example', 'noreply@github.com',
+           'billing@invoices.example', 'team@company.example', 'carol@example.org', 'alerts@monitoring.example']
+SUBJECTS = ['Weekly digest #{n}', 'Invoice {n} is available', 'Your order {n} has shipped', 'Meeting notes {n}',
+            '[repo] Pull request #{n} merged', 'Alert: disk usage above {n}%', 'Lunch on Friday?', 'Re: project plan v{n}']
+
+
+class FakeGmailServer:
+    """
+    In-process fake of the Gmail REST endpoints used by the agent, for offline benchmarks.
+
+    It keeps labels, filters, messages and the mailbox history in memory and serves them over
+    HTTP/1.1 with keep-alive, adding `latency` seconds to every request to mimic the network round
+    trip (a batch request is one round trip). Errors can be injected at random (`error_rate`) or
+    scripted for the next requests (inject_errors), to measure the cost of retries.
+
+    Usage:
+        with FakeGmailServer(latency=0.02, messages=1000) as server:
+            server.url  # e.g. http://127.0.0.1:54321
+            gmail_api = server.client()
+    """
+
+    # The bundled discovery document uses the global endpoint, the live one the per-API endpoint
+    BATCH_PATHS = ('/batch', '/batch/gmail/v1')
+
+    def __init__(self, latency: float = 0.0, messages: int = 0, error_rate: float = 0.0, error_status: int = 503,
+                 seed: int = 0, history_limit: int = 10000):
+        """
+        Initializes the FakeGmailServer object.
+
+        Args:
+            latency (float): Seconds added to every request.
+            messages (int): Number of synthetic messages to seed the mailbox with.
+            error_rate (float): Fraction of the requests (and of the items of a batch) failing with `error_status`.
+            error_status (int): HTTP status of the random errors, e.g. 429 or 503.
+            seed (int): Seed of the synthetic mailbox and of the random errors, for repeatable runs.
+            history_limit (int): Number of history records kept; older start history IDs get a 404.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.labels: Dict[str, Dict] = {}
+        self.filters: Dict[str, Dict] = {}
+        self.messages: Dict[str, Dict] = {}
+        self.history: List[Dict] = []
+        self.history_id = 1000
+        self.history_limit = history_limit
+        self.round_trips = 0
+        self.request_count = 0
+        self.batch_count = 0
+        self.error_count = 0
+        self.requests_by_operation: Counter = Counter()
+        self._scripted_errors: List[Tuple[Optional[re.Pattern], int]] = []
+        self._random = random.Random(seed)
+        self._store: Optional[Tuple[int, FilterMatcher, List[str]]] = None
+        self._version = 0
+        self._lock = threading.RLock()
+        for label_id in ('INBOX', 'UNREAD', 'STARRED', 'IMPORTANT', 'SPAM', 'TRASH', 'SENT', 'DRAFT'):
+            self.labels[label_id] = {'id': label_id, 'name': label_id, 'type': 'system'}
+        now = int(time.time() * 1000)
+        for index in range(messages):
+            sender = SENDERS[index % len(SENDERS)]
+            subject = SUBJECTS[(index // len(SENDERS)) % len(SUBJECTS)].format(n=index)
+            labels = ['INBOX'] + (['UNREAD'] if self._random.random() < 0.3 else [])
+            self._insert_message(f'{index:016x}', sender, subject, labels, now - index * 60000)
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeGmailServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'FakeGmailServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def client(self, **kwargs):
+        """
+        Build a GmailAPI whose service talks to this server without credentials.
+
+        Each thread gets its own connection, like with a real account. Keyword arguments are passed
+        to GmailAPI, e.g. retry_policy; the client gets its own circuit breaker.
+        """
+        import httplib2
+        from google.auth.credentials import AnonymousCredentials
+        from googleapiclient.discovery import build_from_document
+        from gmail_api.gmail_api import CircuitBreaker, GmailAPI, discovery_document
+
+        kwargs.setdefault('circuit_breaker', CircuitBreaker())
+        gmail_api = GmailAPI(credentials_path=None, token_path=None, **kwargs)
+        # The batch endpoint is derived from rootUrl, so the whole document is pointed at the server
+        document = dict(discovery_document(), rootUrl=self.url + '/')
+        gmail_api.service = build_from_document(document, http=httplib2.Http())
+        gmail_api.creds = AnonymousCredentials()
+        return gmail_api
+
+    # region ERRORS
+    def inject_errors(self, count: int, status: int = 503, path: Optional[str] = None) -> None:
+        """
+        Make the next `count` requests fail with `status`.
+
+        Args:
+            count (int): Number of failing requests (items of a batch count one by one).
+            status (int): HTTP status returned.
+            path (str): Optional regex the request path must match, e.g. r'/labels$'.
+        """
+        with self._lock:
+            self._scripted_errors.extend([(re.compile(path) if path else None, status)] * count)
+
+    def _injected_error(self, path: str) -> Optional[Tuple[int, Dict]]:
+        status = None
+        for index, (pattern, scripted_status) in enumerate(self._scripted_errors):
+            if pattern is None or pattern.search(path):
+                status = scripted_status
+                del self._scripted_errors[index]
+                break
+        if status is None and self.error_rate and self._random.random() < self.error_rate:
+            status = self.error_status
+        if status is None:
+            return None
+        self.error_count += 1
+        reason = 'rateLimitExceeded' if status == 429 else 'backendError'
+        return status, {'error': {'code': status, 'message': 'Injected error',
+                                  'errors': [{'reason': reason, 'message': 'Injected error'}]}}
+    # endregion
+
+    # region ROUTING
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: Optional[Dict]):
+        """Dispatch a request to the in-memory mailbox. Returns (status, payload)."""
+        with self._lock:
+            self.request_count += 1
+            error = self._injected_error(path)
+            if error is not None:
+                return error
+            for pattern, route_method, handler in self._routes():
+                match = re.fullmatch(pattern, path)
+                if match and route_method == method:
+                    self.requests_by_operation[handler.__name__.lstrip('_')] += 1
+                    return handler(query, body, *match.groups())
+        return 404, {'error': {'code': 404, 'message': f'No route for {method} {path}'}}
+
+    def _routes(self):
+        prefix = r'/gmail/v1/users/me'
+        return [
+            (prefix + r'/profile', 'GET', self._get_profile),
+            (prefix + r'/labels', 'GET', self._list_labels),
+            (prefix + r'/labels', 'POST', self._create_label),
+            (prefix + r'/labels/([^/]+)', 'GET', self._get_label),
+            (prefix + r'/labels/([^/]+)', 'PATCH', self._patch_label),
+            (prefix + r'/labels/([^/]+)', 'DELETE', self._delete_label),
+            (prefix + r'/settings/filters', 'GET', self._list_filters),
+            (prefix + r'/settings/filters', 'POST', self._create_filter),
+            (prefix + r'/settings/filters/([^/]+)', 'GET', self._get_filter),
+            (prefix + r'/settings/filters/([^/]+)', 'DELETE', self._delete_filter),
+            (prefix + r'/messages', 'GET', self._list_messages),
+            (prefix + r'/messages/batchModify', 'POST', self._batch_modify),
+            (prefix + r'/messages/([^/]+)', 'GET', self._get_message),
+            (prefix + r'/history', 'GET', self._list_history),
+        ]
+
+    def handle_batch(self, content_type: str, raw: bytes) -> Tuple[int, str, bytes]:
+        """
+        Serve a multipart/mixed batch request, dispatching every part as its own request.
+        Returns (status, content type, body).
+        """
+        with self._lock:
+            self.batch_count += 1
+        message = BytesParser(policy=HTTP).parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + raw)
+        boundary = f'batch_{uuid.uuid4().hex}'
+        parts = []
+        for part in message.iter_parts():
+            content_id = (part['Content-ID'] or '').strip('<>')
+            status, payload = self._dispatch_part(part.get_content())
+            content = json.dumps(payload) if payload is not None else ''
+            parts.append(f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n'
+                         f'HTTP/1.1 {status} {"OK" if status < 300 else "Error"}\r\n'
+                         f'Content-Type: application/json; charset=UTF-8\r\n\r\n{content}\r\n')
+        body = ''.join(parts) + f'--{boundary}--\r\n'
+        return 200, f'multipart/mixed; boundary={boundary}', body.encode()
+
+    def _dispatch_part(self, http_request) -> Tuple[int, Optional[Dict]]:
+        if isinstance(http_request, bytes):
+            http_request = http_request.decode()
+        head, _, body = http_request.replace('\r\n', '\n').partition('\n\n')
+        method, target = head.splitlines()[0].split(' ')[:2]
+        url = urlparse(target)
+        return self.handle(method, url.path, parse_qs(url.query), json.loads(body) if body.strip() else None)
+
+    def _not_found(self, kind: str, resource_id: str):
+        return 404, {'error': {'code': 404, 'message': f'{kind} {resource_id} not found'}}
+    # endregion
+
+    # region LABELS
+    def _list_labels(self, query, body):
+        return 200, {'labels': list(self.labels.values())}
+
+    def _create_label(self, query, body):
+        if any(label['name'] == body.get('name') for label in self.labels.values()):
+            return 409, {'error': {'code': 409, 'message': 'Label name exists or conflicts'}}
+        label = dict(body, id=f'Label_{uuid.uuid4().hex[:12]}', type='user')
+        self.labels[label['id']] = label
+        self._version += 1
+        return 200, label
+
+    def _get_label(self, query, body, label_id):
+        if label_id not in self.labels:
+            return self._not_found('Label', label_id)
+        return 200, self.labels[label_id]
+
+    def _patch_label(self, query, body, label_id):
+        if label_id not in self.labels:
+            return self._not_found('Label', label_id)
+        self.labels[label_id].update(body)
+        self._version += 1
+        return 200, self.labels[label_id]
+
+    def _delete_label(self, query, body, label_id):
+        if self.labels.pop(label_id, None) is None:
+            return self._not_found('Label', label_id)
+        for message in self.messages.values():
+            if label_id in message['labelIds']:
+                message['labelIds'].remove(label_id)
+        self._version += 1
+        return 204, None
+    # endregion
+
+    # region FILTERS
+    def _list_filters(self, query, body):
+        return 200, {'filter': list(self.filters.values())} if self.filters else {}
+
+    def _create_filter(self, query, body):
+        gmail_filter = dict(body, id=uuid.uuid4().hex[:16])
+        self.filters[gmail_filter['id']] = gmail_filter
+        return 200, gmail_filter
+
+    def _get_filter(self, query, body, filter_id):
+        if filter_id not in self.filters:
+            return self._not_found('Filter', filter_id)
+        return 200, self.filters[filter_id]
+
+    def _delete_filter(self, query, body, filter_id):
+        if self.filters.pop(filter_id, None) is None:
+            return self._not_found('Filter', filter_id)
+        return 204, None
+    # endregion
+
+    # region MESSAGES
+    def add_message(self, sender: str, subject: str, label_ids: Optional[List[str]] = None) -> str:
+        """Deliver a new message, recorded in the history like a real delivery. Returns its ID."""
+        with self._lock:
+            message_id = uuid.uuid4().hex[:16]
+            message = self._insert_message(message_id, sender, subject, label_ids or ['INBOX', 'UNREAD'],
+                                           int(time.time() * 1000))
+            self._record_history('messagesAdded', [{'message': self._short(message)}])
+            return message_id
+
+    def _insert_message(self, message_id: str, sender: str, subject: str, label_ids: List[str], internal_date: int) -> Dict:
+        message = {
+            'id': message_id, 'threadId': message_id, 'labelIds': list(label_ids),
+            'snippet': f'{subject} - synthetic message body', 'internalDate': str(internal_date),
+            'sizeEstimate': 2048 + len(subject) * 16, 'historyId': str(self.history_id),
+            'payload': {'headers': [
+                {'name': 'From', 'value': sender}, {'name': 'To', 'value': 'bench@example.com'},
+                {'name': 'Subject', 'value': subject},
+                {'name': 'Date', 'value': time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(internal_date / 1000))}
+            ]}
+        }
+        self.messages[message_id] = message
+        self._version += 1
+        return message
+
+    @staticmethod
+    def _short(message: Dict) -> Dict:
+        return {'id': message['id'], 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])}
+
+    def _matching_ids(self, query: str, label_ids: List[str]) -> List[str]:
+        """IDs of the messages matching a search query and label IDs, newest first."""
+        if self._store is None or self._store[0] != self._version:
+            ordered = sorted(self.messages.values(), key=lambda message: -int(message['internalDate']))
+            store = MessageStore(MessageMetadata.from_gmail(message) for message in ordered)
+            store.set_labels(list(self.labels.values()))
+            self._store = (self._version, FilterMatcher(store), [message['id'] for message in ordered])
+        _, matcher, ordered_ids = self._store
+        ids = ordered_ids
+        if query:
+            ids = [ordered_ids[row] for row in matcher.store.rows(matcher.match(query))]
+        if label_ids:
+            ids = [message_id for message_id in ids if set(label_ids) <= set(self.messages[message_id]['labelIds'])]
+        return ids
+
+    def _list_messages(self, query, body):
+        page_size = int(query.get('maxResults', ['100'])[0])
+        start = int(query.get('pageToken', ['0'])[0])
+        matching = self._matching_ids(query.get('q', [''])[0], query.get('labelIds', []))
+        ids = matching[start:start + page_size]
+        payload = {'resultSizeEstimate': len(matching)}
+        if ids:
+            payload['messages'] = [{'id': message_id, 'threadId': self.messages[message_id]['threadId']}
+                                   for message_id in ids]
+        if start + page_size < len(matching):
+            payload['nextPageToken'] = str(start + page_size)
+        return 200, payload
+
+    def _get_message(self, query, body, message_id):
+        message = self.messages.get(message_id)
+        if message is None:
+            return self._not_found('Message', message_id)
+        wanted = {name.lower() for name in query.get('metadataHeaders', [])}
+        headers = [header for header in message['payload']['headers'] if not wanted or header['name'].lower() in wanted]
+        return 200, dict(message, payload={'headers': headers})
+
+    def _batch_modify(self, query, body):
+        added, removed = [], []
+        for message_id in body.get('ids', []):
+            message = self.messages.get(message_id)
+            if message is None:
+                continue
+            remove = [label for label in message['labelIds'] if label in body.get('removeLabelIds', [])]
+            add = [label for label in body.get('addLabelIds', []) if label not in message['labelIds']]
+            message['labelIds'] = [label for label in message['labelIds'] if label not in remove] + add
+            if add:
+                added.append({'message': self._short(message), 'labelIds': add})
+            if remove:
+                removed.append({'message': self._short(message), 'labelIds': remove})
+        if added:
+            self._record_history('labelsAdded', added)
+        if removed:
+            self._record_history('labelsRemoved', removed)
+        self._version += 1
+        return 204, None
+    # endregion
+
+    # region HISTORY
+    def _record_history(self, kind: str, changes: List[Dict]) -> None:
+        self.history_id += 1
+        self.history.append({'id': str(self.history_id), kind: changes})
+        del self.history[:-self.history_limit]
+
+    def _get_profile(self, query, body):
+        return 200, {'emailAddress': 'bench@example.com', 'messagesTotal': len(self.messages),
+                     'threadsTotal': len({message['threadId'] for message in self.messages.values()}),
+                     'historyId': str(self.history_id)}
+
+    def _list_history(self, query, body):
+        start_history_id = int(query.get('startHistoryId', ['0'])[0])
+        oldest = int(self.history[0]['id']) if self.history else self.history_id + 1
+        if start_history_id < oldest - 1 and start_history_id < self.history_id:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        # e.g. historyTypes=labelAdded selects the labelsAdded changes
+        kinds = {re.sub(r'^(message|label)', r'\1s', kind) for kind in query.get('historyTypes', [])} or None
+        records = []
+        for record in self.history:
+            if int(record['id']) <= start_history_id:
+                continue
+            if kinds is not None:
+                record = {key: value for key, value in record.items() if key == 'id' or key in kinds}
+                if len(record) == 1:
+                    continue
+            records.append(record)
+        page_size = int(query.get('maxResults', ['100'])[0])
+        start = int(query.get('pageToken', ['0'])[0])
+        payload = {'historyId': str(self.history_id)}
+        if records[start:start + page_size]:
+            payload['history'] = records[start:start + page_size]
+        if start + page_size < len(records):
+            payload['nextPageToken'] = str(start + page_size)
+        return 200, payload
+    # endregion
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately, Nagle's algorithm would hold the body for a delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self):
+                with server._lock:
+                    server.round_trips += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                if url.path in server.BATCH_PATHS:
+                    status, content_type, content = server.handle_batch(self.headers.get('Content-Type', ''), raw)
+                else:
+                    body = json.loads(raw) if raw else None
+                    status, payload = server.handle(self.command, url.path, parse_qs(url.query), body)
+                    content_type = 'application/json'
+                    content = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _dispatch
+
+        return Handler
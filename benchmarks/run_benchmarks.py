@@ -0,0 +1,118 @@
+"""
+Run the offline benchmark suites, store the results and compare them with a baseline.
+
+The results of every suite are flattened into `suite.group.metric` values, written to a JSON file
+with the commit and the environment they were measured on. Given a baseline (the results of an
+earlier run, e.g. of the main branch), every metric is compared with it: all of them are lower is
+better, timings (`*_ms`) may vary by `--tolerance`, counts (tool calls, round trips, tokens,
+bytes) by `--count-tolerance`. The exit status is 1 if any metric regressed.
+
+Run with:
+    python benchmarks/run_benchmarks.py --output results.json --baseline baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks import bench_agent, bench_gmail_api, bench_startup
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def flatten(suite: str, results: Dict) -> Dict[str, float]:
+    return {f'{suite}.{group}.{name}': value for group, measures in results.items()
+            for name, value in measures.items() if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+def run_suites(suites: List[str], quick: bool = False) -> Dict[str, float]:
+    """Run the selected suites, return their flattened metrics."""
+    metrics = {}
+    if 'gmail_api' in suites:
+        metrics.update(flatten('gmail_api', bench_gmail_api.run(repeat=5 if quick else 20)))
+    if 'agent' in suites:
+        metrics.update(flatten('agent', bench_agent.run(threads=2 if quick else 10)))
+    if 'startup' in suites:
+        startup = bench_startup.run(3 if quick else 10)
+        metrics.update(flatten('startup', {'cold_start': {
+            'import_ms': startup['import_median'] * 1000,
+            'first_request_ms': startup['first_request_median'] * 1000,
+            'total_ms': startup['total_median'] * 1000
+        }}))
+    return metrics
+
+
+def compare(metrics: Dict[str, float], baseline: Dict[str, float], tolerance: float, count_tolerance: float,
+            min_delta_ms: float) -> List[Dict]:
+    """Return the metrics worse than the baseline beyond the tolerances."""
+    regressions = []
+    for name, value in sorted(metrics.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if name.endswith('_ms'):
+            # Sub-millisecond timings are noise, they only regress by more than min_delta_ms
+            regressed = value > previous * (1 + tolerance) and value - previous > min_delta_ms
+        else:
+            regressed = value > previous * (1 + count_tolerance)
+        if regressed:
+            regressions.append({'metric': name, 'baseline': previous, 'value': value,
+                                'change': value / previous - 1 if previous else None})
+    return regressions
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': os.getenv('GITHUB_SHA', commit),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suites', default='gmail_api,agent,startup', help='Comma separated suites to run.')
+    parser.add_argument('--quick', action='store_true', help='Fewer repetitions, for a smoke run.')
+    parser.add_argument('--output', help='Path of the JSON file the results are written to.')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare with (ignored if missing).')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown of a timing.')
+    parser.add_argument('--count-tolerance', type=float, default=0.02, help='Allowed relative increase of a count.')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0, help='Timing differences ignored below this.')
+    args = parser.parse_args()
+
+    metrics = run_suites([suite.strip() for suite in args.suites.split(',') if suite.strip()], args.quick)
+    for name, value in sorted(metrics.items()):
+        print(f"{name:<56}{value:>14.2f}")
+
+    baseline: Optional[Dict] = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = []
+    if baseline is not None:
+        regressions = compare(metrics, baseline['metrics'], args.tolerance, args.count_tolerance, args.min_delta_ms)
+        print(f"\nCompared with {baseline['environment'].get('commit')}: {len(regressions)} regression(s)")
+        for regression in regressions:
+            change = f"{regression['change']:+.0%}" if regression['change'] is not None else 'new'
+            print(f"  {regression['metric']:<54}{regression['baseline']:>12.2f} -> {regression['value']:.2f} ({change})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'metrics': metrics, 'regressions': regressions}, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.utils.tools.result_format import estimate_tokens
+
+# A step of a turn: the final answer, or the tool calls made at once, e.g. [{'name': 'list_labels', 'args': {}}]
+Step = Union[str, List[Dict]]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model replaying predetermined steps, so the agent graph can be benchmarked offline.
+
+    Turn n of a thread (its n-th human message) plays the steps of `turns[n % len(turns)]`: every
+    model call of the turn returns the next step, the tool calls of a step, then the final answer.
+    The step is derived from the messages alone, so one model serves every thread.
+    Usage metadata is estimated from the prompt and the bound tool schemas, like the tokens billed
+    by a real model, for the token accounting of the agent.
+
+    Usage:
+        model = ScriptedChatModel(turns=[[[{'name': 'list_labels', 'args': {}}], 'You have 8 labels.']])
+        agent = Agent(model, checkpointer=BoundedMemorySaver(), client_pool=pool)
+    """
+
+    turns: List[List[Step]]
+    latency: float = 0.0  # Seconds spent in every call, to mimic the model's response time
+    tool_tokens: int = 0  # Estimated tokens of the bound tool schemas, sent with every call
+
+    @property
+    def _llm_type(self) -> str:
+        return 'scripted'
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> 'ScriptedChatModel':
+        # The tool calls are scripted, the schemas only count in the input tokens
+        tool_tokens = sum(estimate_tokens(json.dumps(convert_to_openai_tool(t))) for t in tools)
+        return self.model_copy(update={'tool_tokens': tool_tokens})
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        humans = [index for index, message in enumerate(messages) if message.type == 'human']
+        script = self.turns[max(0, len(humans) - 1) % len(self.turns)]
+        step = sum(1 for message in messages[(humans[-1] if humans else 0) + 1:] if message.type == 'ai')
+        planned = script[min(step, len(script) - 1)]
+
+        prompt_tokens = self.tool_tokens + sum(estimate_tokens(str(message.content)) for message in messages)
+        if isinstance(planned, str):
+            message = AIMessage(content=planned)
+        else:
+            message = AIMessage(content='', tool_calls=[
+                {'name': call['name'], 'args': call.get('args', {}), 'id': f'call_{len(messages)}_{index}'}
+                for index, call in enumerate(planned)])
+        output_tokens = estimate_tokens(str(planned))
+        message.usage_metadata = {'input_tokens': prompt_tokens, 'output_tokens': output_tokens,
+                                  'total_tokens': prompt_tokens + output_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)])
@@ -1,5 +1,5 @@
-from flask import Flask, render_template_string, request, redirect, url_for, session, jsonify
-import os, sys, yaml, time, uuid
+from flask import Flask, render_template_string, request, redirect, url_for, session, jsonify, Response, stream_with_context, g
+import os, sys, yaml, time, uuid, json, threading
 from dotenv import load_dotenv, find_dotenv
 import markdown
 import bleach
@@ -8,11 +8,12 @@ from typing import List
 
 # Add the parent directory to the path so we can import from agent
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from agent.agent_langgraph import Agent
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.checkpoint.sqlite import SqliteSaver
+from agent.utils.response_cache import ResponseCache
+from frontend.session_store import FileSessionStore, MemorySessionStore, ServerSideSessionInterface, SQLiteSessionStore
+from telemetry.metrics import metrics
+from telemetry.tracing import tracer
+# The agent, LangChain and the Google clients are imported when the agent is first built (see get_agent),
+# so the server starts serving pages without waiting for them
 
 # Load environment variables
 _ = load_dotenv(find_dotenv())
@@ -20,6 +21,15 @@ _ = load_dotenv(find_dotenv())
 app = Flask(__name__)
 app.secret_key = "your_secret_key"  # Replace with a secure secret key
 
+# The conversation is kept on the server, the session cookie only holds an opaque session ID
+if os.getenv("SESSION_DB_PATH"):
+    session_backend = SQLiteSessionStore(os.getenv("SESSION_DB_PATH"))
+elif os.getenv("SESSION_DIR"):
+    session_backend = FileSessionStore(os.getenv("SESSION_DIR"))
+else:
+    session_backend = None
+app.session_interface = ServerSideSessionInterface(MemorySessionStore(backend=session_backend))
+
 # Configure Markdown and Bleach for safe rendering
 # Extended allowed tags for markdown rendering
 EXTENDED_ALLOWED_TAGS = list(ALLOWED_TAGS) + [
@@ -53,6 +63,9 @@ def process_markdown(text):
     return sanitized_html
 
 def initialize_agent(checkpointer):
+    from agent.agent_langgraph import Agent
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    
     # Load the prompt from YAML file
     with open(os.path.join(os.path.dirname(__file__), "../agent/prompts/agent_prompt.yaml"), "r") as f:
         config_yaml = yaml.safe_load(f)
@@ -62,11 +75,158 @@ def initialize_agent(checkpointer):
     gnai_key = os.getenv("GOOGLE_GEN_AI_KEY")
     model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", api_key=gnai_key)
     
-    agent = Agent(model, system=prompt, checkpointer=checkpointer)
+    agent = Agent(model, system=prompt, checkpointer=checkpointer, response_cache=global_response_cache,
+                  compact_schemas=os.getenv("COMPACT_TOOL_SCHEMAS", "0") == "1",
+                  fast_path=os.getenv("FAST_PATH", "1") == "1")
     return agent
 
-global_memory = MemorySaver()
-global_agent = initialize_agent(global_memory)
+# Identical model calls, such as the greeting of every new chat, are answered from this cache
+global_response_cache = ResponseCache(sqlite_path=os.getenv("LLM_CACHE_PATH"))
+global_agent = None
+global_agent_lock = threading.Lock()
+
+def get_agent():
+    """Return the agent, building it (model, Gmail toolkit, graph) on first use."""
+    global global_agent
+    if global_agent is None:
+        with global_agent_lock:
+            if global_agent is None:
+                from agent.utils.checkpoint_store import BoundedMemorySaver
+                # Every page load and Clear Chat starts a thread, old ones are evicted (and optionally spilled)
+                checkpointer = BoundedMemorySaver(spill_path=os.getenv("CHECKPOINT_SPILL_PATH"))
+                global_agent = initialize_agent(checkpointer)
+    return global_agent
+
+def warm_up_agent():
+    """Build the agent and authenticate with Gmail in the background, so the first chat does not wait for it."""
+    def warm_up():
+        try:
+            get_agent().toolkit.gmail_api.service
+        except Exception as e:
+            app.logger.error(f"Error during agent warm-up: {str(e)}")
+    threading.Thread(target=warm_up, name="agent-warm-up", daemon=True).start()
+
+# Version 2 threads only receive the new message of every turn, the checkpointer holds the history.
+# Version 1 sessions streamed the whole conversation on every turn and must be migrated.
+HISTORY_VERSION = 2
+
+def thread_config():
+    """The graph configuration of the session's thread: its ID and the Gmail account the tools act on."""
+    return {"configurable": {"thread_id": session.get("thread_id"), "account": session.get("account")}}
+
+def new_thread():
+    """Start a new conversation thread for the current session."""
+    session["thread_id"] = str(uuid.uuid4())
+    session["history_version"] = HISTORY_VERSION
+    return thread_config()
+
+def ensure_thread():
+    """
+    Return the thread configuration of the session, migrating it if needed.
+    
+    Threads of version 1 sessions hold the conversation replayed once per turn, and threads
+    of the in-memory checkpointer are lost on restart. In both cases the session moves to a
+    fresh thread seeded once with the conversation stored in the session.
+    """
+    from langchain_core.messages import HumanMessage, AIMessage
+    
+    thread = thread_config()
+    if session.get("history_version") == HISTORY_VERSION and session.get("thread_id"):
+        if get_agent().graph.get_state(thread).values or not session["messages"]:
+            return thread
+    
+    thread = new_thread()
+    history = [
+        HumanMessage(content=m["content"]) if m["type"] == "user" else AIMessage(content=m["content"])
+        for m in session["messages"]
+    ]
+    if history:
+        get_agent().graph.update_state(thread, {"messages": history}, as_node="execute")
+    return thread
+
+# region STREAMING
+GREETING_PROMPT = "Welcome the user and introduce yourself"
+RENDER_INTERVAL = 0.1  # Seconds between incremental markdown renders of a streamed reply
+TOOL_RESULT_PREVIEW = 500  # Characters of a tool result forwarded to the page
+
+def message_text(content):
+    """Return the text of a message content, which Gemini may split in parts."""
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get("text", "")
+                   for part in content if isinstance(part, (str, dict)))
+
+def sse(event, data):
+    """Format a Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_agent_events(input_state, thread, fallback):
+    """
+    Run the graph and yield its progress as Server-Sent Events:
+        token: a piece of LLM text as it is generated
+        render: the markdown rendered so far of the current agent message (throttled)
+        tool_start / tool_result: a tool call being issued and its (truncated) result
+        tool_progress: the progress of a long tool call, e.g. apply_filter_to_existing_mail
+        error: the fallback message if the run failed
+        done: the final agent message
+    """
+    from langchain_core.messages import AIMessage, ToolMessage
+    from agent.utils.intent_router import is_routed
+    
+    text, message_id, last_render, final = "", None, 0.0, ""
+    try:
+        for mode, data in get_agent().graph.stream(input_state, thread, stream_mode=["messages", "updates", "custom"]):
+            if mode == "custom":
+                yield sse("tool_progress", {"name": data.get("tool"), "text": data.get("progress")})
+                continue
+            if mode == "messages":
+                chunk, metadata = data
+                if metadata.get("langgraph_node") != "execute" or not isinstance(chunk, AIMessage):
+                    continue
+                # The messages of the intent router come at once with their tool calls, they are sent
+                # from the update below so that the tool events come before the reply
+                if is_routed(chunk):
+                    continue
+                if chunk.id != message_id:
+                    message_id, text = chunk.id, ""
+                delta = message_text(chunk.content)
+                if not delta:
+                    continue
+                text += delta
+                yield sse("token", {"text": delta})
+                if time.monotonic() - last_render >= RENDER_INTERVAL:
+                    last_render = time.monotonic()
+                    yield sse("render", {"html": process_markdown(text)})
+                continue
+            
+            for update in data.values():
+                for msg in (update or {}).get("messages", []):
+                    if isinstance(msg, AIMessage):
+                        if msg.content:
+                            final = message_text(msg.content)
+                            yield sse("render", {"html": process_markdown(final)})
+                        for tool_call in msg.tool_calls:
+                            yield sse("tool_start", {"name": tool_call["name"], "args": tool_call["args"]})
+                    elif isinstance(msg, ToolMessage):
+                        yield sse("tool_result", {"name": msg.name, "content": str(msg.content)[:TOOL_RESULT_PREVIEW]})
+    except Exception as e:
+        app.logger.error(f"Error during streaming: {str(e)}")
+        final = fallback
+        yield sse("error", {"html": process_markdown(fallback)})
+    
+    # The response headers are already sent, so the reply is saved to the session store explicitly
+    if final:
+        session["messages"].append({"type": "agent", "content": final})
+        app.session_interface.save(session)
+    yield sse("done", {"html": process_markdown(final) if final else ""})
+
+def event_stream(input_state, thread, fallback):
+    return Response(
+        stream_with_context(stream_agent_events(input_state, thread, fallback)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+# endregion
 
 # HTML template with modern design
 template = """
@@ -381,6 +541,17 @@ template = """
             font-size: 18px;
         }
         
+        .tool-event {
+            align-self: flex-start;
+            font-size: 13px;
+            color: var(--text-secondary);
+            padding: 0 4px;
+        }
+        
+        .tool-event i {
+            margin-right: 6px;
+        }
+        
         .typing-indicator {
             display: flex;
             align-items: center;
@@ -558,8 +729,32 @@ template = """
         // Scroll to bottom on page load
         scrollToBottom();
         
-        // Function to initialize chat
-        function initializeChat() {
+        // Parse the Server-Sent Events of a streamed response and dispatch them to the handlers
+        async function readEventStream(response, handlers) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf("\\n\\n")) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let eventName = "message";
+                    let data = "";
+                    frame.split("\\n").forEach((line) => {
+                        if (line.startsWith("event:")) eventName = line.slice(6).trim();
+                        else if (line.startsWith("data:")) data += line.slice(5).trim();
+                    });
+                    if (handlers[eventName]) handlers[eventName](JSON.parse(data || "{}"));
+                }
+            }
+        }
+        
+        // Stream the agent reply of a request into the chat as it is produced
+        function streamAgentReply(url, body) {
             // Add typing indicator
             const typingIndicator = document.createElement("div");
             typingIndicator.className = "typing-indicator";
@@ -567,28 +762,80 @@ template = """
             messagesContainer.appendChild(typingIndicator);
             scrollToBottom();
             
-            // Initialize chat with empty message
-            fetch("/initialize", {
+            let agentMessageDiv = null;
+            const removeIndicator = () => {
+                if (typingIndicator.parentNode) messagesContainer.removeChild(typingIndicator);
+            };
+            const currentMessage = () => {
+                if (!agentMessageDiv) {
+                    agentMessageDiv = document.createElement("div");
+                    agentMessageDiv.className = "message agent";
+                    messagesContainer.insertBefore(agentMessageDiv, typingIndicator);
+                }
+                return agentMessageDiv;
+            };
+            const addToolEvent = (icon, text) => {
+                const eventDiv = document.createElement("div");
+                eventDiv.className = "tool-event";
+                eventDiv.innerHTML = '<i class="fas ' + icon + '"></i>';
+                eventDiv.appendChild(document.createTextNode(text));
+                messagesContainer.insertBefore(eventDiv, typingIndicator);
+                // The next text belongs to a new agent message
+                agentMessageDiv = null;
+                scrollToBottom();
+                return eventDiv;
+            };
+            // One event per tool call in progress, updated in place
+            const progressEvents = {};
+            
+            return fetch(url, {
                 method: "POST",
                 headers: {
-                    "Content-Type": "application/json"
-                }
+                    "Content-Type": "application/json",
+                    "Accept": "text/event-stream"
+                },
+                body: JSON.stringify(body || {})
             })
-            .then(response => response.json())
-            .then(data => {
-                // Remove typing indicator
-                messagesContainer.removeChild(typingIndicator);
-                
-                // Add agent message
-                const messageDiv = document.createElement("div");
-                messageDiv.className = "message agent";
-                messageDiv.innerHTML = data.message;
-                messagesContainer.appendChild(messageDiv);
-                
-                // Apply syntax highlighting to code blocks
-                highlightNewCode();
-                scrollToBottom();
-            });
+            .then(response => readEventStream(response, {
+                // Raw text shown at once, replaced by its markdown on the next render
+                token: (data) => {
+                    currentMessage().appendChild(document.createTextNode(data.text));
+                    scrollToBottom();
+                },
+                render: (data) => {
+                    currentMessage().innerHTML = data.html;
+                    highlightNewCode();
+                    scrollToBottom();
+                },
+                tool_start: (data) => addToolEvent("fa-gear", "Calling " + data.name + "..."),
+                tool_progress: (data) => {
+                    if (!progressEvents[data.name]) progressEvents[data.name] = addToolEvent("fa-spinner", "");
+                    progressEvents[data.name].lastChild.textContent = data.name + ": " + data.text;
+                },
+                tool_result: (data) => {
+                    delete progressEvents[data.name];
+                    addToolEvent("fa-check", data.name + " finished");
+                },
+                error: (data) => {
+                    currentMessage().innerHTML = data.html;
+                    scrollToBottom();
+                },
+                // The final message, rendered in full (the last render may be throttled away)
+                done: (data) => {
+                    if (data.html) {
+                        currentMessage().innerHTML = data.html;
+                        highlightNewCode();
+                    }
+                    removeIndicator();
+                    scrollToBottom();
+                }
+            }))
+            .finally(removeIndicator);
+        }
+        
+        // Function to initialize chat
+        function initializeChat() {
+            streamAgentReply("/initialize/stream");
         }
         
         // Clear chat button
@@ -627,36 +874,8 @@ template = """
             // Clear input
             userInput.value = "";
             
-            // Add typing indicator
-            const typingIndicator = document.createElement("div");
-            typingIndicator.className = "typing-indicator";
-            typingIndicator.innerHTML = '<div class="typing-dots"><div class="dot"></div><div class="dot"></div><div class="dot"></div></div>';
-            messagesContainer.appendChild(typingIndicator);
-            scrollToBottom();
-            
-            // Send message to server
-            fetch("/chat", {
-                method: "POST",
-                headers: {
-                    "Content-Type": "application/json"
-                },
-                body: JSON.stringify({ user_input: userMessage })
-            })
-            .then(response => response.json())
-            .then(data => {
-                // Remove typing indicator
-                messagesContainer.removeChild(typingIndicator);
-                
-                // Add agent message with HTML content
-                const agentMessageDiv = document.createElement("div");
-                agentMessageDiv.className = "message agent";
-                agentMessageDiv.innerHTML = data.message;
-                messagesContainer.appendChild(agentMessageDiv);
-                
-                // Apply syntax highlighting to code blocks
-                highlightNewCode();
-                scrollToBottom();
-            });
+            // Stream the agent reply from the server
+            streamAgentReply("/chat/stream", { user_input: userMessage });
         });
     </script>
 </body>
@@ -672,25 +891,30 @@ def make_session_permanent():
 def chat():
     # Start a new chat on page refresh by clearing session data
     session["messages"] = []
-    session["thread_id"] = str(uuid.uuid4())
+    new_thread()
+    
+    # ?account=<name> switches the session to another mailbox that has authorized the app
+    # (a token file in GMAIL_TOKEN_DIR). Put the frontend behind authentication before serving several users.
+    account = request.args.get("account")
+    if account and get_agent().toolkit.pool.has_account(account):
+        session["account"] = account
     
     return render_template_string(template, messages=[])
 
 @app.route("/initialize", methods=["POST"])
 def initialize_chat():
-    # Create a new thread ID
-    session["thread_id"] = str(uuid.uuid4())
+    # Create a new thread
     session["messages"] = []
+    thread = new_thread()
     
-    # Create a new thread configuration
-    thread = {"configurable": {"thread_id": session["thread_id"]}}
+    from langchain_core.messages import HumanMessage, AIMessage
     
     # Send a greeting message instead of empty content
-    init_state = {"messages": [HumanMessage(content="Welcome the user and introduce yourself")]}
+    init_state = {"messages": [HumanMessage(content=GREETING_PROMPT)]}
     agent_response = ""
     
     try:
-        for event in global_agent.graph.stream(init_state, thread):
+        for event in get_agent().graph.stream(init_state, thread):
             for v in event.values():
                 msg = v["messages"][-1]
                 if isinstance(msg, AIMessage) and msg.content:
@@ -710,27 +934,24 @@ def initialize_chat():
 
 @app.route("/chat", methods=["POST"])
 def process_message():
+    from langchain_core.messages import HumanMessage, AIMessage
+    
     user_input = request.json.get("user_input")
     
     if not user_input:
         return jsonify({"success": False, "message": "No input provided"})
     
+    # Get thread configuration, before the new message is added to the session history
+    thread = ensure_thread()
+    
     # Add user message to session
     session["messages"].append({"type": "user", "content": user_input})
+    session.modified = True  # In-place changes to the list are not detected by the session
     
-    # Get thread configuration
-    thread = {"configurable": {"thread_id": session.get("thread_id", str(uuid.uuid4()))}}
-    
-    # Create conversation history
-    conversation_history = [
-        HumanMessage(content=m["content"]) if m["type"] == "user" else AIMessage(content=m["content"])
-        for m in session["messages"]
-    ]
-    
-    # Get agent response
+    # Only the new message is sent, the checkpointer already holds the rest of the conversation
     agent_response = ""
     try:
-        for event in global_agent.graph.stream({"messages": conversation_history}, thread):
+        for event in get_agent().graph.stream({"messages": [HumanMessage(content=user_input)]}, thread):
             for v in event.values():
                 msg = v["messages"][-1]
                 if isinstance(msg, AIMessage) and msg.content:
@@ -748,15 +969,111 @@ def process_message():
     
     return jsonify({"success": True, "message": html_response})
 
+@app.route("/initialize/stream", methods=["POST"])
+def initialize_chat_stream():
+    # Create a new thread
+    from langchain_core.messages import HumanMessage
+    
+    session["messages"] = []
+    thread = new_thread()
+    
+    init_state = {"messages": [HumanMessage(content=GREETING_PROMPT)]}
+    fallback = "I'm ready to help you with Gmail. What would you like to know or do today?"
+    return event_stream(init_state, thread, fallback)
+
+@app.route("/chat/stream", methods=["POST"])
+def process_message_stream():
+    from langchain_core.messages import HumanMessage
+    
+    user_input = request.json.get("user_input")
+    
+    if not user_input:
+        return Response(sse("error", {"html": "No input provided"}), mimetype="text/event-stream")
+    
+    thread = ensure_thread()
+    session["messages"].append({"type": "user", "content": user_input})
+    session.modified = True
+    
+    # The agent reply is added to the session once streamed (see stream_agent_events)
+    fallback = "I encountered an error processing your request. Please try again."
+    return event_stream({"messages": [HumanMessage(content=user_input)]}, thread, fallback)
+
 @app.route("/clear", methods=["POST"])
 def clear_chat():
     # Clear session messages
     session["messages"] = []
     
-    # Initialize a new agent (reinitialize)
-    session["thread_id"] = str(uuid.uuid4())
+    # Forget the old thread and start a new one
+    if global_agent is not None and session.get("thread_id"):
+        global_agent.graph.checkpointer.delete_thread(session["thread_id"])
+    new_thread()
     
     return jsonify({"success": True})
 
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(global_response_cache.stats())
+
+@app.route("/tokens/report", methods=["GET"])
+def token_report():
+    if global_agent is None:
+        return jsonify({})
+    return jsonify(global_agent.token_accountant.report(top=request.args.get("top", 10, type=int)))
+
+@app.route("/router/stats", methods=["GET"])
+def router_stats():
+    if global_agent is None or global_agent.router is None:
+        return jsonify({})
+    return jsonify(global_agent.router.stats())
+
+# region TELEMETRY
+UNTRACED_ENDPOINTS = {"metrics", "static"}
+
+@app.before_request
+def start_request_span():
+    """Time every request as an "http" span, the parent of the graph, LLM, tool and Gmail spans of the turn."""
+    if request.endpoint in UNTRACED_ENDPOINTS:
+        return
+    g.parent_span = tracer.current()
+    g.request_span = tracer.start("http", f"{request.method} {request.url_rule.rule if request.url_rule else 'unknown'}")
+    g.request_span.payload_bytes = request.content_length or 0
+    tracer.activate(g.request_span)
+
+@app.after_request
+def record_response(response):
+    span = g.get("request_span")
+    if span is not None:
+        span.set(status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_span(error=None):
+    # Streamed responses (/chat/stream) are torn down once the stream ends, so the span covers the whole turn
+    span = g.pop("request_span", None)
+    if span is None:
+        return
+    if error is not None:
+        span.fail(error)
+    elif span.attributes.get("status", 200) >= 500:
+        span.fail(f"HTTP {span.attributes['status']}")
+    tracer.activate(g.pop("parent_span", None))
+    tracer.finish(span)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus metrics of the spans: duration histograms, errors and payload sizes by kind and name."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+# endregion
+
+@app.route("/checkpoints/stats", methods=["GET"])
+def checkpoint_stats():
+    if global_agent is None:
+        return jsonify({})
+    return jsonify(global_agent.graph.checkpointer.stats())
+
+# Set AGENT_WARMUP=0 to build the agent on the first chat instead
+if os.getenv("AGENT_WARMUP", "1") != "0":
+    warm_up_agent()
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+class SQLiteSessionStore:
+    """Sessions persisted in a SQLite database, shared between worker processes and kept across restarts."""
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600.0):
+        """
+        Initializes the SQLiteSessionStore object.
+
+        Args:
+            path (str): The SQLite database.
+            ttl (float): Seconds a session is kept after its last change.
+        """
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS sessions '
+                             '(sid TEXT PRIMARY KEY, updated REAL NOT NULL, data TEXT NOT NULL)')
+
+    def get(self, sid: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute('SELECT updated, data FROM sessions WHERE sid = ?', (sid,)).fetchone()
+        if row is None or time.time() - row[0] >= self.ttl:
+            return None
+        return json.loads(row[1])
+
+    def set(self, sid: str, data: Dict) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO sessions (sid, updated, data) VALUES (?, ?, ?)',
+                             (sid, now, json.dumps(data)))
+            self._db.execute('DELETE FROM sessions WHERE updated < ?', (now - self.ttl,))
+
+    def delete(self, sid: str) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class FileSessionStore:
+    """Sessions persisted as one JSON file each in a directory."""
+
+    def __init__(self, directory: str, ttl: float = 7 * 24 * 3600.0):
+        """
+        Initializes the FileSessionStore object.
+
+        Args:
+            directory (str): The directory of the session files, created if needed.
+            ttl (float): Seconds a session is kept after its last change.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid: str) -> str:
+        return os.path.join(self.directory, f'{sid}.json')
+
+    def get(self, sid: str) -> Optional[Dict]:
+        path = self._path(sid)
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, sid: str, data: Dict) -> None:
+        # Written aside and renamed, so a reader never sees a partial file
+        temporary = f'{self._path(sid)}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(data, f)
+        os.replace(temporary, self._path(sid))
+
+    def delete(self, sid: str) -> None:
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+
+class MemorySessionStore:
+    """
+    In-process LRU of sessions with an idle TTL, optionally in front of a persistent store
+    (SQLiteSessionStore or FileSessionStore).
+
+    Reads are served from memory and only fall through to the persistent store on a miss, e.g. after
+    a restart or in another worker process. Writes go to both.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 3600.0, backend=None):
+        """
+        Initializes the MemorySessionStore object.
+
+        Args:
+            max_entries (int): Maximum number of sessions kept in memory.
+            ttl (float): Seconds a session is kept in memory after its last use.
+            backend: Optional persistent store with the same get/set/delete methods.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries: 'OrderedDict[str, Tuple[float, Dict]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries[sid] = (now, entry[1])
+                self._entries.move_to_end(sid)
+                return dict(entry[1])
+            self._entries.pop(sid, None)
+        data = self.backend.get(sid) if self.backend is not None else None
+        if data is not None:
+            self._remember(sid, data)
+        return data
+
+    def set(self, sid: str, data: Dict) -> None:
+        self._remember(sid, data)
+        if self.backend is not None:
+            self.backend.set(sid, data)
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._entries.pop(sid, None)
+        if self.backend is not None:
+            self.backend.delete(sid)
+
+    def _remember(self, sid: str, data: Dict) -> None:
+        with self._lock:
+            # A shallow copy, the request keeps working on its own dict
+            self._entries[sid] = (time.monotonic(), dict(data))
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session data kept on the server, the cookie only holds its ID."""
+
+    def __init__(self, data: Optional[Dict] = None, sid: Optional[str] = None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(data, on_update)
+        self.new = sid is None
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface storing the session data in a session store, keyed by an opaque random ID.
+
+    The cookie stays a few dozen bytes however long the conversation gets, and it is only sent when
+    a session is created, so the per-request overhead does not grow with the history.
+    """
+
+    def __init__(self, store):
+        """
+        Initializes the ServerSideSessionInterface object.
+
+        Args:
+            store: The session store, e.g. MemorySessionStore(backend=SQLiteSessionStore(path)).
+        """
+        self.store = store
+
+    def open_session(self, app, request) -> ServerSideSession:
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and _SESSION_ID.match(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSideSession(data, sid)
+        # Unknown or expired ID: start a new session rather than trusting the ID sent by the client
+        return ServerSideSession()
+
+    def save_session(self, app, session: ServerSideSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified or session.new:
+            self.save(session)
+        if session.new or (session.permanent and app.config['SESSION_REFRESH_EACH_REQUEST']):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+        response.vary.add('Cookie')
+
+    def save(self, session: ServerSideSession) -> None:
+        """
+        Store the session now. Changes made while a response is streamed happen after save_session,
+        so they are saved explicitly with this method.
+        """
+        self.store.set(session.sid, dict(session))
+        session.modified = False
@@ -0,0 +1,405 @@
+import asyncio
+import os
+import sys
+
+import httpx
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from typing import AsyncIterator, Callable, Dict, List, Optional, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.gmail_api import (CircuitBreaker, GmailAPI, GmailAPIError, GmailError, LabelCache, RetryPolicy,
+                                 _error_status, _is_failure, criteria_to_query)
+from telemetry.tracing import traced_methods, tracer
+
+
+GMAIL_BASE_URL = 'https://gmail.googleapis.com/gmail/v1'
+
+
+@traced_methods('gmail', failure=_is_failure, exclude=('load_credentials', 'close'))
+class AsyncGmailAPI:
+    """
+    Asyncio counterpart of GmailAPI.
+
+    Every call goes through one pooled httpx.AsyncClient with keep-alive connections, so many
+    Gmail calls can be in flight at once on a single event loop without holding a thread each.
+    The method surface mirrors GmailAPI; the batch HTTP mode is not needed here because
+    independent calls can simply be awaited together with asyncio.gather.
+    """
+
+    SCOPES = GmailAPI.SCOPES
+    load_credentials = GmailAPI.load_credentials
+
+    def __init__(self, credentials_path: str, token_path: str, label_cache_ttl: float = 300.0,
+                 base_url: str = GMAIL_BASE_URL, max_connections: int = 20,
+                 max_keepalive_connections: int = 10, timeout: float = 30.0,
+                 credentials: Optional[Credentials] = None, retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None):
+        """
+        Initializes the AsyncGmailAPI object.
+
+        Args:
+            credentials_path (str): The path to the credentials file.
+            token_path (str): The path to the token file.
+            label_cache_ttl (float): Seconds a full label listing is reused before refetching.
+            base_url (str): Root of the Gmail REST API, overridable to target a local server.
+            max_connections (int): Maximum number of pooled connections.
+            max_keepalive_connections (int): Maximum number of idle connections kept alive.
+            timeout (float): Timeout in seconds of every HTTP request.
+            credentials (Credentials): Already loaded credentials. If None they are loaded
+                from the token file on authenticate.
+            retry_policy (RetryPolicy): Retry and backoff policy of every call.
+            circuit_breaker (CircuitBreaker): Breaker guarding the calls. Defaults to the one shared
+                with every other client of the same token (account).
+        """
+        self.credentials_path = credentials_path
+        self.token_path = token_path
+        self.base_url = base_url.rstrip('/')
+        self.creds = credentials
+        self.credential_manager = None
+        self.label_cache = LabelCache(ttl=label_cache_ttl)
+        self.retry_policy = retry_policy or RetryPolicy(network_errors=(httpx.TransportError,))
+        self.circuit_breaker = circuit_breaker or CircuitBreaker.for_account(str(token_path))
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections))
+        self._refresh_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> 'AsyncGmailAPI':
+        await self.authenticate()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    # region AUTHENTICATION
+    async def authenticate(self) -> None:
+        """Load the credentials without blocking the event loop."""
+        if self.creds is None:
+            self.creds = await asyncio.to_thread(self.load_credentials)
+
+    async def close(self) -> None:
+        """Close the pooled connections."""
+        await self.client.aclose()
+
+    async def _headers(self) -> Dict[str, str]:
+        if self.creds is None:
+            return {}
+        if not self.creds.valid:
+            async with self._refresh_lock:
+                if not self.creds.valid:
+                    await asyncio.to_thread(self.creds.refresh, Request())
+        return {'Authorization': f'Bearer {self.creds.token}'}
+
+    async def _request(self, method: str, path: str, operation: str, params: Optional[Dict] = None,
+                       json: Optional[Dict] = None) -> Dict:
+        """
+        Send a request with the same retry, backoff and circuit breaker rules as GmailAPI._execute.
+
+        Raises:
+            GmailAPIError: If the call failed permanently, ran out of attempts or the circuit is open.
+        """
+        attempt = 0
+        with tracer.span('gmail_request', operation) as span:
+            while True:
+                if not self.circuit_breaker.allow():
+                    raise GmailAPIError(GmailError(
+                        operation=operation, retryable=True, attempts=attempt, circuit_open=True,
+                        message=f'too many recent failures, retry in {self.circuit_breaker.retry_in():.0f}s'))
+                attempt += 1
+                span.set(attempts=attempt)
+                try:
+                    response = await self.client.request(
+                        method, path, params=params, json=json, headers=await self._headers())
+                    response.raise_for_status()
+                except Exception as error:
+                    retryable = self.retry_policy.is_retryable(error)
+                    if retryable:
+                        self.circuit_breaker.record_failure()
+                    else:
+                        self.circuit_breaker.record_success()
+                    if not retryable or attempt >= self.retry_policy.max_attempts:
+                        span.set(status=_error_status(error))
+                        raise GmailAPIError(GmailError.from_exception(operation, error, retryable, attempt)) from error
+                    await asyncio.sleep(self.retry_policy.delay(attempt, error))
+                    continue
+                self.circuit_breaker.record_success()
+                span.payload_bytes = len(response.content)
+                if not response.content:
+                    return {}
+                return response.json()
+
+    _failure = staticmethod(GmailAPI._failure)
+    # endregion
+
+    # region LABELS
+    async def list_labels(self, refresh: bool = False) -> Union[List[Dict], GmailError]:
+        """
+        List all the labels in the user's gmail account.
+
+        Args:
+            refresh (bool): Skip the cache and reload the labels from Gmail.
+
+        Returns:
+            A list of label resources if successful, a GmailError otherwise.
+        """
+        if not refresh and self.label_cache.is_fresh():
+            return self.label_cache.labels()
+        try:
+            labels = (await self._request('GET', '/users/me/labels', 'labels.list')).get('labels', [])
+            self.label_cache.load(labels)
+            return labels
+        except Exception as error:
+            return self._failure('labels.list', error)
+
+    async def create_label(self, label_content: Dict) -> Union[Dict, GmailError]:
+        """
+        Create a new label for the authenticated user.
+
+        Args:
+            label_content (Dict): A dictionary containing the label information, as in GmailAPI.create_label.
+
+        Returns:
+            Created label resource if successful, a GmailError otherwise.
+        """
+        try:
+            label = await self._request('POST', '/users/me/labels', 'labels.create', json=label_content)
+            self.label_cache.put(label)
+            return label
+        except Exception as error:
+            return self._failure('labels.create', error)
+
+    async def delete_label(self, label_id: str) -> Optional[GmailError]:
+        """
+        Delete a label by its ID.
+
+        Args:
+            label_id (str): The ID of the label to delete.
+        """
+        try:
+            await self._request('DELETE', f'/users/me/labels/{label_id}', 'labels.delete')
+            self.label_cache.remove(label_id)
+        except Exception as error:
+            return self._failure('labels.delete', error)
+
+    async def get_label_id(self, label_name: str) -> Union[str, None, GmailError]:
+        """
+        Get the ID of a label by its name.
+
+        Args:
+            label_name (str): The name of the label to get the ID for.
+
+        Returns:
+            The ID of the label if found, None otherwise.
+        """
+        label_id = self.label_cache.get_id(label_name)
+        if label_id is not None or self.label_cache.is_fresh():
+            return label_id
+
+        labels = await self.list_labels(refresh=True)
+        if isinstance(labels, GmailError):
+            return labels
+        return self.label_cache.get_id(label_name)
+
+    async def update_label(self, label_id: str, label_content: Dict) -> Union[Dict, GmailError]:
+        """
+        Update an existing label's name and/or color.
+
+        Args:
+            label_id (str): The ID of the label to update.
+            label_content (Dict): A dictionary containing the label information, as in GmailAPI.update_label.
+
+        Returns:
+            Updated label resource if successful, a GmailError otherwise.
+        """
+        try:
+            label = await self._request('PATCH', f'/users/me/labels/{label_id}', 'labels.patch', json=label_content)
+            self.label_cache.put(label)
+            return label
+        except Exception as error:
+            return self._failure('labels.patch', error)
+    # endregion
+
+    # region FILTERS
+    async def list_filters(self) -> Union[List[Dict], GmailError]:
+        """
+        List all filters for the authenticated user.
+
+        Returns:
+            List of filter resources if successful, a GmailError otherwise.
+        """
+        try:
+            return (await self._request('GET', '/users/me/settings/filters', 'filters.list')).get('filter', [])
+        except Exception as error:
+            return self._failure('filters.list', error)
+
+    async def get_filter(self, filter_id: str) -> Union[Dict, GmailError]:
+        """
+        Get a filter by its ID.
+
+        Args:
+            filter_id (str): The ID of the filter to get.
+
+        Returns:
+            The filter resource if successful, a GmailError otherwise.
+        """
+        try:
+            return await self._request('GET', f'/users/me/settings/filters/{filter_id}', 'filters.get')
+        except Exception as error:
+            return self._failure('filters.get', error)
+
+    async def create_filter(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> Union[Dict, GmailError]:
+        """
+        Create a GMail filter that automatically applies a label to matching messages.
+
+        Args:
+            criteria (Dict[str, str]): Filter criteria dictionary, as in GmailAPI.create_filter.
+            actions (Dict[str, Union[str, List[str]]]): Filter actions dictionary, as in GmailAPI.create_filter.
+
+        Returns:
+            Created filter resource if successful, a GmailError otherwise.
+        """
+        try:
+            filter_content = {
+                'criteria': criteria,
+                'action': GmailAPI.normalize_filter_actions(actions)
+            }
+            return await self._request('POST', '/users/me/settings/filters', 'filters.create', json=filter_content)
+        except Exception as error:
+            return self._failure('filters.create', error)
+
+    async def delete_filter(self, filter_id: str) -> Optional[GmailError]:
+        """
+        Delete a filter by its ID.
+
+        Args:
+            filter_id (str): The ID of the filter to delete.
+        """
+        try:
+            await self._request('DELETE', f'/users/me/settings/filters/{filter_id}', 'filters.delete')
+        except Exception as error:
+            return self._failure('filters.delete', error)
+
+    async def update_filter(self, filter_id: str, criteria: Optional[Dict[str, str]] = None,
+                            actions: Optional[Dict[str, Union[str, List[str]]]] = None) -> Union[Dict, GmailError]:
+        """
+        Update an existing filter by creating a new one with the new criteria and actions and deleting it.
+        The filter is deleted only once the new one exists, so a failed update keeps it.
+
+        Args:
+            filter_id (str): The ID of the filter to update.
+            criteria (Dict[str, str]): Filter criteria dictionary, as in GmailAPI.create_filter.
+            actions (Dict[str, Union[str, List[str]]]): Filter actions dictionary, as in GmailAPI.create_filter.
+
+        Returns:
+            Updated filter resource if successful, a GmailError otherwise.
+        """
+        created = await self.create_filter(criteria, actions)
+        if isinstance(created, GmailError):
+            return created
+        # The update took effect even if the previous filter could not be deleted (the failure is logged)
+        await self.delete_filter(filter_id)
+        return created
+    # endregion
+
+    # region MESSAGES
+    MODIFY_CHUNK_SIZE = GmailAPI.MODIFY_CHUNK_SIZE
+
+    async def iter_message_ids(self, query: str, page_size: int = 500) -> AsyncIterator[List[str]]:
+        """
+        Page through the IDs of the messages matching a Gmail search query.
+
+        Args:
+            query (str): Gmail search query.
+            page_size (int): Number of IDs requested per page (max 500).
+
+        Yields:
+            One list of message IDs per page.
+        """
+        params = {'q': query, 'maxResults': page_size, 'fields': 'messages/id,nextPageToken'}
+        while True:
+            response = await self._request('GET', '/users/me/messages', 'messages.list', params=params)
+            yield [message['id'] for message in response.get('messages', [])]
+            if not response.get('nextPageToken'):
+                return
+            params['pageToken'] = response['nextPageToken']
+
+    async def batch_modify_messages(self, message_ids: List[str], add_label_ids: Optional[List[str]] = None,
+                                    remove_label_ids: Optional[List[str]] = None) -> None:
+        """
+        Add and/or remove labels on up to 1000 messages in a single call.
+
+        Args:
+            message_ids (List[str]): The IDs of the messages to modify.
+            add_label_ids (List[str]): The IDs of the labels to add.
+            remove_label_ids (List[str]): The IDs of the labels to remove.
+        """
+        body = {
+            'ids': message_ids,
+            'addLabelIds': add_label_ids or [],
+            'removeLabelIds': remove_label_ids or []
+        }
+        await self._request('POST', '/users/me/messages/batchModify', 'messages.batchModify', json=body)
+
+    async def apply_filter_to_existing(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]],
+                                       max_workers: int = 4,
+                                       progress_callback: Optional[Callable[[Dict], None]] = None) -> Union[Dict, GmailError]:
+        """
+        Apply the label actions of a filter to the messages already in the mailbox.
+
+        Same contract as GmailAPI.apply_filter_to_existing, with `max_workers` bounding the
+        number of concurrent batchModify calls instead of worker threads.
+        """
+        query = criteria_to_query(criteria)
+        add_label_ids = GmailAPI._split_label_ids(actions.get('addLabelIds'))
+        remove_label_ids = GmailAPI._split_label_ids(actions.get('removeLabelIds'))
+        if not query:
+            return self._failure('messages.batchModify', ValueError(
+                'refusing to apply a filter without criteria to the whole mailbox'))
+
+        progress = {'query': query, 'matched': 0, 'modified': 0, 'failed': 0}
+        if not add_label_ids and not remove_label_ids:
+            return progress
+
+        slots = asyncio.Semaphore(max_workers)
+        tasks = set()
+
+        async def modify(chunk: List[str]) -> None:
+            try:
+                await self.batch_modify_messages(chunk, add_label_ids, remove_label_ids)
+                progress['modified'] += len(chunk)
+            except Exception as error:
+                self._failure('messages.batchModify', error)
+                progress['failed'] += len(chunk)
+            finally:
+                slots.release()
+            if progress_callback is not None:
+                progress_callback(dict(progress))
+
+        async def submit(chunk: List[str]) -> None:
+            await slots.acquire()
+            task = asyncio.create_task(modify(chunk))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            chunk: List[str] = []
+            async for page in self.iter_message_ids(query):
+                progress['matched'] += len(page)
+                chunk.extend(page)
+                while len(chunk) >= self.MODIFY_CHUNK_SIZE:
+                    await submit(chunk[:self.MODIFY_CHUNK_SIZE])
+                    chunk = chunk[self.MODIFY_CHUNK_SIZE:]
+            if chunk:
+                await submit(chunk)
+        except Exception as error:
+            return self._failure('messages.list', error)
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        return progress
+    # endregion
@@ -0,0 +1,136 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.gmail_api import GmailAPI
+
+DEFAULT_ACCOUNT = 'default'
+_ACCOUNT = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.@+-]{0,127}$')
+
+# The account the Gmail calls of the current request, thread or task are made for
+current_account: ContextVar[str] = ContextVar('gmail_account', default=DEFAULT_ACCOUNT)
+
+
+@contextmanager
+def use_account(account: Optional[str]) -> Iterator[str]:
+    """Make the Gmail calls of the block use an account, e.g. `with use_account('jane@example.com'):`."""
+    token = current_account.set(account or DEFAULT_ACCOUNT)
+    try:
+        yield current_account.get()
+    finally:
+        current_account.reset(token)
+
+
+class GmailClientPool:
+    """
+    Authenticated GmailAPI clients of several accounts, keyed by account.
+
+    Clients are created on first use, each with its own token file, and evicted when they have been
+    idle for `idle_ttl` seconds or when more than `max_clients` are held (least recently used first).
+    The default account uses the token file given to the pool, the other accounts a token file named
+    after them in `token_directory`.
+    """
+
+    def __init__(self, credentials_path: str, token_path: Optional[str] = None, token_directory: Optional[str] = None,
+                 max_clients: int = 32, idle_ttl: float = 1800.0, factory: Optional[Callable[[str], GmailAPI]] = None):
+        """
+        Initializes the GmailClientPool object.
+
+        Args:
+            credentials_path (str): The OAuth client file shared by every account.
+            token_path (str): The token file of the default account.
+            token_directory (str): The directory of the other accounts' token files, `<account>.json`.
+            max_clients (int): Maximum number of clients kept.
+            idle_ttl (float): Seconds after its last use before a client is evicted.
+            factory (Callable[[str], GmailAPI]): Builds the client of an account. Defaults to a GmailAPI
+                on the account's token file.
+        """
+        self.credentials_path = credentials_path
+        self.default_token_path = token_path
+        self.token_directory = token_directory
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.factory = factory or self._create
+        self.created = 0
+        self.evictions = 0
+        self._clients: 'OrderedDict[str, Tuple[float, GmailAPI]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def token_path(self, account: str) -> Optional[str]:
+        """Return the token file of an account, None if the account is not valid or has no token directory."""
+        if account == DEFAULT_ACCOUNT:
+            return self.default_token_path
+        if not self.token_directory or not _ACCOUNT.match(account):
+            return None
+        return os.path.join(self.token_directory, f'{account}.json')
+
+    def has_account(self, account: str) -> bool:
+        """Whether an account is known, i.e. has authorized the app and has a token file."""
+        path = self.token_path(account)
+        return path is not None and os.path.exists(path)
+
+    def _create(self, account: str) -> GmailAPI:
+        token_path = self.token_path(account)
+        if token_path is None:
+            raise ValueError(f'Unknown Gmail account: {account!r}')
+        return GmailAPI(credentials_path=self.credentials_path, token_path=token_path)
+
+    def get(self, account: Optional[str] = None) -> GmailAPI:
+        """
+        Return the client of an account, creating it if needed.
+
+        Args:
+            account (str): The account, defaults to the one bound with use_account (or the default account).
+
+        Raises:
+            ValueError: If the account name is not valid.
+        """
+        account = account or current_account.get()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(account)
+            if entry is not None and now - entry[0] < self.idle_ttl:
+                self._clients[account] = (now, entry[1])
+                self._clients.move_to_end(account)
+                return entry[1]
+            if entry is not None:
+                self.evictions += 1
+            # The client authenticates on first use, so creating it under the lock is cheap
+            client = self.factory(account)
+            self.created += 1
+            self._clients[account] = (now, client)
+            self._clients.move_to_end(account)
+            self._evict(now)
+            return client
+
+    def evict(self, account: str) -> None:
+        """Forget the client of an account, e.g. after the user signed out."""
+        with self._lock:
+            if self._clients.pop(account, None) is not None:
+                self.evictions += 1
+
+    def _evict(self, now: float) -> None:
+        while self._clients:
+            account, (last_used, _) = next(iter(self._clients.items()))
+            if len(self._clients) <= self.max_clients and now - last_used < self.idle_ttl:
+                break
+            del self._clients[account]
+            self.evictions += 1
+
+    def __contains__(self, account: str) -> bool:
+        return account in self._clients
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def stats(self) -> Dict:
+        """Number of clients held, created and evicted."""
+        with self._lock:
+            return {'clients': len(self._clients), 'created': self.created, 'evictions': self.evictions}
@@ -0,0 +1,234 @@
+import datetime
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from google.oauth2.credentials import Credentials
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on `path` (created if needed), shared by every process and thread of the machine."""
+    with open(path, 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class CredentialManager:
+    """
+    The OAuth2 credentials of one token file, refreshed in the background before they expire.
+
+    Every client of the same token file in the process gets the same Credentials object
+    (see for_token), and refreshes update it in place, so a refresh done once is seen by every
+    thread and no request runs into an expired token. Refreshes hold a lock file next to the
+    token file: a process that gets the lock after another one refreshed the token reads the new
+    token from the file instead of refreshing it again. The token file is replaced atomically.
+    """
+
+    REFRESH_MARGIN = 300.0  # Seconds before the expiry a token is refreshed
+    RETRY_DELAY = 30.0  # Seconds before a failed background refresh is tried again
+
+    _registry: 'weakref.WeakValueDictionary[str, CredentialManager]' = weakref.WeakValueDictionary()
+    _registry_lock = threading.Lock()
+
+    def __init__(self, token_path: str, credentials_path: Optional[str] = None, scopes: Optional[List[str]] = None,
+                 refresh_margin: float = REFRESH_MARGIN):
+        """
+        Initializes the CredentialManager object.
+
+        Args:
+            token_path (str): The token file, read on first use and rewritten after every refresh.
+            credentials_path (str): The OAuth client file, used when there is no usable token yet.
+            scopes (List[str]): The scopes requested when running the OAuth flow.
+            refresh_margin (float): Seconds before the expiry the token is refreshed in the background.
+        """
+        self.token_path = token_path
+        self.credentials_path = credentials_path
+        self.scopes = scopes
+        self.refresh_margin = refresh_margin
+        self.creds: Optional[Credentials] = None
+        self.refreshes = 0
+        self.adopted = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_token(cls, token_path: str, credentials_path: Optional[str] = None, scopes: Optional[List[str]] = None,
+                  **kwargs) -> 'CredentialManager':
+        """
+        Return the manager shared by every client of the same token file.
+
+        Managers are only kept while a client holds them, the background refresh of an
+        account stops once its clients are gone.
+        """
+        key = os.path.abspath(token_path)
+        with cls._registry_lock:
+            manager = cls._registry.get(key)
+            if manager is None:
+                manager = cls._registry[key] = cls(token_path, credentials_path, scopes, **kwargs)
+            return manager
+
+    # region CREDENTIALS
+    def credentials(self) -> Credentials:
+        """
+        Return valid credentials, loading them on first use and scheduling their background refresh.
+        Only the first call may wait for a refresh (or the OAuth flow), later ones never do.
+        """
+        with self._lock:
+            if self.creds is None:
+                self.creds = self._load()
+                _refresher.schedule(self, self.seconds_until_refresh())
+            return self.creds
+
+    def seconds_until_refresh(self) -> Optional[float]:
+        """Seconds before the token must be refreshed, None if it does not expire."""
+        if self.creds is None or self.creds.expiry is None:
+            return None
+        remaining = (self.creds.expiry - _utcnow()).total_seconds()
+        return max(0.0, remaining - self.refresh_margin)
+
+    def refresh(self) -> None:
+        """Refresh the token now, or adopt the one another process has just written."""
+        with self._lock:
+            if self.creds is not None:
+                self._refresh(self.creds)
+
+    def _load(self) -> Credentials:
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        creds = self._read()
+        if creds is not None and creds.refresh_token and (not creds.valid or self._expiring(creds)):
+            self._refresh(creds)
+        elif creds is None or not creds.valid:
+            flow = InstalledAppFlow.from_client_secrets_file(self.credentials_path, self.scopes)
+            creds = flow.run_local_server(port=0)
+            with file_lock(self.token_path + '.lock'):
+                self._write(creds)
+        return creds
+
+    def _refresh(self, creds: Credentials) -> None:
+        from google.auth.transport.requests import Request
+
+        with file_lock(self.token_path + '.lock'):
+            stored = self._read()
+            if stored is not None and stored.token != creds.token and stored.valid and not self._expiring(stored):
+                # Refreshed by another process while this one was waiting for the lock
+                creds.token = stored.token
+                creds.expiry = stored.expiry
+                self.adopted += 1
+                return
+            creds.refresh(Request())
+            self._write(creds)
+            self.refreshes += 1
+
+    def _expiring(self, creds: Credentials) -> bool:
+        return creds.expiry is not None and (creds.expiry - _utcnow()).total_seconds() <= self.refresh_margin
+
+    def _read(self) -> Optional[Credentials]:
+        if not os.path.exists(self.token_path):
+            return None
+        try:
+            return Credentials.from_authorized_user_file(self.token_path)
+        except (ValueError, json.JSONDecodeError) as error:
+            print(f'An error occurred: {error}')
+            return None
+
+    def _write(self, creds: Credentials) -> None:
+        # Written aside and renamed, so readers never see a partial token file
+        temporary = f'{self.token_path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as token:
+            token.write(creds.to_json())
+        os.replace(temporary, self.token_path)
+    # endregion
+
+    def _background_refresh(self) -> Optional[float]:
+        """Refresh the token if it is due, return the seconds before the next check (None to stop)."""
+        try:
+            delay = self.seconds_until_refresh()
+            if delay is None or delay > 0:
+                return delay
+            self.refresh()
+            self.last_error = None
+            delay = self.seconds_until_refresh()
+            # A token living less than the margin is not refreshed in a loop
+            return None if delay is None else max(delay, self.RETRY_DELAY)
+        except Exception as error:
+            # The token is still valid for up to refresh_margin seconds, and requests refresh it themselves when expired
+            self.failures += 1
+            self.last_error = str(error)
+            print(f'An error occurred: {error}')
+            return self.RETRY_DELAY
+
+    def stats(self) -> Dict:
+        """Refresh counters and the time left before the next refresh."""
+        return {
+            'refreshes': self.refreshes,
+            'adopted': self.adopted,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'seconds_until_refresh': self.seconds_until_refresh()
+        }
+
+
+class _Refresher:
+    """A single daemon thread running the background refresh of every CredentialManager when it is due."""
+
+    def __init__(self):
+        self._due: List = []  # Heap of (monotonic time, sequence, weak reference to the manager)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, manager: CredentialManager, delay: Optional[float]) -> None:
+        if delay is None:
+            return
+        with self._condition:
+            heapq.heappush(self._due, (time.monotonic() + delay, next(self._sequence), weakref.ref(manager)))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='credential-refresh', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._due or self._due[0][0] > time.monotonic():
+                    self._condition.wait(self._due[0][0] - time.monotonic() if self._due else None)
+                _, _, reference = heapq.heappop(self._due)
+            manager = reference()
+            if manager is not None:
+                self.schedule(manager, manager._background_refresh())
+            # Not kept alive while waiting for the next one
+            manager = None
+
+
+_refresher = _Refresher()
+
+
+def _utcnow() -> datetime.datetime:
+    # Credentials.expiry is a naive UTC datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,336 @@
+import bisect
+import os
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.search_query import (Node, criteria_to_query, normalize_label_name, parse_date, parse_query,
+                                    parse_relative, parse_size)
+
+
+SYSTEM_LABELS = {
+    'inbox': 'INBOX', 'spam': 'SPAM', 'trash': 'TRASH', 'sent': 'SENT', 'draft': 'DRAFT', 'drafts': 'DRAFT',
+    'unread': 'UNREAD', 'starred': 'STARRED', 'important': 'IMPORTANT', 'chats': 'CHAT',
+    'primary': 'CATEGORY_PERSONAL', 'social': 'CATEGORY_SOCIAL', 'promotions': 'CATEGORY_PROMOTIONS',
+    'updates': 'CATEGORY_UPDATES', 'forums': 'CATEGORY_FORUMS'
+}
+
+
+@dataclass
+class MessageMetadata:
+    """Headers and labels of a message, as returned by messages.get with format=metadata."""
+    id: str
+    thread_id: str = ''
+    sender: str = ''
+    to: str = ''
+    cc: str = ''
+    subject: str = ''
+    snippet: str = ''
+    label_ids: List[str] = field(default_factory=list)
+    date: float = 0.0  # Epoch seconds of the internal date
+    size_estimate: int = 0
+
+    @classmethod
+    def from_gmail(cls, message: Dict) -> 'MessageMetadata':
+        """Build the record from a Gmail message resource fetched with format=metadata."""
+        headers = {header['name'].lower(): header['value']
+                   for header in message.get('payload', {}).get('headers', [])}
+        return cls(
+            id=message['id'],
+            thread_id=message.get('threadId', ''),
+            sender=headers.get('from', ''),
+            to=headers.get('to', ''),
+            cc=headers.get('cc', ''),
+            subject=headers.get('subject', ''),
+            snippet=message.get('snippet', ''),
+            label_ids=list(message.get('labelIds', [])),
+            date=int(message.get('internalDate', 0)) / 1000,
+            size_estimate=int(message.get('sizeEstimate', 0))
+        )
+
+
+class _Column:
+    """
+    A text column of the store, kept as one newline separated corpus so a precompiled
+    pattern scans every message in a single regex pass instead of one call per message.
+    """
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self._corpus: Optional[str] = None
+        self._offsets: List[int] = []
+
+    def append(self, value: str) -> None:
+        self.parts.append(value.replace('\n', ' ').casefold())
+        self._corpus = None
+
+    def rows_matching(self, pattern: re.Pattern) -> Iterable[int]:
+        if self._corpus is None:
+            self._corpus = '\n'.join(self.parts)
+            self._offsets, position = [], 0
+            for part in self.parts:
+                self._offsets.append(position)
+                position += len(part) + 1
+        last_row = -1
+        for match in pattern.finditer(self._corpus):
+            row = bisect.bisect_right(self._offsets, match.start()) - 1
+            if row != last_row:
+                last_row = row
+                yield row
+
+
+class MessageStore:
+    """
+    Columnar, in-memory store of message metadata that filter criteria are evaluated against.
+
+    Rows are addressed by position, and sets of rows are represented as Python int bitmasks,
+    so the and/or/not of a query compile to single big-integer operations.
+    """
+
+    def __init__(self, messages: Iterable[MessageMetadata] = ()):
+        self.messages: List[MessageMetadata] = []
+        self.columns = {name: _Column() for name in ('from', 'to', 'cc', 'subject', 'snippet')}
+        self.label_rows: Dict[str, List[int]] = {}
+        self.label_names: Dict[str, str] = {}
+        self.loaded_at = time.monotonic()
+        self.version = 0
+        self.extend(messages)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def extend(self, messages: Iterable[MessageMetadata]) -> None:
+        for message in messages:
+            row = len(self.messages)
+            self.messages.append(message)
+            self.columns['from'].append(message.sender)
+            self.columns['to'].append(message.to)
+            self.columns['cc'].append(message.cc)
+            self.columns['subject'].append(message.subject)
+            self.columns['snippet'].append(message.snippet)
+            for label_id in message.label_ids:
+                self.label_rows.setdefault(label_id, []).append(row)
+        self.version += 1
+
+    def set_labels(self, labels: List[Dict]) -> None:
+        """Register the user's labels so `label:` can be resolved by name."""
+        self.label_names = {normalize_label_name(label['name']): label['id'] for label in labels}
+        self.version += 1
+
+    @property
+    def all_rows(self) -> int:
+        return (1 << len(self.messages)) - 1
+
+    def mask(self, rows: Iterable[int]) -> int:
+        """Build the bitmask of a set of rows."""
+        bits = bytearray((len(self.messages) + 7) // 8)
+        for row in rows:
+            bits[row >> 3] |= 1 << (row & 7)
+        return int.from_bytes(bits, 'little')
+
+    def rows(self, mask: int, limit: Optional[int] = None) -> List[int]:
+        """Return the rows of a bitmask, lowest first."""
+        rows = []
+        while mask and (limit is None or len(rows) < limit):
+            lowest = mask & -mask
+            rows.append(lowest.bit_length() - 1)
+            mask ^= lowest
+        return rows
+
+
+class FilterMatcher:
+    """
+    Compiles filter criteria and Gmail search queries into matchers over a MessageStore.
+
+    Every distinct predicate (e.g. `from:newsletter`, `label:work`) is evaluated once over the
+    whole store, with a precompiled pattern, into a bitmask that is cached and shared by every
+    query evaluated afterwards. Previewing many candidate rules therefore mostly costs a few
+    big-integer and/or/not operations per rule.
+    """
+
+    TEXT_FIELDS = ('subject', 'from', 'to', 'cc', 'snippet')
+
+    def __init__(self, store: MessageStore):
+        """
+        Initializes the FilterMatcher object.
+
+        Args:
+            store (MessageStore): The messages the criteria are evaluated against.
+        """
+        self.store = store
+        self._masks: Dict[Tuple, int] = {}
+        self._unsupported: Set[Tuple] = set()
+        self._version = store.version
+        self._lock = threading.Lock()
+
+    def match(self, query: Union[str, Node]) -> int:
+        """
+        Return the bitmask of the messages matching a Gmail search query (or a parsed query).
+        Messages whose outcome depends on an operator that cannot be checked locally never match.
+        """
+        return self._match(query)[0]
+
+    def _match(self, query: Union[str, Node]) -> Tuple[int, int]:
+        """Return the bitmasks of the messages matching a query, and of the ones that may match."""
+        node = parse_query(query) if isinstance(query, str) else query
+        with self._lock:
+            if self._version != self.store.version:
+                self._masks, self._unsupported, self._version = {}, set(), self.store.version
+            return self._evaluate(node)
+
+    def unsupported(self, query: Union[str, Node]) -> List[str]:
+        """Return the terms of an evaluated query that cannot be checked locally."""
+        node = parse_query(query) if isinstance(query, str) else query
+        return sorted({f"{term[1] or ''}:{term[2]}".lstrip(':') for term in self._terms(node)
+                       if self._key(term) in self._unsupported})
+
+    def match_criteria(self, criteria: Dict) -> int:
+        """Return the bitmask of the messages a filter with the given criteria would catch."""
+        return self.match(criteria_to_query(criteria))
+
+    def preview(self, criteria: Dict, sample_size: int = 5) -> Dict:
+        """
+        Preview a filter over the store.
+
+        Returns:
+            {
+                "query": the equivalent Gmail search query,
+                "matches": number of matching messages,
+                "total": number of messages in the store,
+                "samples": up to sample_size matching MessageMetadata, in store order (newest first),
+                "unsupported": operators that cannot be evaluated locally,
+                "uncertain": messages left out of the matches because they depend on those operators,
+                    so matches + uncertain is an upper bound of the real count,
+                "elapsed_ms": evaluation time
+            }
+        """
+        start = time.perf_counter()
+        query = criteria_to_query(criteria)
+        node = parse_query(query)
+        mask, possible = self._match(node)
+        # messages.list returns the newest messages first, so the lowest rows are the newest
+        samples = [self.store.messages[row] for row in self.store.rows(mask, limit=sample_size)]
+        return {
+            'query': query,
+            'matches': bin(mask).count('1'),
+            'total': len(self.store),
+            'samples': samples,
+            'unsupported': self.unsupported(node),
+            'uncertain': bin(possible & ~mask).count('1'),
+            'elapsed_ms': (time.perf_counter() - start) * 1000
+        }
+
+    # region EVALUATION
+    def _evaluate(self, node: Node) -> Tuple[int, int]:
+        """
+        Return the bitmask of the rows matching a node, and of the rows that may match it.
+
+        A term that cannot be evaluated locally may match any row, so its negation is not every
+        row but unknown as well; the rows in between are left out of the matches.
+        """
+        kind = node[0]
+        if kind == 'and':
+            mask = possible = self.store.all_rows
+            for child in node[1]:
+                child_mask, child_possible = self._evaluate(child)
+                mask &= child_mask
+                possible &= child_possible
+                if not possible:
+                    break
+            return mask, possible
+        if kind == 'or':
+            mask = possible = 0
+            for child in node[1]:
+                child_mask, child_possible = self._evaluate(child)
+                mask |= child_mask
+                possible |= child_possible
+            return mask, possible
+        if kind == 'not':
+            mask, possible = self._evaluate(node[1])
+            return self.store.all_rows & ~possible, self.store.all_rows & ~mask
+        key = self._key(node)
+        if key not in self._masks:
+            mask = self._predicate(*key)
+            if mask is None:
+                self._unsupported.add(key)
+            self._masks[key] = mask
+        mask = self._masks[key]
+        return (0, self.store.all_rows) if mask is None else (mask, mask)
+
+    @staticmethod
+    def _key(term: Node) -> Tuple:
+        # Quoted phrases and plain words are both matched as whole words, in order
+        return (term[1], term[2].casefold())
+
+    def _terms(self, node: Node) -> Iterable[Node]:
+        if node[0] == 'term':
+            yield node
+        elif node[0] == 'not':
+            yield from self._terms(node[1])
+        else:
+            for child in node[1]:
+                yield from self._terms(child)
+
+    def _predicate(self, field: Optional[str], value: str) -> Optional[int]:
+        """Evaluate a single term over the whole store, or return None if it cannot be evaluated locally."""
+        store = self.store
+        if field in (None, 'subject', 'from', 'to', 'cc', 'deliveredto'):
+            if field in ('from', 'to', 'cc'):
+                # Address operators match any part of the header, e.g. from:newsletter@
+                pattern = re.compile(re.escape(value))
+                columns = [field]
+            elif field == 'deliveredto':
+                pattern, columns = re.compile(re.escape(value)), ['to', 'cc']
+            else:
+                words = r'\W+'.join(re.escape(word) for word in value.split())
+                pattern = re.compile(rf'(?<!\w){words}(?!\w)')
+                columns = ['subject'] if field == 'subject' else list(self.TEXT_FIELDS)
+            rows = set()
+            for column in columns:
+                rows.update(store.columns[column].rows_matching(pattern))
+            return store.mask(rows)
+        if field in ('label', 'in', 'is', 'category'):
+            return self._label_mask(field, value)
+        if field == 'has':
+            if value in ('userlabels', 'nouserlabels'):
+                user_rows = {row for label_id, rows in store.label_rows.items()
+                             if label_id.startswith('Label_') for row in rows}
+                mask = store.mask(user_rows)
+                return mask if value == 'userlabels' else store.all_rows & ~mask
+            return None
+        if field in ('after', 'before', 'newer', 'older', 'older_than', 'newer_than'):
+            if field in ('older_than', 'newer_than'):
+                bound = parse_relative(value, time.time())
+            else:
+                bound = parse_date(value)
+            if bound is None:
+                return None
+            newer = field in ('after', 'newer', 'newer_than')
+            return store.mask(row for row, message in enumerate(store.messages)
+                              if (message.date >= bound if newer else message.date < bound))
+        if field in ('larger', 'smaller', 'size'):
+            size = parse_size(value)
+            if size is None:
+                return None
+            larger = field != 'smaller'
+            return store.mask(row for row, message in enumerate(store.messages)
+                              if (message.size_estimate > size if larger else message.size_estimate < size))
+        return None
+
+    def _label_mask(self, field: str, value: str) -> Optional[int]:
+        store = self.store
+        if field == 'in' and value == 'anywhere':
+            return store.all_rows
+        if field == 'is' and value == 'read':
+            return store.all_rows & ~store.mask(store.label_rows.get('UNREAD', []))
+        label_id = SYSTEM_LABELS.get(value)
+        if field in ('label', 'in') and label_id is None:
+            label_id = store.label_names.get(normalize_label_name(value))
+        if label_id is None:
+            return None
+        return store.mask(store.label_rows.get(label_id, []))
+    # endregion
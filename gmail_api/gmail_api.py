@@ -1,14 +1,338 @@
+import functools
+import json
 import os.path
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from email.utils import parsedate_to_datetime
 
-from google.auth.transport.requests import Request
+import httplib2
+from google.auth.exceptions import TransportError
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.errors import HttpError
 
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.credential_manager import CredentialManager
+from gmail_api.search_query import criteria_to_query
+from telemetry.tracing import traced, traced_methods, tracer
 
+
+# region ERROR HANDLING
+@dataclass
+class GmailError:
+    """
+    Structured description of a failed Gmail call.
+    
+    Instances are falsy, so callers checking `if not result` keep treating them as a failure,
+    while the toolkit can pass `str(error)` to the LLM to tell it whether retrying makes sense.
+    """
+    operation: str
+    message: str
+    status: Optional[int] = None
+    reason: Optional[str] = None
+    retryable: bool = False
+    attempts: int = 1
+    circuit_open: bool = False
+    
+    def __bool__(self) -> bool:
+        return False
+    
+    def __str__(self) -> str:
+        if self.circuit_open:
+            return (f"Gmail is temporarily unavailable ({self.operation} was not sent: {self.message}). "
+                    "Do not retry now, tell the user to try again in a minute.")
+        status = f"HTTP {self.status}, " if self.status else ""
+        hint = "temporary, can be retried later" if self.retryable else "not retryable"
+        return f"Gmail {self.operation} failed after {self.attempts} attempt(s): {self.message} ({status}{hint})."
+    
+    def to_dict(self) -> Dict:
+        return asdict(self)
+    
+    @classmethod
+    def from_exception(cls, operation: str, error: Exception, retryable: bool = False, attempts: int = 1) -> 'GmailError':
+        """Build the structured error from an exception raised by the client library or httpx."""
+        return cls(operation=operation, message=_error_message(error), status=_error_status(error),
+                   reason=_error_reason(error), retryable=retryable, attempts=attempts)
+
+
+class GmailAPIError(Exception):
+    """Raised by the central call wrapper, carrying the structured GmailError."""
+    
+    def __init__(self, error: GmailError):
+        super().__init__(str(error))
+        self.error = error
+
+
+def _error_status(error: Exception) -> Optional[int]:
+    if isinstance(error, HttpError):
+        return error.resp.status
+    response = getattr(error, 'response', None)  # httpx.HTTPStatusError
+    return getattr(response, 'status_code', None)
+
+
+def _error_payload(error: Exception) -> Dict:
+    content = getattr(error, 'content', None)
+    if content is None and getattr(error, 'response', None) is not None:
+        content = getattr(error.response, 'content', None)
+    try:
+        return json.loads(content).get('error', {}) if content else {}
+    except (ValueError, AttributeError):
+        return {}
+
+
+def _error_reason(error: Exception) -> Optional[str]:
+    details = _error_payload(error).get('errors') or []
+    return details[0].get('reason') if details else None
+
+
+def _error_message(error: Exception) -> str:
+    return _error_payload(error).get('message') or str(error) or error.__class__.__name__
+
+
+def _error_headers(error: Exception) -> Dict:
+    if isinstance(error, HttpError):
+        return error.resp
+    response = getattr(error, 'response', None)
+    return getattr(response, 'headers', None) or {}
+
+
+class RetryPolicy:
+    """Decides which Gmail errors are transient and how long to wait before retrying them."""
+    
+    RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+    RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'backendError'}
+    NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, httplib2.HttpLib2Error, TransportError)
+    
+    def __init__(self, max_attempts: int = 5, base_delay: float = 0.5, max_delay: float = 32.0,
+                 network_errors: Tuple[type, ...] = ()):
+        """
+        Initializes the RetryPolicy object.
+        
+        Args:
+            max_attempts (int): Maximum number of attempts of a call, including the first one.
+            base_delay (float): Delay in seconds before the first retry, doubled on every attempt.
+            max_delay (float): Upper bound in seconds of a single delay.
+            network_errors (Tuple[type, ...]): Extra exception types of the HTTP transport to retry.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.network_errors = self.NETWORK_ERRORS + tuple(network_errors)
+        
+    def is_retryable(self, error: Exception) -> bool:
+        """Return True if the error is a rate limit, a server error or a network failure."""
+        status = _error_status(error)
+        if status is not None:
+            if status in self.RETRYABLE_STATUS:
+                return True
+            return status == 403 and _error_reason(error) in self.RATE_LIMIT_REASONS
+        return isinstance(error, self.network_errors)
+    
+    def delay(self, attempt: int, error: Optional[Exception] = None) -> float:
+        """
+        Seconds to wait before retrying after the given (1-based) attempt.
+        
+        Uses full-jitter exponential backoff, unless the server sent a Retry-After header,
+        in which case the requested delay is honoured.
+        """
+        retry_after = self._retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+    
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        value = _error_headers(error).get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class CircuitBreaker:
+    """
+    Per-account circuit breaker.
+    
+    After `failure_threshold` consecutive transient failures the circuit opens and calls fail
+    fast for `reset_timeout` seconds. Then a single trial call is let through (half-open):
+    success closes the circuit, failure opens it again.
+    """
+    
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+    
+    _registry: Dict[str, 'CircuitBreaker'] = {}
+    _registry_lock = threading.Lock()
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Initializes the CircuitBreaker object.
+        
+        Args:
+            failure_threshold (int): Consecutive transient failures that open the circuit.
+            reset_timeout (float): Seconds the circuit stays open before a trial call is allowed.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def for_account(cls, account: str, **kwargs) -> 'CircuitBreaker':
+        """Return the breaker shared by every client of the same account."""
+        with cls._registry_lock:
+            if account not in cls._registry:
+                cls._registry[account] = cls(**kwargs)
+            return cls._registry[account]
+    
+    def allow(self) -> bool:
+        """Return True if a call may be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+    
+    def retry_in(self) -> float:
+        """Seconds until the open circuit lets a trial call through."""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+# endregion
+
+
+class LabelCache:
+    """
+    In-process index of the user's labels, keyed both by name and by ID.
+    
+    The cache is filled from a full `labels().list` call and then kept up to date
+    in place by the label write operations, so lookups and verification listings
+    do not need another round trip until the TTL expires.
+    """
+    
+    def __init__(self, ttl: float = 300.0):
+        """
+        Initializes the LabelCache object.
+        
+        Args:
+            ttl (float): Seconds after a full load before the cache is considered stale.
+                A value <= 0 disables caching.
+        """
+        self.ttl = ttl
+        self._by_id: Dict[str, Dict] = {}
+        self._name_to_id: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()
+        
+    def is_fresh(self) -> bool:
+        """Return True if the cache holds a full listing younger than the TTL."""
+        with self._lock:
+            return (self.ttl > 0 and self._loaded_at is not None
+                    and time.monotonic() - self._loaded_at < self.ttl)
+    
+    def load(self, labels: List[Dict]) -> None:
+        """Replace the whole index with a fresh listing."""
+        with self._lock:
+            self._by_id = {label['id']: label for label in labels}
+            self._name_to_id = {label['name']: label['id'] for label in labels}
+            self._loaded_at = time.monotonic()
+            
+    def labels(self) -> List[Dict]:
+        """Return the cached labels, in listing order."""
+        with self._lock:
+            return list(self._by_id.values())
+    
+    def get_id(self, label_name: str) -> Optional[str]:
+        """Return the ID of a label by its name, if cached."""
+        with self._lock:
+            return self._name_to_id.get(label_name)
+        
+    def get(self, label_id: str) -> Optional[Dict]:
+        """Return a cached label by its ID."""
+        with self._lock:
+            return self._by_id.get(label_id)
+    
+    def put(self, label: Dict) -> None:
+        """Insert or update a single label, keeping the name index consistent."""
+        with self._lock:
+            previous = self._by_id.get(label['id'])
+            if previous is not None and self._name_to_id.get(previous['name']) == label['id']:
+                del self._name_to_id[previous['name']]
+            self._by_id[label['id']] = label
+            self._name_to_id[label['name']] = label['id']
+            
+    def remove(self, label_id: str) -> None:
+        """Drop a single label from the index."""
+        with self._lock:
+            label = self._by_id.pop(label_id, None)
+            if label is not None and self._name_to_id.get(label['name']) == label_id:
+                del self._name_to_id[label['name']]
+                
+    def invalidate(self) -> None:
+        """Forget everything so the next lookup reloads from Gmail."""
+        with self._lock:
+            self._by_id = {}
+            self._name_to_id = {}
+            self._loaded_at = None
+
+
+@functools.lru_cache(maxsize=None)
+def discovery_document() -> Dict:
+    """
+    The Gmail v1 discovery document, parsed once per process and shared by every GmailAPI.
+    
+    It is the copy bundled with google-api-python-client, so it is pinned by the version in
+    requirements.txt and never fetched over the network. Treat it as read only.
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+    
+    document = get_static_doc('gmail', 'v1')
+    if document is None:
+        raise FileNotFoundError('The bundled Gmail discovery document is missing, reinstall google-api-python-client')
+    return json.loads(document)
+
+
+def _is_failure(result) -> bool:
+    return isinstance(result, GmailError)
+
+
+# Every public method is timed as a "gmail" span, its requests as nested "gmail_request" spans
+@traced_methods('gmail', failure=_is_failure, exclude=('users', 'batch'))
 class GmailAPI:
     """A wrapper class for the Gmail API operations needed by the agent."""
     
@@ -18,47 +342,156 @@ class GmailAPI:
         'https://www.googleapis.com/auth/gmail.settings.basic'
     ]
     
-    def __init__(self, credentials_path: str, token_path: str):
+    def __init__(self, credentials_path: str, token_path: str, label_cache_ttl: float = 300.0,
+                 retry_policy: Optional[RetryPolicy] = None, circuit_breaker: Optional[CircuitBreaker] = None):
         """
         Initializes the GmailAPI object.
         
         Args:
             credentials_path (str): The path to the credentials file.
             token_path (str): The path to the token file.
+            label_cache_ttl (float): Seconds a full label listing is reused before refetching.
+                Use 0 to always hit Gmail.
+            retry_policy (RetryPolicy): Retry and backoff policy of every call. Defaults to RetryPolicy().
+            circuit_breaker (CircuitBreaker): Breaker guarding the calls. Defaults to the one shared
+                by every client of the same token (account).
         """
         self.credentials_path = credentials_path
         self.token_path = token_path
-        self.service = None
+        self._service = None
+        self._users = None
+        self._auth_lock = threading.Lock()
+        self.creds = None
+        self.credential_manager: Optional[CredentialManager] = None
+        self.label_cache = LabelCache(ttl=label_cache_ttl)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker.for_account(str(token_path))
+        self._local = threading.local()
     
     def __call__(self):
         self.authenticate()
     
     # region AUTHENTICATION
+    @property
+    def service(self):
+        """The Gmail service, authenticated and built on first use."""
+        if self._service is None:
+            with self._auth_lock:
+                if self._service is None:
+                    self.authenticate()
+        return self._service
+    
+    @service.setter
+    def service(self, service) -> None:
+        self._service = service
+        self._users = None
+    
+    def users(self):
+        """The `users` resource of the service, built once rather than on every call."""
+        users = self._users
+        if users is None:
+            users = self._users = self.service.users()
+        return users
+    
     def authenticate(self) -> None:
         """Handle the OAth2 flow and build the Gmail service."""
-        creds = None
+        # The discovery client is imported here, it is slow to import and only needed once authenticated
+        from googleapiclient.discovery import build_from_document
         
-        if os.path.exists(self.token_path):
-            creds = Credentials.from_authorized_user_file(self.token_path)
-            
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_path, self.SCOPES)
-                creds = flow.run_local_server(port=0)
-                
-            with open(self.token_path, 'w') as token:
-                token.write(creds.to_json())
-                
-        self.service = build('gmail', 'v1', credentials=creds)
+        creds = self.load_credentials()
+        self.creds = creds
+        self._local = threading.local()
+        # Built from the shared parsed document: no discovery fetch and no JSON parsing per instance
+        self.service = build_from_document(discovery_document(), credentials=creds)
+    
+    def load_credentials(self) -> Credentials:
+        """
+        Load the stored token, refreshing it or running the OAuth2 flow when needed.
+        
+        The credentials are shared with every client of the same token file and refreshed in the
+        background before they expire (see CredentialManager), so requests never wait for a refresh.
+        """
+        # Kept on the client: the manager, and its background refresh, live as long as a client uses it
+        self.credential_manager = CredentialManager.for_token(self.token_path, self.credentials_path, self.SCOPES)
+        return self.credential_manager.credentials()
+    
+    def _thread_http(self) -> Optional[AuthorizedHttp]:
+        """
+        Return an authorized HTTP transport owned by the calling thread.
+        
+        httplib2 connections are not thread safe, so requests issued from worker threads
+        must be executed with their own transport instead of the one shared by the service.
+        """
+        if self.creds is None:
+            return None
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
     # endregion    
     
+    # region CALL WRAPPER
+    def _execute(self, request, operation: str):
+        """
+        Execute a client library request with retries, backoff and the account's circuit breaker.
+        
+        Args:
+            request: The HttpRequest or BatchHttpRequest to execute.
+            operation (str): Name of the operation, used in the structured error.
+            
+        Returns:
+            The response of the request.
+            
+        Raises:
+            GmailAPIError: If the call failed permanently, ran out of attempts or the circuit is open.
+        """
+        attempt = 0
+        # One span per call, however many attempts it takes
+        with tracer.span('gmail_request', operation) as span:
+            while True:
+                if not self.circuit_breaker.allow():
+                    raise GmailAPIError(GmailError(
+                        operation=operation, retryable=True, attempts=attempt, circuit_open=True,
+                        message=f'too many recent failures, retry in {self.circuit_breaker.retry_in():.0f}s'))
+                attempt += 1
+                span.set(attempts=attempt)
+                try:
+                    response = request.execute(http=self._thread_http())
+                except Exception as error:
+                    retryable = self.retry_policy.is_retryable(error)
+                    if retryable:
+                        self.circuit_breaker.record_failure()
+                    else:
+                        # Client errors (404, 400...) prove Gmail is reachable
+                        self.circuit_breaker.record_success()
+                    if not retryable or attempt >= self.retry_policy.max_attempts:
+                        span.set(status=_error_status(error))
+                        raise GmailAPIError(GmailError.from_exception(operation, error, retryable, attempt)) from error
+                    time.sleep(self.retry_policy.delay(attempt, error))
+                    continue
+                self.circuit_breaker.record_success()
+                span.set_payload(response)
+                return response
+    
+    @staticmethod
+    def _failure(operation: str, error: Exception) -> GmailError:
+        """Turn any exception into a structured GmailError, logging it."""
+        result = error.error if isinstance(error, GmailAPIError) else GmailError.from_exception(operation, error)
+        print(f'An error occurred: {result}')
+        return result
+    # endregion
+    
     # region LABELS
-    def list_labels(self) -> Optional[List[Dict]]:
+    def list_labels(self, refresh: bool = False) -> Union[List[Dict], GmailError]:
         """
         List all the labels in the user's gmail account.
+        
+        The listing is served from the label cache while it is fresh. Message and thread
+        counters may therefore lag behind Gmail by up to the cache TTL.
+        
+        Args:
+            refresh (bool): Skip the cache and reload the labels from Gmail.
     
         Returns:
             A list of dictionaries containing the label information.
@@ -76,14 +509,18 @@ class GmailAPI:
                     object (Color)
                 }
             }
+            or a GmailError if the call failed.
         """
+        if not refresh and self.label_cache.is_fresh():
+            return self.label_cache.labels()
         try:
-            return self.service.users().labels().list(userId='me').execute().get('labels', [])
+            labels = self._execute(self.users().labels().list(userId='me'), 'labels.list').get('labels', [])
+            self.label_cache.load(labels)
+            return labels
         except Exception as error:
-            print(f'An error occurred: {error}')
-            return None
+            return self._failure('labels.list', error)
     
-    def create_label(self, label_content: Dict) -> Optional[Dict]:
+    def create_label(self, label_content: Dict) -> Union[Dict, GmailError]:
         """
         Create a new label for the authenticated user.
         
@@ -99,28 +536,33 @@ class GmailAPI:
                 }
             
         Returns:
-            Created label resource if successful, None otherwise.
+            Created label resource if successful, a GmailError otherwise.
         """
         try:                
-            return self.service.users().labels().create(
-                userId='me', body=label_content).execute()
+            label = self._execute(self.users().labels().create(
+                userId='me', body=label_content), 'labels.create')
+            self.label_cache.put(label)
+            return label
         except Exception as error:
-            print(f'An error occurred: {error}')
-            return None
+            return self._failure('labels.create', error)
         
-    def delete_label(self, label_id: str) -> None:
+    def delete_label(self, label_id: str) -> Optional[GmailError]:
         """
         Delete a label by its ID.
         
         Args:
             label_id (str): The ID of the label to delete.
+            
+        Returns:
+            None if successful, a GmailError otherwise.
         """
         try:
-            self.service.users().labels().delete(userId='me', id=label_id).execute()
+            self._execute(self.users().labels().delete(userId='me', id=label_id), 'labels.delete')
+            self.label_cache.remove(label_id)
         except Exception as error:
-            print(f'An error occurred: {error}')
+            return self._failure('labels.delete', error)
     
-    def get_label_id(self, label_name: str) -> Optional[str]:
+    def get_label_id(self, label_name: str) -> Union[str, None, GmailError]:
         """
         Get the ID of a label by its name.
         
@@ -128,18 +570,18 @@ class GmailAPI:
             label_name (str): The name of the label to get the ID for.
             
         Returns:
-            The ID of the label if found, None otherwise.
+            The ID of the label if found, None if there is no such label, a GmailError if the listing failed.
         """
-        try:
-            labels = self.service.users().labels().list(userId='me').execute().get('labels', [])
-            for label in labels:
-                if label['name'] == label_name:
-                    return label['id']
-        except Exception as error:
-            print(f'An error occurred: {error}')
-            return None
+        label_id = self.label_cache.get_id(label_name)
+        if label_id is not None or self.label_cache.is_fresh():
+            return label_id
+        
+        labels = self.list_labels(refresh=True)
+        if isinstance(labels, GmailError):
+            return labels
+        return self.label_cache.get_id(label_name)
 
-    def update_label(self, label_id: str, label_content: Dict) -> Optional[Dict]:
+    def update_label(self, label_id: str, label_content: Dict) -> Union[Dict, GmailError]:
         """
         Update an existing label's name and/or color.
         
@@ -156,33 +598,34 @@ class GmailAPI:
                 }
             
         Returns:
-            Updated label resource if successful, None otherwise.
+            Updated label resource if successful, a GmailError otherwise.
         """
         try:                
-            return self.service.users().labels().patch(
-                userId='me', id=label_id, body=label_content).execute()
+            label = self._execute(self.users().labels().patch(
+                userId='me', id=label_id, body=label_content), 'labels.patch')
+            self.label_cache.put(label)
+            return label
         except Exception as error:
-            print(f'An error occurred: {error}')
-            return None
+            return self._failure('labels.patch', error)
     # endregion
     
     
     # region FILTERS
-    def list_filters(self) -> Optional[List[Dict]]:
+    def list_filters(self) -> Union[List[Dict], GmailError]:
             """
             List all filters for the authenticated user.
             
             Returns:
-                List of filter resources if successful, None otherwise.
+                List of filter resources if successful, a GmailError otherwise.
             """
             try:
-                return self.service.users().settings().filters().list(userId='me').execute().get('filter', [])
+                return self._execute(self.users().settings().filters().list(userId='me'),
+                                     'filters.list').get('filter', [])
             except Exception as error:
-                print(f'An error occurred: {error}')
-                return None
+                return self._failure('filters.list', error)
             
             
-    def create_filter(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> Optional[Dict]:
+    def create_filter(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> Union[Dict, GmailError]:
         """
         Create a GMail filter that automatically applies a label to matching messages
         
@@ -199,44 +642,42 @@ class GmailAPI:
 
             
         Returns:
-            Created filter resource if successful, None otherwise.
+            Created filter resource if successful, a GmailError otherwise.
         """
         try:
-            # Ensure addLabelIds and removeLabelIds are strings
-            if 'addLabelIds' in actions and isinstance(actions['addLabelIds'], list):
-                actions['addLabelIds'] = ','.join(actions['addLabelIds'])
-            if 'removeLabelIds' in actions and isinstance(actions['removeLabelIds'], list):
-                actions['removeLabelIds'] = ','.join(actions['removeLabelIds'])
-            
             filter_content = {
                 'criteria': criteria,
-                'action': actions
+                'action': self.normalize_filter_actions(actions)
             }
                 
-            return self.service.users().settings().filters().create(
-                userId='me', body=filter_content).execute()
+            return self._execute(self.users().settings().filters().create(
+                userId='me', body=filter_content), 'filters.create')
                 
         except Exception as error:
-            print(f'An error occurred: {error}')
-            return None
+            return self._failure('filters.create', error)
             
             
-    def delete_filter(self, filter_id: str) -> None:
+    def delete_filter(self, filter_id: str) -> Optional[GmailError]:
         """
         Delete a filter by its ID.
         
         Args:
             filter_id (str): The ID of the filter to delete.
+            
+        Returns:
+            None if successful, a GmailError otherwise.
         """
         try:
-            self.service.users().settings().filters().delete(userId='me', id=filter_id).execute()
+            self._execute(self.users().settings().filters().delete(userId='me', id=filter_id), 'filters.delete')
         except Exception as error:
-            print(f'An error occurred: {error}')
+            return self._failure('filters.delete', error)
             
-    def update_filter(self, filter_id: str, criteria: Optional[Dict[str, str]] = None, actions: Optional[Dict[str, Union[str, List[str]]]] = None) -> Optional[Dict]:
+    def update_filter(self, filter_id: str, criteria: Optional[Dict[str, str]] = None, actions: Optional[Dict[str, Union[str, List[str]]]] = None) -> Union[Dict, GmailError]:
         """
         Update an existing filter's criteria and/or actions. 
-        To update a filter, we are deleting the previous one an creating a new one adding the new criteria and actions.
+        To update a filter, we are creating a new one with the new criteria and actions and deleting the previous one.
+        The previous filter is deleted only once the new one exists, so a failed update keeps it.
+        Criteria or actions left to None are kept, and a filter that would not change is left as it is.
         
         Args:
             filter_id (str): The ID of the filter to update.
@@ -251,12 +692,455 @@ class GmailAPI:
                 - forward: Email address to forward the matching messages to.
                 
         Returns:
-            Updated filter resource if successful, None otherwise.
+            Updated filter resource if successful, a GmailError otherwise.
         """
+        current = self.get_filter(filter_id)
+        if isinstance(current, GmailError):
+            return current
+        if criteria is None:
+            criteria = current.get('criteria', {})
+        actions = self.normalize_filter_actions(dict(current.get('action', {}) if actions is None else actions))
+        current_actions = self.normalize_filter_actions(dict(current.get('action', {})))
+        if criteria == current.get('criteria', {}) and actions == current_actions:
+            return current
+        
+        created = self.create_filter(criteria, actions)
+        if isinstance(created, GmailError):
+            return created
+        # The update took effect even if the previous filter could not be deleted (the failure is logged)
         self.delete_filter(filter_id)
-        return self.create_filter(criteria, actions)
+        return created
+    
+    def get_filter(self, filter_id: str) -> Union[Dict, GmailError]:
+        """
+        Get a filter by its ID.
+        
+        Args:
+            filter_id (str): The ID of the filter to get.
+            
+        Returns:
+            The filter resource if successful, a GmailError otherwise.
+        """
+        try:
+            return self._execute(self.users().settings().filters().get(userId='me', id=filter_id), 'filters.get')
+        except Exception as error:
+            return self._failure('filters.get', error)
+    
+    @staticmethod
+    def normalize_filter_actions(actions: Dict[str, Union[str, List[str]]]) -> Dict[str, Union[str, List[str]]]:
+        """Ensure addLabelIds and removeLabelIds are sent as comma separated strings."""
+        if 'addLabelIds' in actions and isinstance(actions['addLabelIds'], list):
+            actions['addLabelIds'] = ','.join(actions['addLabelIds'])
+        if 'removeLabelIds' in actions and isinstance(actions['removeLabelIds'], list):
+            actions['removeLabelIds'] = ','.join(actions['removeLabelIds'])
+        return actions
+        
+    # endregion
+    
+    # region MESSAGES
+    MODIFY_CHUNK_SIZE = 1000  # Maximum number of IDs accepted by messages.batchModify
+    
+    def iter_message_ids(self, query: str, page_size: int = 500) -> Iterator[List[str]]:
+        """
+        Page through the IDs of the messages matching a Gmail search query.
+        
+        Args:
+            query (str): Gmail search query.
+            page_size (int): Number of IDs requested per page (max 500).
+            
+        Yields:
+            One list of message IDs per page, so the caller never holds the whole result set.
+            
+        Raises:
+            GmailAPIError: If a page could not be fetched.
+        """
+        page_token = None
+        while True:
+            response = self._execute(self.users().messages().list(
+                userId='me', q=query, maxResults=page_size, pageToken=page_token,
+                fields='messages/id,nextPageToken'), 'messages.list')
+            yield [message['id'] for message in response.get('messages', [])]
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+    
+    def batch_modify_messages(self, message_ids: List[str], add_label_ids: Optional[List[str]] = None,
+                              remove_label_ids: Optional[List[str]] = None) -> None:
+        """
+        Add and/or remove labels on up to 1000 messages in a single call.
+        
+        Args:
+            message_ids (List[str]): The IDs of the messages to modify.
+            add_label_ids (List[str]): The IDs of the labels to add.
+            remove_label_ids (List[str]): The IDs of the labels to remove.
+            
+        Raises:
+            GmailAPIError: If the messages could not be modified.
+        """
+        body = {
+            'ids': message_ids,
+            'addLabelIds': add_label_ids or [],
+            'removeLabelIds': remove_label_ids or []
+        }
+        self._execute(self.users().messages().batchModify(userId='me', body=body), 'messages.batchModify')
+    
+    def apply_filter_to_existing(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]],
+                                 max_workers: int = 4,
+                                 progress_callback: Optional[Callable[[Dict], None]] = None) -> Union[Dict, GmailError]:
+        """
+        Apply the label actions of a filter to the messages already in the mailbox.
+        
+        Matching messages are streamed page by page from messages.list and modified with
+        messages.batchModify in chunks of 1000 IDs, with at most `max_workers` chunks being
+        modified concurrently and a bounded number of chunks waiting, so memory use does
+        not depend on the size of the mailbox.
+        
+        Args:
+            criteria (Dict[str, str]): Filter criteria dictionary, as in create_filter.
+            actions (Dict[str, Union[str, List[str]]]): Filter actions dictionary, as in create_filter.
+                Only addLabelIds and removeLabelIds are applied; forwarding only affects new mail.
+            max_workers (int): Maximum number of batchModify calls in flight.
+            progress_callback (Callable[[Dict], None]): Called after every chunk with the running totals.
+            
+        Returns:
+            A dictionary with the totals if successful, a GmailError otherwise.
+            {
+                "query": str,
+                "matched": int,
+                "modified": int,
+                "failed": int
+            }
+        """
+        query = criteria_to_query(criteria)
+        add_label_ids = self._split_label_ids(actions.get('addLabelIds'))
+        remove_label_ids = self._split_label_ids(actions.get('removeLabelIds'))
+        if not query:
+            return self._failure('messages.batchModify', ValueError(
+                'refusing to apply a filter without criteria to the whole mailbox'))
+        
+        progress = {'query': query, 'matched': 0, 'modified': 0, 'failed': 0}
+        if not add_label_ids and not remove_label_ids:
+            return progress
+        
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(max_workers * 2)
+        
+        def modify(chunk: List[str]) -> None:
+            try:
+                self.batch_modify_messages(chunk, add_label_ids, remove_label_ids)
+                outcome = 'modified'
+            except Exception as error:
+                self._failure('messages.batchModify', error)
+                outcome = 'failed'
+            finally:
+                slots.release()
+            with lock:
+                progress[outcome] += len(chunk)
+                snapshot = dict(progress)
+            if progress_callback is not None:
+                progress_callback(snapshot)
+        
+        def submit(executor: ThreadPoolExecutor, chunk: List[str]) -> None:
+            slots.acquire()
+            executor.submit(modify, chunk)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                chunk: List[str] = []
+                for page in self.iter_message_ids(query):
+                    with lock:
+                        progress['matched'] += len(page)
+                    chunk.extend(page)
+                    while len(chunk) >= self.MODIFY_CHUNK_SIZE:
+                        submit(executor, chunk[:self.MODIFY_CHUNK_SIZE])
+                        chunk = chunk[self.MODIFY_CHUNK_SIZE:]
+                if chunk:
+                    submit(executor, chunk)
+        except Exception as error:
+            return self._failure('messages.list', error)
+        
+        return progress
+    
+    METADATA_HEADERS = ['From', 'To', 'Cc', 'Subject', 'Date']
+    METADATA_FIELDS = 'id,threadId,labelIds,snippet,internalDate,sizeEstimate,historyId,payload/headers'
+    
+    def fetch_message_metadata(self, query: str = '', max_messages: int = 2000) -> Union[List[Dict], GmailError]:
+        """
+        Fetch the headers and labels of the most recent messages matching a query.
+    
+        The IDs are paged from messages.list, and the metadata is fetched with batched
+        messages.get calls (format=metadata), which is enough to evaluate filter criteria locally.
+    
+        Args:
+            query (str): Gmail search query, empty for every message.
+            max_messages (int): Maximum number of messages fetched, newest first.
+    
+        Returns:
+            The message resources (id, threadId, labelIds, snippet, internalDate, sizeEstimate
+            and the From/To/Cc/Subject/Date headers) if successful, a GmailError otherwise.
+        """
+        try:
+            message_ids: List[str] = []
+            for page in self.iter_message_ids(query, page_size=min(500, max_messages)):
+                message_ids.extend(page)
+                if len(message_ids) >= max_messages:
+                    break
+        except Exception as error:
+            return self._failure('messages.list', error)
+    
+        batch = self.batch(batch_size=GmailBatch.MAX_BATCH_SIZE)
+        for message_id in message_ids[:max_messages]:
+            batch.get_message_metadata(message_id)
+        return [entry['result'] for entry in batch.execute() if entry['ok']]
+    
+    @staticmethod
+    def _split_label_ids(label_ids: Optional[Union[str, List[str]]]) -> List[str]:
+        if not label_ids:
+            return []
+        if isinstance(label_ids, str):
+            label_ids = label_ids.split(',')
+        return [label_id.strip() for label_id in label_ids if label_id.strip()]
+    # endregion
+    
+    # region HISTORY
+    HISTORY_FIELDS = ('history(messagesAdded/message(id,labelIds),messagesDeleted/message/id,'
+                      'labelsAdded/message(id,labelIds),labelsRemoved/message(id,labelIds)),historyId,nextPageToken')
+    
+    def get_profile(self) -> Dict:
+        """
+        Get the profile of the mailbox (emailAddress, messagesTotal, threadsTotal, historyId).
+        
+        Raises:
+            GmailAPIError: If the profile could not be fetched.
+        """
+        return self._execute(self.users().getProfile(userId='me'), 'getProfile')
+    
+    def iter_history(self, start_history_id: str, page_size: int = 500) -> Iterator[Dict]:
+        """
+        Page through the changes of the mailbox since a history ID.
+        
+        Args:
+            start_history_id (str): History ID returned by a previous sync (getProfile, messages.get or history.list).
+            page_size (int): Number of history records requested per page (max 500).
+            
+        Yields:
+            One history.list response per page, with the history records and the latest historyId.
+            
+        Raises:
+            GmailAPIError: If a page could not be fetched. A 404 status means the start history ID
+                is too old and the mailbox must be synced from scratch.
+        """
+        page_token = None
+        while True:
+            response = self._execute(self.users().history().list(
+                userId='me', startHistoryId=start_history_id, maxResults=page_size, pageToken=page_token,
+                historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+                fields=self.HISTORY_FIELDS), 'history.list')
+            yield response
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+    # endregion
+    
+    # region BATCH
+    def batch(self, batch_size: int = 50) -> 'GmailBatch':
+        """
+        Start a batch of label and filter operations.
+        
+        Args:
+            batch_size (int): Maximum number of operations sent in a single HTTP batch request.
+            
+        Returns:
+            A GmailBatch collecting the operations until it is executed.
+        """
+        return GmailBatch(self, batch_size=batch_size)
+    # endregion
+    
+
+class GmailBatch:
+    """
+    Collects label and filter operations and sends them through the client library's
+    batch HTTP support, so N operations cost ceil(N / batch_size) round trips instead of N.
+    
+    Gmail does not guarantee the order in which the requests of a batch are executed,
+    so operations that depend on each other should go in separate batches.
+    
+    Usage:
+        with gmail_api.batch() as batch:
+            batch.create_label({'name': 'Work'})
+            batch.delete_filter(filter_id)
+        results = batch.results
+    """
+    
+    MAX_BATCH_SIZE = 100  # Hard limit of the Gmail batch endpoint
+    
+    def __init__(self, gmail_api: GmailAPI, batch_size: int = 50):
+        """
+        Initializes the GmailBatch object.
+        
+        Args:
+            gmail_api (GmailAPI): The authenticated API the operations are sent through.
+            batch_size (int): Maximum number of operations per HTTP batch request.
+        """
+        self.gmail_api = gmail_api
+        self.batch_size = max(1, min(batch_size, self.MAX_BATCH_SIZE))
+        self.results: List[Dict] = []
+        self._operations: List[Dict] = []
+        
+    def __len__(self) -> int:
+        return len(self._operations)
         
+    def __enter__(self) -> 'GmailBatch':
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.execute()
+    
+    # region OPERATIONS
+    def create_label(self, label_content: Dict) -> int:
+        """Queue a label creation. Returns the index of the operation in the results."""
+        request = self._users().labels().create(userId='me', body=label_content)
+        return self._add('create_label', request, target=label_content.get('name'),
+                         on_success=self.gmail_api.label_cache.put)
+    
+    def update_label(self, label_id: str, label_content: Dict) -> int:
+        """Queue a label patch. Returns the index of the operation in the results."""
+        request = self._users().labels().patch(userId='me', id=label_id, body=label_content)
+        return self._add('update_label', request, target=label_id,
+                         on_success=self.gmail_api.label_cache.put)
+    
+    def delete_label(self, label_id: str) -> int:
+        """Queue a label deletion. Returns the index of the operation in the results."""
+        request = self._users().labels().delete(userId='me', id=label_id)
+        return self._add('delete_label', request, target=label_id,
+                         on_success=lambda _: self.gmail_api.label_cache.remove(label_id))
+    
+    def create_filter(self, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> int:
+        """Queue a filter creation. Returns the index of the operation in the results."""
+        filter_content = {
+            'criteria': criteria,
+            'action': GmailAPI.normalize_filter_actions(actions)
+        }
+        request = self._users().settings().filters().create(userId='me', body=filter_content)
+        return self._add('create_filter', request, target=criteria)
+    
+    def delete_filter(self, filter_id: str) -> int:
+        """Queue a filter deletion. Returns the index of the operation in the results."""
+        request = self._users().settings().filters().delete(userId='me', id=filter_id)
+        return self._add('delete_filter', request, target=filter_id)
+    
+    def update_filter(self, filter_id: str, criteria: Dict[str, str], actions: Dict[str, Union[str, List[str]]]) -> int:
+        """
+        Queue a filter replacement. Filters cannot be patched, so this queues the creation of the new
+        filter and returns its index. The old filter is deleted in a second phase of `execute`, once
+        the creation succeeded (the requests of a batch are not ordered), so a failed creation keeps it.
+        """
+        index = self.create_filter(criteria, actions)
+        self._operations[index]['replaces'] = filter_id
+        return index
+    
+    def get_message_metadata(self, message_id: str) -> int:
+        """Queue the fetch of the headers and labels of a message. Returns the index of the operation in the results."""
+        request = self._users().messages().get(
+            userId='me', id=message_id, format='metadata', metadataHeaders=GmailAPI.METADATA_HEADERS,
+            fields=GmailAPI.METADATA_FIELDS)
+        return self._add('get_message_metadata', request, target=message_id)
     # endregion
+    
+    @traced('gmail', 'batch.execute')
+    def execute(self) -> List[Dict]:
+        """
+        Send every queued operation, in chunks of `batch_size`.
+        
+        Returns:
+            One result per queued operation, in queue order:
+            {
+                "operation": str,
+                "target": the label name, ID, filter ID or criteria the operation refers to,
+                "ok": bool,
+                "result": the returned resource (if ok),
+                "error": the error message (if not ok),
+                "status": the HTTP status of the failure, if any (if not ok),
+                "replaced": for a successful update_filter, whether the old filter was deleted,
+                "replace_error": the error of that deletion (if not replaced)
+            }
+        """
+        results: List[Optional[Dict]] = [None] * len(self._operations)
+        policy = self.gmail_api.retry_policy
+        attempt = 0
+        retryable: Dict[int, Exception] = {}
+        
+        def record(index: int, response=None, error: Optional[Union[Exception, GmailError]] = None) -> None:
+            operation = self._operations[index]
+            entry = {'operation': operation['operation'], 'target': operation['target']}
+            if error is None:
+                entry.update(ok=True, result=response)
+                if operation['on_success'] is not None:
+                    operation['on_success'](response)
+            else:
+                if not isinstance(error, GmailError):
+                    is_retryable = policy.is_retryable(error)
+                    if is_retryable:
+                        retryable[index] = error
+                    error = GmailError.from_exception(operation['operation'], error, is_retryable, attempt)
+                entry.update(ok=False, error=str(error), status=error.status)
+            results[index] = entry
+        
+        def callback(request_id, response, exception):
+            record(int(request_id), response, exception)
+        
+        pending = list(range(len(self._operations)))
+        while pending:
+            attempt += 1
+            retryable.clear()
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                batch_request = self.gmail_api.service.new_batch_http_request(callback=callback)
+                for index in chunk:
+                    batch_request.add(self._operations[index]['request'], request_id=str(index))
+                try:
+                    self.gmail_api._execute(batch_request, 'batch')
+                except Exception as error:
+                    failure = self.gmail_api._failure('batch', error)
+                    for index in chunk:
+                        if results[index] is None or not results[index]['ok']:
+                            record(index, error=failure)
+            
+            # Items rejected with a transient error (e.g. per-user rate limit) are sent again
+            if not retryable or attempt >= policy.max_attempts:
+                break
+            pending = sorted(retryable)
+            time.sleep(policy.delay(attempt, next(iter(retryable.values()))))
+        
+        # Second phase of update_filter: the filters replaced by a successful creation are deleted
+        replaced = [(index, operation['replaces']) for index, operation in enumerate(self._operations)
+                    if operation.get('replaces') and results[index]['ok']]
+        if replaced:
+            deletions = GmailBatch(self.gmail_api, batch_size=self.batch_size)
+            for _, filter_id in replaced:
+                deletions.delete_filter(filter_id)
+            for (index, _), deletion in zip(replaced, deletions.execute()):
+                results[index]['replaced'] = deletion['ok']
+                if not deletion['ok']:
+                    results[index]['replace_error'] = deletion['error']
+        
+        self._operations = []
+        self.results = results
+        return results
+    
+    def _users(self):
+        return self.gmail_api.users()
+    
+    def _add(self, operation: str, request, target=None, on_success=None) -> int:
+        self._operations.append({
+            'operation': operation,
+            'request': request,
+            'target': target,
+            'on_success': on_success
+        })
+        return len(self._operations) - 1
+        
         
 def main():
     '''
@@ -0,0 +1,210 @@
+import os
+import re
+import sys
+import zlib
+from email.utils import getaddresses
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.filter_matcher import MessageMetadata
+
+_WORD = re.compile(r'[^\W\d_]{3,}')
+
+
+class LabelClassifier:
+    """
+    Multinomial naive Bayes over hashed sender and subject features, trained on the messages that
+    already carry user labels and used to suggest labels for the rest without calling the LLM.
+
+    Every message is turned into a handful of tokens (sender address, sender domains, subject
+    words), hashed into `n_features` buckets. Training is a single bincount of (label, feature)
+    pairs, and scoring a batch is one gather of the log-probability matrix followed by a segmented
+    sum, so tens of thousands of messages are scored per second.
+
+    Naive Bayes always picks one of the labels it knows. To leave the messages unlike every label
+    without one, the messages carrying none of the labels can be learned as a background class.
+    """
+
+    def __init__(self, n_features: int = 2 ** 16, alpha: float = 0.1, min_examples: int = 5):
+        """
+        Initializes the LabelClassifier object.
+
+        Args:
+            n_features (int): Number of hash buckets of the features.
+            alpha (float): Additive (Laplace) smoothing of the feature counts.
+            min_examples (int): Minimum number of messages a label needs to be learned.
+        """
+        self.n_features = n_features
+        self.alpha = alpha
+        self.min_examples = min_examples
+        self.labels: List[str] = []
+        self.log_prior: Optional[np.ndarray] = None
+        self.log_likelihood: Optional[np.ndarray] = None  # (n_labels, n_features)
+        self.feature_names: Dict[int, str] = {}
+        self.label_counts: Optional[np.ndarray] = None
+
+    # region FEATURES
+    @staticmethod
+    def tokens(message: MessageMetadata) -> List[str]:
+        """The readable features of a message, e.g. 'from:news@shop.com', 'domain:shop.com', 'subject:invoice'."""
+        tokens = []
+        for _, address in getaddresses([message.sender]):
+            address = address.casefold()
+            if '@' not in address:
+                continue
+            tokens.append(f'from:{address}')
+            parts = address.rsplit('@', 1)[1].split('.')
+            tokens.extend(f"domain:{'.'.join(parts[start:])}" for start in range(len(parts) - 1))
+        tokens.extend(f'subject:{word}' for word in set(_WORD.findall(message.subject.casefold())))
+        return tokens
+
+    def _hash(self, token: str) -> int:
+        # crc32 rather than hash(): Python string hashes change with every process
+        return zlib.crc32(token.encode()) % self.n_features
+
+    def _vectorize(self, messages: Sequence[MessageMetadata],
+                   remember: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the (document, feature) pairs of the messages, grouped by document."""
+        documents: List[int] = []
+        features: List[int] = []
+        for document, message in enumerate(messages):
+            for token in self.tokens(message):
+                feature = self._hash(token)
+                documents.append(document)
+                features.append(feature)
+                if remember:
+                    self.feature_names.setdefault(feature, token)
+        return np.asarray(documents, dtype=np.int64), np.asarray(features, dtype=np.int64)
+    # endregion
+
+    # region TRAINING AND SCORING
+    def fit(self, messages: Sequence[MessageMetadata], label_ids: Sequence[str],
+            background: bool = False) -> 'LabelClassifier':
+        """
+        Learn the labels from messages that already carry them.
+
+        Args:
+            messages (Sequence[MessageMetadata]): The messages to learn from. A message with several
+                of the labels counts as an example of each of them.
+            label_ids (Sequence[str]): The labels to learn, typically the user labels.
+            background (bool): Also learn the messages carrying none of the labels, as a background
+                class taking its share of the probabilities (see predict_proba).
+
+        Returns:
+            The classifier itself.
+        """
+        wanted = set(label_ids)
+        examples = [(message, [label for label in message.label_ids if label in wanted]) for message in messages]
+        counts: Dict[str, int] = {}
+        for _, labels in examples:
+            for label in labels:
+                counts[label] = counts.get(label, 0) + 1
+        self.labels = sorted(label for label, count in counts.items() if count >= self.min_examples)
+        label_index = {label: index for index, label in enumerate(self.labels)}
+        if not self.labels:
+            self.log_prior = self.log_likelihood = None
+            return self
+        # The background class, if any, is the row after the labels
+        n_labels = len(self.labels)
+        examples = [(message, [label_index[label] for label in labels if label in label_index]
+                     or ([n_labels] if background and not labels else []))
+                    for message, labels in examples]
+        examples = [(message, labels) for message, labels in examples if labels]
+
+        self.feature_names = {}
+        documents, features = self._vectorize([message for message, _ in examples], remember=True)
+        # Expand every (document, feature) pair to the labels of its document
+        document_labels = [labels for _, labels in examples]
+        repeats = np.fromiter((len(labels) for labels in document_labels), dtype=np.int64, count=len(examples))
+        flat_labels = np.fromiter((label for labels in document_labels for label in labels), dtype=np.int64)
+        label_offsets = np.concatenate(([0], np.cumsum(repeats)[:-1]))
+        pair_repeats = repeats[documents]
+        pair_labels = flat_labels[np.repeat(label_offsets[documents], pair_repeats)
+                                  + _ranges(pair_repeats)]
+        pair_features = np.repeat(features, pair_repeats)
+
+        n_rows = int(flat_labels.max()) + 1
+        feature_counts = np.bincount(pair_labels * self.n_features + pair_features,
+                                     minlength=n_rows * self.n_features).reshape(n_rows, self.n_features)
+        smoothed = feature_counts + self.alpha
+        self.log_likelihood = (np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))).astype(np.float32)
+        self.label_counts = np.bincount(flat_labels, minlength=n_rows)
+        self.log_prior = np.log(self.label_counts / self.label_counts.sum()).astype(np.float32)
+        return self
+
+    def predict_proba(self, messages: Sequence[MessageMetadata]) -> np.ndarray:
+        """
+        Score a batch of messages.
+
+        Returns:
+            A (messages, labels) array of label probabilities, the labels being in `self.labels` order.
+            With a background class, the probability missing from a row is the one of no label.
+        """
+        if self.log_likelihood is None:
+            return np.zeros((len(messages), 0), dtype=np.float32)
+        documents, features = self._vectorize(messages)
+        scores = np.tile(self.log_prior, (len(messages), 1))
+        if len(features):
+            # Pairs are grouped by document, so each document's sum is one segment of the reduceat
+            contributions = self.log_likelihood[:, features].T
+            starts = np.flatnonzero(np.r_[True, documents[1:] != documents[:-1]])
+            scores[documents[starts]] += np.add.reduceat(contributions, starts, axis=0)
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        return (probabilities / probabilities.sum(axis=1, keepdims=True))[:, :len(self.labels)]
+
+    def predict(self, messages: Sequence[MessageMetadata],
+                min_confidence: float = 0.0) -> List[Optional[Tuple[str, float]]]:
+        """Return the most likely label of every message and its probability, None below min_confidence."""
+        probabilities = self.predict_proba(messages)
+        if probabilities.shape[1] == 0:
+            return [None] * len(messages)
+        best = probabilities.argmax(axis=1)
+        confidence = probabilities[np.arange(len(messages)), best]
+        return [(self.labels[label], float(score)) if score >= min_confidence else None
+                for label, score in zip(best.tolist(), confidence.tolist())]
+
+    def top_features(self, label_id: str, count: int = 5) -> List[str]:
+        """
+        The features that most distinguish a label from the others, e.g. ['domain:shop.com', 'subject:invoice'].
+        They are the building blocks of a filter for the label.
+        """
+        if self.log_likelihood is None or label_id not in self.labels:
+            return []
+        index = self.labels.index(label_id)
+        known = np.fromiter(self.feature_names, dtype=np.int64)
+        if len(self.log_likelihood) > 1:
+            others = np.delete(self.log_likelihood, index, axis=0)
+            weights = (self.label_counts[np.arange(len(self.log_likelihood)) != index])[:, None]
+            rest = np.log((np.exp(others[:, known]) * weights).sum(axis=0) / weights.sum())
+        else:
+            rest = np.full(len(known), np.log(1 / self.n_features))
+        lift = self.log_likelihood[index, known] - rest
+        # Only features actually seen with the label, most distinctive first
+        order = np.argsort(-lift)
+        return [self.feature_names[int(known[position])] for position in order[:count] if lift[position] > 0]
+    # endregion
+
+
+def _ranges(lengths: np.ndarray) -> np.ndarray:
+    """Concatenation of arange(length) for every length, e.g. [2, 3] -> [0, 1, 0, 1, 2]."""
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.arange(lengths.sum()) - offsets
+
+
+def criteria_from_features(features: List[str]) -> Dict[str, str]:
+    """Turn top features into filter criteria, e.g. {'from': 'shop.com OR news@x.org', 'subject': 'invoice'}."""
+    senders = [feature.split(':', 1)[1] for feature in features if feature.startswith(('from:', 'domain:'))]
+    words = [feature.split(':', 1)[1] for feature in features if feature.startswith('subject:')]
+    # A sender address is covered by its domain
+    senders = [sender for sender in senders
+               if not any(sender != other and sender.endswith(('@' + other, '.' + other)) for other in senders)]
+    if senders:
+        return {'from': ' OR '.join(senders)}
+    if words:
+        return {'subject': words[0]}
+    return {}
@@ -0,0 +1,335 @@
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.gmail_api import GmailAPI, GmailError
+
+# Label settings a config can declare; the defaults are left out of exports
+LABEL_SETTINGS = ('color', 'labelListVisibility', 'messageListVisibility')
+LABEL_DEFAULTS = {'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'}
+FILTER_ACTIONS = ('addLabels', 'removeLabels', 'forward')
+# System labels a filter can use; their name is their ID, the category labels all start with CATEGORY_
+SYSTEM_LABEL_IDS = ('INBOX', 'SPAM', 'TRASH', 'UNREAD', 'STARRED', 'IMPORTANT', 'SENT', 'DRAFT')
+
+
+def _criteria(criteria: Optional[Dict]) -> Dict:
+    """Filter criteria without the empty values Gmail may return, e.g. {'from': 'a@b.com', 'hasAttachment': False}."""
+    return {key: value for key, value in (criteria or {}).items() if value not in (None, '', False, [])}
+
+
+def _color(color: Optional[Dict]) -> Optional[Dict]:
+    if not color:
+        return None
+    return {key: str(value).lower() for key, value in color.items() if key in ('backgroundColor', 'textColor')}
+
+
+@dataclass
+class ConfigPlan:
+    """
+    The changes turning the current labels and filters into the ones of a MailboxConfig.
+
+    The changes run in four phases, every phase in batched requests (see GmailBatch), because
+    Gmail does not order the requests of a batch:
+        1. label creations and patches (renames, colors, visibility)
+        2. filter creations, once the labels they use exist, and deletions of the pruned filters
+        3. deletions of the filters replaced in phase 2, only once their replacement exists
+        4. label deletions, once no filter uses them
+    """
+    create_labels: List[Dict] = field(default_factory=list)  # Label contents
+    update_labels: List[Dict] = field(default_factory=list)  # {'label_id', 'name', 'label_content'}
+    delete_labels: List[Dict] = field(default_factory=list)  # {'label_id', 'name'}
+    # {'criteria', 'action'} with label names, and 'replaces': the current filter with the same criteria, if any
+    create_filters: List[Dict] = field(default_factory=list)
+    delete_filters: List[Dict] = field(default_factory=list)  # {'filter_id', 'criteria', 'action'} with label names
+    unchanged: Dict[str, int] = field(default_factory=lambda: {'labels': 0, 'filters': 0})
+    errors: List[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return (len(self.create_labels) + len(self.update_labels) + len(self.delete_labels)
+                + len(self.create_filters) + len(self.delete_filters))
+
+    def summary(self) -> str:
+        """The plan as a list of changes, as shown to the user before applying it."""
+        lines = [f"{len(self)} change(s), {self.unchanged['labels']} label(s) and "
+                 f"{self.unchanged['filters']} filter(s) unchanged."]
+        lines += [f"+ label {label['name']}" + _settings(label) for label in self.create_labels]
+        lines += [f"~ label {update['name']}" + (f" renamed to {update['label_content']['name']}"
+                                                  if 'name' in update['label_content'] else '')
+                  + _settings(update['label_content']) for update in self.update_labels]
+        lines += [f"- label {label['name']}" for label in self.delete_labels]
+        lines += [f"- filter {_describe(gmail_filter)}" for gmail_filter in self.delete_filters]
+        lines += [f"~ filter {_describe(gmail_filter['replaces'])} replaced by {_describe(gmail_filter)}"
+                  if gmail_filter.get('replaces') else f"+ filter {_describe(gmail_filter)}"
+                  for gmail_filter in self.create_filters]
+        lines += [f"! {error}" for error in self.errors]
+        return '\n'.join(lines)
+
+    def apply(self, gmail_api: GmailAPI) -> List[Dict]:
+        """
+        Run the plan, phase by phase.
+
+        Returns:
+            The results of every operation (see GmailBatch.execute). Filters using a label that
+            could not be created fail without being sent. A replaced filter is kept if its
+            replacement could not be created.
+        """
+        results = []
+        with gmail_api.batch() as batch:
+            for label_content in self.create_labels:
+                batch.create_label(label_content)
+            for update in self.update_labels:
+                batch.update_label(update['label_id'], update['label_content'])
+        results += batch.results
+
+        labels = gmail_api.list_labels()
+        if isinstance(labels, GmailError):
+            return results + [{'operation': 'list_labels', 'target': None, 'ok': False, 'error': str(labels)}]
+        label_ids = {label['name']: label['id'] for label in labels}
+        replacements = []
+        with gmail_api.batch() as batch:
+            for gmail_filter in self.delete_filters:
+                batch.delete_filter(gmail_filter['filter_id'])
+            unresolved = []
+            for gmail_filter in self.create_filters:
+                action, missing = _action_to_ids(gmail_filter['action'], label_ids)
+                if missing:
+                    unresolved.append({'operation': 'create_filter', 'target': gmail_filter['criteria'], 'ok': False,
+                                       'error': f"Unknown label(s): {', '.join(missing)}"})
+                    continue
+                index = batch.create_filter(gmail_filter['criteria'], action)
+                if gmail_filter.get('replaces'):
+                    replacements.append((index, gmail_filter['replaces']))
+        results += batch.results + unresolved
+
+        created = batch.results
+        with gmail_api.batch() as batch:
+            for index, replaced in replacements:
+                if created[index]['ok']:
+                    batch.delete_filter(replaced['filter_id'])
+        results += batch.results
+
+        with gmail_api.batch() as batch:
+            for label in self.delete_labels:
+                batch.delete_label(label['label_id'])
+        return results + batch.results
+
+
+class MailboxConfig:
+    """
+    The desired label tree and filter set of a mailbox, read from and written to YAML.
+
+    Filters refer to labels by name, so a config can be applied to another account.
+
+    Format:
+        prune: false  # Delete the user labels and the filters missing from the config
+        labels:
+          - name: Work
+            color: {backgroundColor: '#4a86e8', textColor: '#000000'}  # Optional settings,
+            messageListVisibility: hide                                # left unchanged if absent
+          - name: Travel
+            renamed_from: Trips  # Renames the label Trips, keeping its messages
+        filters:
+          - criteria: {from: boss@example.com}
+            action: {addLabels: [Work], removeLabels: [INBOX]}
+
+    Filters cannot be patched: a filter whose criteria match a current filter but whose actions
+    differ replaces it. Unchanged labels and filters are left alone.
+    """
+
+    def __init__(self, labels: Optional[List[Dict]] = None, filters: Optional[List[Dict]] = None, prune: bool = False):
+        """
+        Initializes the MailboxConfig object.
+
+        Args:
+            labels (List[Dict]): The user labels, each with a name and optional settings.
+            filters (List[Dict]): The filters, each with criteria and an action using label names.
+            prune (bool): Delete the user labels and the filters missing from the config.
+        """
+        self.labels = labels or []
+        self.filters = filters or []
+        self.prune = prune
+
+    @classmethod
+    def from_yaml(cls, text: str) -> 'MailboxConfig':
+        """Parse a config, raising a ValueError if it is malformed."""
+        try:
+            data = yaml.safe_load(text) or {}
+        except yaml.YAMLError as error:
+            raise ValueError(f"Invalid YAML: {error}") from None
+        if not isinstance(data, dict):
+            raise ValueError("The config must be a mapping with 'labels' and 'filters'.")
+        labels, filters = data.get('labels') or [], data.get('filters') or []
+        names = set()
+        for label in labels:
+            if not isinstance(label, dict) or not label.get('name'):
+                raise ValueError(f"Every label needs a name: {label!r}")
+            if label['name'] in names:
+                raise ValueError(f"Label {label['name']} is declared twice.")
+            names.add(label['name'])
+        for gmail_filter in filters:
+            if not isinstance(gmail_filter, dict) or not _criteria(gmail_filter.get('criteria')):
+                raise ValueError(f"Every filter needs criteria: {gmail_filter!r}")
+            unknown = set(gmail_filter.get('action') or {}) - set(FILTER_ACTIONS)
+            if unknown:
+                raise ValueError(f"Unknown filter action(s) {', '.join(sorted(unknown))}, "
+                                 f"use {', '.join(FILTER_ACTIONS)}.")
+        return cls(labels, filters, bool(data.get('prune', False)))
+
+    @classmethod
+    def export(cls, labels: List[Dict], filters: List[Dict]) -> 'MailboxConfig':
+        """The config of the current labels and filters, as returned by list_labels and list_filters."""
+        label_names = {label['id']: label['name'] for label in labels}
+        exported_labels = []
+        for label in sorted((label for label in labels if label.get('type') != 'system'), key=lambda l: l['name']):
+            exported = {'name': label['name']}
+            for setting in LABEL_SETTINGS:
+                value = _color(label.get(setting)) if setting == 'color' else label.get(setting)
+                if value is not None and value != LABEL_DEFAULTS.get(setting):
+                    exported[setting] = value
+            exported_labels.append(exported)
+        exported_filters = [{'criteria': _criteria(gmail_filter.get('criteria')),
+                             'action': _action_to_names(gmail_filter.get('action'), label_names)}
+                            for gmail_filter in filters]
+        return cls(exported_labels, exported_filters)
+
+    def to_yaml(self) -> str:
+        return yaml.safe_dump({'prune': self.prune, 'labels': self.labels, 'filters': self.filters},
+                              sort_keys=False, allow_unicode=True)
+
+    def plan(self, labels: List[Dict], filters: List[Dict]) -> ConfigPlan:
+        """
+        Diff the config against the current labels and filters.
+
+        Args:
+            labels (List[Dict]): The current labels, as returned by list_labels.
+            filters (List[Dict]): The current filters, as returned by list_filters.
+
+        Returns:
+            The minimal plan: only the labels and filters that differ are created, patched or deleted.
+        """
+        plan = ConfigPlan()
+        by_name = {label['name']: label for label in labels}
+        kept_ids = set()
+        for desired in self.labels:
+            name = desired['name']
+            current = by_name.get(name)
+            if current is None and desired.get('renamed_from') in by_name:
+                current = by_name[desired['renamed_from']]
+            settings = {setting: desired[setting] for setting in LABEL_SETTINGS if setting in desired}
+            if current is None:
+                plan.create_labels.append({'name': name, **settings})
+                continue
+            kept_ids.add(current['id'])
+            if current.get('type') == 'system':
+                plan.errors.append(f"{name} is a system label, it cannot be changed.")
+                continue
+            changes = {'name': name} if current['name'] != name else {}
+            for setting, value in settings.items():
+                current_value = current.get(setting, LABEL_DEFAULTS.get(setting))
+                if setting == 'color':
+                    value, current_value = _color(value), _color(current_value)
+                if value != current_value:
+                    changes[setting] = value
+            if changes:
+                plan.update_labels.append({'label_id': current['id'], 'name': current['name'], 'label_content': changes})
+            else:
+                plan.unchanged['labels'] += 1
+        if self.prune:
+            plan.delete_labels = [{'label_id': label['id'], 'name': label['name']} for label in labels
+                                  if label.get('type') != 'system' and label['id'] not in kept_ids]
+
+        # Names of the labels once the plan ran (renames included), for the filters' actions
+        label_names = {label['id']: label['name'] for label in labels}
+        label_names.update({update['label_id']: update['label_content']['name'] for update in plan.update_labels
+                            if 'name' in update['label_content']})
+        known = {label['name'] for label in labels} | {label['name'] for label in self.labels}
+        known -= {label['name'] for label in plan.delete_labels}
+        current_filters = [{'filter_id': gmail_filter['id'], 'criteria': _criteria(gmail_filter.get('criteria')),
+                            'action': _action_to_names(gmail_filter.get('action'), label_names)}
+                           for gmail_filter in filters]
+        unmatched = list(current_filters)
+        for desired in self.filters:
+            wanted = {'criteria': _criteria(desired.get('criteria')), 'action': _normalize_action(desired.get('action'))}
+            missing = [name for key in ('addLabels', 'removeLabels') for name in wanted['action'].get(key, [])
+                       if name not in known and not _is_system_label(name)]
+            if missing:
+                plan.errors.append(f"Filter {_describe(wanted)} uses unknown label(s) {', '.join(missing)}.")
+                continue
+            same = next((current for current in unmatched if current['criteria'] == wanted['criteria']
+                         and current['action'] == wanted['action']), None)
+            if same is not None:
+                unmatched.remove(same)
+                plan.unchanged['filters'] += 1
+                continue
+            # Filters cannot be patched, a filter with the same criteria is replaced
+            previous = next((current for current in unmatched if current['criteria'] == wanted['criteria']), None)
+            if previous is not None:
+                unmatched.remove(previous)
+                wanted['replaces'] = previous
+            plan.create_filters.append(wanted)
+        plan.delete_filters = unmatched if self.prune else []
+        return plan
+
+
+def _normalize_action(action: Optional[Dict]) -> Dict:
+    normalized = {}
+    for key in ('addLabels', 'removeLabels'):
+        names = (action or {}).get(key)
+        if isinstance(names, str):
+            names = names.split(',')
+        names = sorted(name.strip() for name in names or [] if name.strip())
+        if names:
+            normalized[key] = names
+    if (action or {}).get('forward'):
+        normalized['forward'] = action['forward']
+    return normalized
+
+
+def _action_to_names(action: Optional[Dict], label_names: Dict[str, str]) -> Dict:
+    """A Gmail filter action with label IDs as a config action with label names."""
+    action = action or {}
+    return _normalize_action({
+        'addLabels': [label_names.get(label_id, label_id) for label_id in GmailAPI._split_label_ids(action.get('addLabelIds'))],
+        'removeLabels': [label_names.get(label_id, label_id)
+                         for label_id in GmailAPI._split_label_ids(action.get('removeLabelIds'))],
+        'forward': action.get('forward')
+    })
+
+
+def _action_to_ids(action: Dict, label_ids: Dict[str, str]) -> Tuple[Dict, List[str]]:
+    """A config action as a Gmail filter action, and the label names that do not exist."""
+    gmail_action, missing = {}, []
+    for key, gmail_key in (('addLabels', 'addLabelIds'), ('removeLabels', 'removeLabelIds')):
+        ids = []
+        for name in action.get(key, []):
+            label_id = label_ids.get(name, name if _is_system_label(name) else None)
+            if label_id is None:
+                missing.append(name)
+            else:
+                ids.append(label_id)
+        if ids:
+            gmail_action[gmail_key] = ids
+    if action.get('forward'):
+        gmail_action['forward'] = action['forward']
+    return gmail_action, missing
+
+
+def _is_system_label(name: str) -> bool:
+    return name in SYSTEM_LABEL_IDS or name.startswith('CATEGORY_')
+
+
+def _settings(label: Dict) -> str:
+    settings = {key: value for key, value in label.items() if key in LABEL_SETTINGS}
+    return f" {settings}" if settings else ''
+
+
+def _describe(gmail_filter: Dict) -> str:
+    criteria = ' '.join(f"{key}:{value}" for key, value in gmail_filter['criteria'].items())
+    action = ' '.join([f"+{name}" for name in gmail_filter['action'].get('addLabels', [])]
+                      + [f"-{name}" for name in gmail_filter['action'].get('removeLabels', [])]
+                      + ([f"forward:{gmail_filter['action']['forward']}"] if gmail_filter['action'].get('forward') else []))
+    return f"{criteria} -> {action}"
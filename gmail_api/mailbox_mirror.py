@@ -0,0 +1,267 @@
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.filter_matcher import MessageMetadata, MessageStore
+from gmail_api.gmail_api import GmailAPI, GmailAPIError, GmailBatch, GmailError
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT NOT NULL,
+    sender TEXT NOT NULL DEFAULT '',
+    recipients TEXT NOT NULL DEFAULT '',
+    cc TEXT NOT NULL DEFAULT '',
+    subject TEXT NOT NULL DEFAULT '',
+    snippet TEXT NOT NULL DEFAULT '',
+    date REAL NOT NULL DEFAULT 0,
+    size_estimate INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_thread ON messages (thread_id);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (date DESC);
+
+CREATE TABLE IF NOT EXISTS message_labels (
+    label_id TEXT NOT NULL,
+    message_id TEXT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    PRIMARY KEY (label_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS message_labels_message ON message_labels (message_id);
+
+-- Messages whose fetch failed (e.g. on a transient 429 or 5xx), fetched again by the next sync
+CREATE TABLE IF NOT EXISTS pending_messages (
+    id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class MailboxMirror:
+    """
+    Local SQLite mirror of the metadata of a mailbox (headers and labels, never bodies).
+
+    The first sync backfills every message with batched messages.get calls (format=metadata).
+    Later syncs replay users.history.list from the last stored historyId: label changes are
+    applied from the history records themselves and only new messages are fetched, so keeping
+    up usually costs one or two API calls. If the stored historyId has expired (HTTP 404),
+    the mirror is rebuilt from scratch.
+
+    Messages that could not be fetched are kept in a pending table and fetched again by the next
+    sync, so the historyId can move on without losing them.
+    """
+
+    def __init__(self, gmail_api: GmailAPI, db_path: str, page_size: int = 500):
+        """
+        Initializes the MailboxMirror object.
+
+        Args:
+            gmail_api (GmailAPI): Authenticated client of the mirrored account.
+            db_path (str): Path of the SQLite database, created if missing.
+            page_size (int): Number of message IDs listed, and history records read, per call.
+        """
+        self.gmail_api = gmail_api
+        self.db_path = db_path
+        self.page_size = page_size
+        self._sync_lock = threading.Lock()
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # region SYNC
+    def sync(self) -> Union[Dict, GmailError]:
+        """
+        Bring the mirror up to date, with a full backfill on the first run and history replay afterwards.
+
+        Returns:
+            A dictionary with the sync statistics if successful, a GmailError otherwise.
+            {
+                "mode": "full" or "incremental",
+                "fetched": number of messages fetched,
+                "deleted": number of messages removed,
+                "relabeled": number of messages whose labels changed,
+                "failed": number of messages that could not be fetched, retried by the next sync,
+                "history_id": the history ID the mirror is now at
+            }
+        """
+        with self._sync_lock:
+            try:
+                history_id = self.history_id
+                stats = None
+                if history_id is not None:
+                    try:
+                        stats = self._incremental_sync(history_id)
+                    except GmailAPIError as error:
+                        if error.error.status != 404:
+                            raise
+                        print(f'History {history_id} expired, resyncing the mailbox from scratch')
+                if stats is None:
+                    stats = self._full_sync()
+            except Exception as error:
+                return self.gmail_api._failure('sync', error)
+            if stats['failed']:
+                print(f"{stats['failed']} message(s) could not be fetched, they will be retried on the next sync")
+            return stats
+
+    def _full_sync(self) -> Dict:
+        # The history ID is read before listing, so changes made during the backfill are replayed next time
+        history_id = self.gmail_api.get_profile()['historyId']
+        stats = {'mode': 'full', 'fetched': 0, 'deleted': 0, 'relabeled': 0, 'failed': 0, 'history_id': history_id}
+        with self._connect() as connection:
+            connection.execute('DELETE FROM messages')
+            connection.execute('DELETE FROM pending_messages')
+            connection.execute('DELETE FROM sync_state')
+        for page in self.gmail_api.iter_message_ids('', page_size=self.page_size):
+            stats['fetched'] += self._fetch(page)
+        stats['failed'] = self.pending_count()
+        self._set_state('history_id', history_id)
+        return stats
+
+    def _incremental_sync(self, history_id: str) -> Dict:
+        added: Set[str] = set()
+        deleted: Set[str] = set()
+        labels: Dict[str, List[str]] = {}
+        for response in self.gmail_api.iter_history(history_id, page_size=self.page_size):
+            # Records are in chronological order, so the last label list seen for a message is its current one
+            for record in response.get('history', []):
+                for change in record.get('messagesAdded', []):
+                    added.add(change['message']['id'])
+                    deleted.discard(change['message']['id'])
+                for change in record.get('messagesDeleted', []):
+                    deleted.add(change['message']['id'])
+                    added.discard(change['message']['id'])
+                for key in ('labelsAdded', 'labelsRemoved'):
+                    for change in record.get(key, []):
+                        labels[change['message']['id']] = change['message'].get('labelIds', [])
+            history_id = response.get('historyId', history_id)
+
+        with self._connect() as connection:
+            connection.executemany('DELETE FROM messages WHERE id = ?', ((message_id,) for message_id in deleted))
+            connection.executemany('DELETE FROM pending_messages WHERE id = ?', ((message_id,) for message_id in deleted))
+            # The messages a previous sync failed to fetch are fetched again with the new ones
+            added |= {row[0] for row in connection.execute('SELECT id FROM pending_messages')}
+            relabeled = [message_id for message_id in labels if message_id not in added and message_id not in deleted]
+            for message_id in relabeled:
+                connection.execute('DELETE FROM message_labels WHERE message_id = ?', (message_id,))
+                connection.executemany(
+                    'INSERT OR IGNORE INTO message_labels (label_id, message_id) '
+                    'SELECT ?, id FROM messages WHERE id = ?',
+                    ((label_id, message_id) for label_id in labels[message_id]))
+        fetched = self._fetch(sorted(added))
+        self._set_state('history_id', history_id)
+        return {'mode': 'incremental', 'fetched': fetched, 'deleted': len(deleted),
+                'relabeled': len(relabeled), 'failed': self.pending_count(), 'history_id': history_id}
+
+    def _fetch(self, message_ids: List[str]) -> int:
+        """
+        Fetch the metadata of messages with batched calls and store it. Returns the number stored.
+        
+        Messages that could not be fetched are recorded as pending, except the ones deleted since
+        they were listed (HTTP 404).
+        """
+        if not message_ids:
+            return 0
+        batch = self.gmail_api.batch(batch_size=GmailBatch.MAX_BATCH_SIZE)
+        for message_id in message_ids:
+            batch.get_message_metadata(message_id)
+        results = batch.execute()
+        messages = [entry['result'] for entry in results if entry['ok']]
+        failed = {entry['target'] for entry in results if not entry['ok'] and entry.get('status') != 404}
+        self.store(MessageMetadata.from_gmail(message) for message in messages)
+        with self._connect() as connection:
+            connection.executemany('DELETE FROM pending_messages WHERE id = ?',
+                                   ((message_id,) for message_id in message_ids if message_id not in failed))
+            connection.executemany('INSERT OR IGNORE INTO pending_messages (id) VALUES (?)',
+                                   ((message_id,) for message_id in failed))
+        return len(messages)
+    # endregion
+
+    # region STORAGE
+    def store(self, messages: Iterable[MessageMetadata]) -> None:
+        """Insert or replace messages and their labels."""
+        with self._connect() as connection:
+            for message in messages:
+                connection.execute(
+                    'INSERT OR REPLACE INTO messages '
+                    '(id, thread_id, sender, recipients, cc, subject, snippet, date, size_estimate) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (message.id, message.thread_id, message.sender, message.to, message.cc,
+                     message.subject, message.snippet, message.date, message.size_estimate))
+                connection.execute('DELETE FROM message_labels WHERE message_id = ?', (message.id,))
+                connection.executemany(
+                    'INSERT OR IGNORE INTO message_labels (label_id, message_id) VALUES (?, ?)',
+                    ((label_id, message.id) for label_id in message.label_ids))
+
+    @property
+    def history_id(self) -> Optional[str]:
+        """The history ID the mirror is up to date with, None before the first sync."""
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM sync_state WHERE key = 'history_id'").fetchone()
+        return row[0] if row else None
+
+    def pending_count(self) -> int:
+        """Number of messages that could not be fetched yet."""
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM pending_messages').fetchone()[0]
+
+    def _set_state(self, key: str, value: str) -> None:
+        with self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def __len__(self) -> int:
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def messages(self, limit: Optional[int] = None, label_id: Optional[str] = None) -> List[MessageMetadata]:
+        """
+        Read mirrored messages, newest first.
+
+        Args:
+            limit (int): Maximum number of messages returned, None for all of them.
+            label_id (str): Only return the messages with this label.
+
+        Returns:
+            The messages with their labels.
+        """
+        query = ('SELECT m.id, m.thread_id, m.sender, m.recipients, m.cc, m.subject, m.snippet, m.date, '
+                 'm.size_estimate, (SELECT group_concat(label_id) FROM message_labels WHERE message_id = m.id) '
+                 'FROM messages m')
+        params: List = []
+        if label_id is not None:
+            query += ' JOIN message_labels l ON l.message_id = m.id AND l.label_id = ?'
+            params.append(label_id)
+        query += ' ORDER BY m.date DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+        return [
+            MessageMetadata(id=row[0], thread_id=row[1], sender=row[2], to=row[3], cc=row[4], subject=row[5],
+                            snippet=row[6], date=row[7], size_estimate=row[8],
+                            label_ids=row[9].split(',') if row[9] else [])
+            for row in rows
+        ]
+
+    def load_store(self, limit: Optional[int] = None) -> MessageStore:
+        """Load mirrored messages, newest first, into a MessageStore for local filter evaluation."""
+        return MessageStore(self.messages(limit=limit))
+    # endregion
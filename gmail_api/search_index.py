@@ -0,0 +1,278 @@
+import bisect
+import os
+import re
+import sys
+import time
+from array import array
+from email.utils import getaddresses
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.filter_matcher import SYSTEM_LABELS, MessageMetadata
+from gmail_api.search_query import Node, normalize_label_name, parse_date, parse_query, parse_relative
+
+_WORD = re.compile(r'\w+')
+
+
+def _popcount(mask: int) -> int:
+    return mask.bit_count() if hasattr(mask, 'bit_count') else bin(mask).count('1')
+
+
+class UnsupportedQueryError(ValueError):
+    """Raised when a query uses an operator the local index cannot answer."""
+
+
+class _Bitmap:
+    """A dense set of document IDs, stored as the bits of a Python int."""
+
+    __slots__ = ('mask', '_count', '_bytes')
+
+    def __init__(self, mask: int, count: Optional[int] = None):
+        self.mask = mask
+        self._count = count
+        self._bytes: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        if self._count is None:
+            self._count = _popcount(self.mask)
+        return self._count
+
+    def __contains__(self, doc: int) -> bool:
+        if self._bytes is None:
+            self._bytes = self.mask.to_bytes((self.mask.bit_length() + 7) // 8, 'little')
+        return doc >> 3 < len(self._bytes) and bool(self._bytes[doc >> 3] >> (doc & 7) & 1)
+
+    def __iter__(self) -> Iterator[int]:
+        if self._bytes is None:
+            self._bytes = self.mask.to_bytes((self.mask.bit_length() + 7) // 8, 'little')
+        for position, byte in enumerate(self._bytes):
+            while byte:
+                lowest = byte & -byte
+                yield position * 8 + lowest.bit_length() - 1
+                byte ^= lowest
+
+
+# An intermediate result is either a sorted sequence of document IDs (sparse) or a _Bitmap (dense)
+Postings = Union[array, List[int], _Bitmap]
+
+
+class SearchIndex:
+    """
+    Inverted index over message headers answering Gmail-style search queries locally.
+
+    Documents are numbered newest first, so date operators resolve to a contiguous range of
+    document IDs with a binary search. Rare terms are kept as sorted posting lists and frequent
+    ones (a label such as INBOX, a common domain) as bitmaps. Conjunctions intersect operands
+    smallest first: a short posting list is filtered against the others with binary searches or
+    bit tests, and two large operands are intersected with a single big-integer AND. `OR` and
+    `-` are unions and complements on the same representations.
+
+    Indexed fields:
+        from / to (to and cc): full address, local part (`newsletters@`), domain and its parent
+            domains (`@shop.com`, `shop.com`), display name words.
+        subject: words. Phrases match messages containing every word of the phrase.
+        label / in / is / category: label IDs, and user label names.
+        after / before / older_than / newer_than: the internal date.
+        Free text: words of the subject and of the sender.
+    """
+
+    DENSE_RATIO = 32  # Posting lists longer than 1/32 of the documents are stored as bitmaps
+
+    def __init__(self, messages: Iterable[MessageMetadata], labels: Optional[List[Dict]] = None):
+        """
+        Initializes the SearchIndex object.
+
+        Args:
+            messages (Iterable[MessageMetadata]): The messages to index, e.g. read from the MailboxMirror.
+            labels (List[Dict]): The user's labels, to resolve `label:` by name.
+        """
+        self.messages: List[MessageMetadata] = sorted(messages, key=lambda message: -message.date)
+        self._negated_dates = array('d', (-message.date for message in self.messages))
+        self.label_names = {normalize_label_name(label['name']): label['id'] for label in labels or []}
+        self.built_at = time.monotonic()
+        self._all = _Bitmap((1 << len(self.messages)) - 1, len(self.messages))
+
+        postings: Dict[Tuple[str, str], List[int]] = {}
+        for doc, message in enumerate(self.messages):
+            keys = set()
+            for field_name, header in (('from', message.sender), ('to', message.to), ('to', message.cc)):
+                keys.update((field_name, token) for token in self._address_tokens(header))
+            keys.update(('subject', word) for word in _WORD.findall(message.subject.casefold()))
+            keys.update(('label', label_id) for label_id in message.label_ids)
+            for key in keys:
+                postings.setdefault(key, []).append(doc)
+
+        dense = max(1024, len(self.messages) // self.DENSE_RATIO)
+        self.postings: Dict[Tuple[str, str], Postings] = {
+            key: self._bitmap(docs) if len(docs) > dense else array('i', docs)
+            for key, docs in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    @staticmethod
+    def _address_tokens(header: str) -> Set[str]:
+        tokens = set()
+        for name, address in getaddresses([header]):
+            tokens.update(_WORD.findall(name.casefold()))
+            address = address.casefold()
+            if '@' not in address:
+                tokens.update(_WORD.findall(address))
+                continue
+            tokens.add(address)
+            local, domain = address.rsplit('@', 1)
+            tokens.update((local, local + '@'))
+            parts = domain.split('.')
+            for start in range(len(parts) - 1):
+                parent = '.'.join(parts[start:])
+                tokens.update((parent, '@' + parent))
+        return tokens
+
+    # region SEARCH
+    def search(self, query: Union[str, Node], limit: Optional[int] = None,
+               offset: int = 0) -> Tuple[int, List[MessageMetadata]]:
+        """
+        Answer a Gmail search query from the index.
+
+        Args:
+            query (Union[str, Node]): Gmail search query, or a query parsed with parse_query.
+            limit (int): Maximum number of messages returned, None for all of them.
+            offset (int): Number of matching messages skipped, to page through the results.
+
+        Returns:
+            The number of matching messages, and the matching messages newest first.
+
+        Raises:
+            UnsupportedQueryError: If the query uses an operator that is not indexed (e.g. has:attachment).
+        """
+        node = parse_query(query) if isinstance(query, str) else query
+        docs = self._evaluate(node)
+        end = None if limit is None else offset + limit
+        return len(docs), [self.messages[doc] for doc in islice(docs, offset, end)]
+
+    def count(self, query: Union[str, Node]) -> int:
+        """Return the number of messages matching a Gmail search query."""
+        return self.search(query, limit=0)[0]
+
+    def _evaluate(self, node: Node) -> Postings:
+        kind = node[0]
+        if kind == 'term':
+            return self._term(node[1], node[2], node[3])
+        if kind == 'not':
+            return self._difference(self._all, self._evaluate(node[1]))
+        if kind == 'or':
+            return self._union([self._evaluate(child) for child in node[1]])
+
+        # Conjunction: positive operands are intersected smallest first, negated ones subtracted last
+        positives = sorted((self._evaluate(child) for child in node[1] if child[0] != 'not'), key=len)
+        negatives = [self._evaluate(child[1]) for child in node[1] if child[0] == 'not']
+        result: Postings = positives[0] if positives else self._all
+        for operand in positives[1:]:
+            if not result:
+                break
+            result = self._intersect(result, operand)
+        for operand in negatives:
+            if not result:
+                break
+            result = self._difference(result, operand)
+        return result
+
+    def _term(self, field_name: Optional[str], raw_value: str, exact: bool) -> Postings:
+        value = raw_value.casefold()
+        if field_name is None:
+            words = _WORD.findall(value)
+            return self._evaluate(('and', [('or', [('term', 'subject', word, False), ('term', 'from', word, False)])
+                                           for word in words]))
+        if field_name in ('from', 'to', 'cc'):
+            key = ('from' if field_name == 'from' else 'to', value)
+            words = _WORD.findall(value)
+            if key not in self.postings and len(words) > 1 and '@' not in value:
+                # A display name such as from:"Jane Doe"
+                return self._evaluate(('and', [('term', field_name, word, False) for word in words]))
+            return self.postings.get(key, array('i'))
+        if field_name == 'subject':
+            words = _WORD.findall(value)
+            if len(words) == 1:
+                return self.postings.get(('subject', words[0]), array('i'))
+            return self._evaluate(('and', [('term', 'subject', word, False) for word in words]))
+        if field_name in ('label', 'in', 'is', 'category'):
+            if field_name == 'in' and value == 'anywhere':
+                return self._all
+            if field_name == 'is' and value == 'read':
+                return self._difference(self._all, self._label('UNREAD'))
+            label_id = SYSTEM_LABELS.get(value)
+            if field_name in ('label', 'in') and label_id is None:
+                label_id = self.label_names.get(normalize_label_name(value), raw_value)
+            if label_id is None:
+                raise UnsupportedQueryError(f'{field_name}:{value} is not indexed')
+            return self._label(label_id)
+        if field_name in ('after', 'before', 'newer', 'older', 'older_than', 'newer_than'):
+            if field_name in ('older_than', 'newer_than'):
+                bound = parse_relative(value, time.time())
+            else:
+                bound = parse_date(value)
+            if bound is None:
+                raise UnsupportedQueryError(f'{field_name}:{value} is not a valid date')
+            # Documents are sorted newest first, so the messages at or after the bound are a prefix
+            newer = bisect.bisect_right(self._negated_dates, -bound)
+            if field_name in ('after', 'newer', 'newer_than'):
+                return _Bitmap((1 << newer) - 1, newer)
+            return _Bitmap(self._all.mask ^ ((1 << newer) - 1), len(self.messages) - newer)
+        raise UnsupportedQueryError(f'{field_name}:{value} is not indexed, only the headers and labels are')
+
+    def _label(self, label_id: str) -> Postings:
+        return self.postings.get(('label', label_id), array('i'))
+    # endregion
+
+    # region POSTING LISTS
+    def _bitmap(self, docs: Postings) -> _Bitmap:
+        if isinstance(docs, _Bitmap):
+            return docs
+        bits = bytearray((len(self.messages) + 7) // 8)
+        for doc in docs:
+            bits[doc >> 3] |= 1 << (doc & 7)
+        return _Bitmap(int.from_bytes(bits, 'little'), len(docs))
+
+    def _intersect(self, small: Postings, large: Postings) -> Postings:
+        if isinstance(small, _Bitmap) and isinstance(large, _Bitmap):
+            return _Bitmap(small.mask & large.mask)
+        if isinstance(small, _Bitmap):
+            small, large = large, small
+        if isinstance(large, _Bitmap):
+            return [doc for doc in small if doc in large]
+        if len(small) * 16 < len(large):
+            # Much shorter list: binary search each document in the longer one
+            result, low = [], 0
+            for doc in small:
+                low = bisect.bisect_left(large, doc, low)
+                if low == len(large):
+                    break
+                if large[low] == doc:
+                    result.append(doc)
+            return result
+        return sorted(set(small).intersection(large))
+
+    def _difference(self, docs: Postings, excluded: Postings) -> Postings:
+        if not excluded or not docs:
+            return docs
+        if isinstance(docs, _Bitmap):
+            return _Bitmap(docs.mask & ~self._bitmap(excluded).mask)
+        if isinstance(excluded, _Bitmap):
+            return [doc for doc in docs if doc not in excluded]
+        excluded = set(excluded)
+        return [doc for doc in docs if doc not in excluded]
+
+    def _union(self, operands: List[Postings]) -> Postings:
+        operands = [operand for operand in operands if operand]
+        if len(operands) <= 1:
+            return operands[0] if operands else array('i')
+        if all(not isinstance(operand, _Bitmap) for operand in operands) \
+                and sum(map(len, operands)) * self.DENSE_RATIO < len(self.messages):
+            return sorted(set().union(*operands))
+        mask = 0
+        for operand in operands:
+            mask |= self._bitmap(operand).mask
+        return _Bitmap(mask)
+    # endregion
@@ -0,0 +1,203 @@
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple, Union
+
+# Gmail search queries are parsed into a small tree of tuples:
+#   ('and', [nodes]) | ('or', [nodes]) | ('not', node) | ('term', field, value, exact)
+# where field is None for free text and exact is True for quoted phrases.
+Node = Tuple
+
+FIELDS = {
+    'from', 'to', 'cc', 'bcc', 'subject', 'label', 'in', 'is', 'has', 'category', 'list', 'deliveredto',
+    'after', 'before', 'older', 'newer', 'older_than', 'newer_than', 'larger', 'smaller', 'size', 'rfc822msgid'
+}
+
+# Only the known operators are fields, anything else such as `foo:bar` or a URL is a single word
+_TOKEN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<lbrace>\{)
+  | (?P<rbrace>\})
+  | (?P<quoted>"[^"]*"?)
+  | (?P<field>(?i:%s)):(?=\S)
+  | (?P<not>-)(?=[^\s-])
+  | (?P<word>[^\s(){}"]+)
+''' % '|'.join(sorted(FIELDS, key=len, reverse=True)), re.VERBOSE)
+
+
+def criteria_to_query(criteria: Dict[str, Union[str, bool, int]]) -> str:
+    """
+    Translate a filter criteria dictionary into the equivalent Gmail search query.
+
+    Args:
+        criteria (Dict): Filter criteria dictionary with possible keys:
+            from, to, subject, query, negatedQuery, hasAttachment, size, sizeComparison.
+
+    Returns:
+        The Gmail search query matching the same messages as the filter.
+    """
+    terms = []
+    for key in ('from', 'to', 'subject'):
+        if criteria.get(key):
+            terms.append(f"{key}:({criteria[key]})")
+    if criteria.get('query'):
+        terms.append(f"({criteria['query']})")
+    if criteria.get('negatedQuery'):
+        terms.append(f"-({criteria['negatedQuery']})")
+    if criteria.get('hasAttachment'):
+        terms.append('has:attachment')
+    if criteria.get('size') and criteria.get('sizeComparison') in ('larger', 'smaller'):
+        terms.append(f"{criteria['sizeComparison']}:{criteria['size']}")
+    return ' '.join(terms)
+
+
+def tokenize(query: str) -> List[Tuple[str, str]]:
+    """Split a Gmail search query into (kind, text) tokens."""
+    tokens = []
+    for match in _TOKEN.finditer(query):
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'space':
+            continue
+        if kind == 'word' and text in ('OR', '|'):
+            kind = 'or'
+        elif kind == 'word' and text == 'AND':
+            continue
+        tokens.append((kind, text))
+    return tokens
+
+
+class QueryParser:
+    """
+    Recursive descent parser of the Gmail search syntax: field operators (`from:`, `label:`...),
+    negation with `-`, `OR` / `{}` alternatives, `()` grouping, quoted phrases and implicit AND.
+    A field applied to a group, e.g. `from:(a OR b)`, applies to every term of the group.
+    """
+
+    def __init__(self, query: str):
+        self.tokens = tokenize(query)
+        self.position = 0
+
+    def parse(self) -> Node:
+        node = self._sequence(None, stop=())
+        # Unbalanced closing brackets are ignored, like Gmail does
+        while self.position < len(self.tokens):
+            self.position += 1
+            node = ('and', [node, self._sequence(None, stop=())])
+        return _simplify(node)
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _sequence(self, field: Optional[str], stop: Tuple[str, ...]) -> Node:
+        nodes = []
+        while self._peek() is not None and self._peek()[0] not in stop + ('rparen', 'rbrace'):
+            nodes.append(self._alternatives(field))
+        return ('and', nodes)
+
+    def _alternatives(self, field: Optional[str]) -> Node:
+        nodes = [self._unary(field)]
+        while self._peek() is not None and self._peek()[0] == 'or':
+            self.position += 1
+            if self._peek() is None or self._peek()[0] in ('rparen', 'rbrace'):
+                break
+            nodes.append(self._unary(field))
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def _unary(self, field: Optional[str]) -> Node:
+        kind, text = self._peek()
+        if kind == 'not':
+            self.position += 1
+            return ('not', self._unary(field))
+        return self._atom(field)
+
+    def _atom(self, field: Optional[str]) -> Node:
+        kind, text = self._peek()
+        self.position += 1
+        if kind == 'lparen':
+            node = self._sequence(field, stop=('rparen',))
+            self._expect('rparen')
+            return node
+        if kind == 'lbrace':
+            nodes = []
+            while self._peek() is not None and self._peek()[0] != 'rbrace':
+                if self._peek()[0] == 'or':
+                    self.position += 1
+                    continue
+                nodes.append(self._unary(field))
+            self._expect('rbrace')
+            return ('or', nodes)
+        if kind == 'field':
+            if self._peek() is None:
+                return ('term', None, text, False)
+            return self._unary(text.lower())
+        if kind == 'quoted':
+            return ('term', field, text.strip('"'), True)
+        # A stray 'or' or closing bracket is read as a plain word
+        return ('term', field, text, False)
+
+    def _expect(self, kind: str) -> None:
+        if self._peek() is not None and self._peek()[0] == kind:
+            self.position += 1
+
+
+def _simplify(node: Node) -> Node:
+    """Flatten nested and/or nodes and drop single-child wrappers."""
+    if node[0] in ('and', 'or'):
+        children = []
+        for child in (_simplify(child) for child in node[1]):
+            if child[0] == node[0]:
+                children.extend(child[1])
+            elif child != ('and', []):
+                children.append(child)
+        if len(children) == 1:
+            return children[0]
+        return (node[0], children)
+    if node[0] == 'not':
+        return ('not', _simplify(node[1]))
+    return node
+
+
+def parse_query(query: str) -> Node:
+    """Parse a Gmail search query. An empty query parses to ('and', []), which matches everything."""
+    return QueryParser(query or '').parse()
+
+
+# region VALUE HELPERS
+_RELATIVE_UNITS = {'d': 86400, 'm': 30 * 86400, 'y': 365 * 86400}
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 * 1024}
+
+
+def parse_date(value: str) -> Optional[float]:
+    """Parse the value of `after:`/`before:` (YYYY/MM/DD, YYYY-MM-DD or epoch seconds) into epoch seconds."""
+    if value.isdigit() and len(value) > 8:
+        return float(value)
+    for fmt in ('%Y/%m/%d', '%Y-%m-%d', '%Y/%m', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_relative(value: str, now: float) -> Optional[float]:
+    """Parse the value of `older_than:`/`newer_than:` (e.g. 2d, 3m, 1y) into the epoch seconds it points to."""
+    match = re.fullmatch(r'(\d+)([dmy])', value.lower())
+    if not match:
+        return None
+    return now - int(match.group(1)) * _RELATIVE_UNITS[match.group(2)]
+
+
+def parse_size(value: str) -> Optional[int]:
+    """Parse the value of `larger:`/`smaller:` (e.g. 10M, 500K, 1000) into bytes."""
+    match = re.fullmatch(r'(\d+)([kKmM]?)[bB]?', value)
+    if not match:
+        return None
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).lower()]
+
+
+def normalize_label_name(name: str) -> str:
+    """Normalize a label name the way the `label:` operator matches it (case, spaces and slashes)."""
+    return re.sub(r'[\s/]+', '-', name.strip().casefold())
+# endregion
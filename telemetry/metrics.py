@@ -0,0 +1,92 @@
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# Upper bounds in seconds of the duration buckets, from a Gmail call served from cache to a slow LLM turn
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class MetricsRegistry:
+    """
+    Aggregates of the finished spans, by kind (http, node, llm, tool, gmail, gmail_request) and name,
+    rendered in the Prometheus text exposition format.
+
+    Exposed series:
+        gmail_agent_span_duration_seconds (histogram): duration of the spans
+        gmail_agent_span_errors_total (counter): spans that ended with an error
+        gmail_agent_span_payload_bytes_total (counter): size of the results (or bodies) of the spans
+    """
+
+    PREFIX = 'gmail_agent_span'
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._durations: Dict[Tuple[str, str], _Histogram] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._payload_bytes: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, name: str, duration: float, error: Optional[str] = None, payload_bytes: int = 0) -> None:
+        """Record a finished span."""
+        key = (kind, name)
+        with self._lock:
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = _Histogram(self.buckets)
+            histogram.observe(duration)
+            if error is not None:
+                self._errors[key] = self._errors.get(key, 0) + 1
+            if payload_bytes:
+                self._payload_bytes[key] = self._payload_bytes.get(key, 0) + payload_bytes
+
+    def summary(self) -> List[Dict]:
+        """Count, total and mean duration, errors and payload of every kind and name, slowest total first."""
+        with self._lock:
+            rows = [{'kind': kind, 'name': name, 'count': sum(histogram.counts), 'total_seconds': histogram.total,
+                     'mean_seconds': histogram.total / max(1, sum(histogram.counts)),
+                     'errors': self._errors.get((kind, name), 0),
+                     'payload_bytes': self._payload_bytes.get((kind, name), 0)}
+                    for (kind, name), histogram in self._durations.items()]
+        return sorted(rows, key=lambda row: -row['total_seconds'])
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = [f'# HELP {self.PREFIX}_duration_seconds Duration of the spans.',
+                 f'# TYPE {self.PREFIX}_duration_seconds histogram']
+        with self._lock:
+            for (kind, name), histogram in sorted(self._durations.items()):
+                labels = f'kind="{_escape(kind)}",name="{_escape(name)}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{self.PREFIX}_duration_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+                cumulative += histogram.counts[-1]
+                lines.append(f'{self.PREFIX}_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+                lines.append(f'{self.PREFIX}_duration_seconds_sum{{{labels}}} {histogram.total:.6f}')
+                lines.append(f'{self.PREFIX}_duration_seconds_count{{{labels}}} {cumulative}')
+            for metric, help_text, values in (
+                    ('errors_total', 'Spans that ended with an error.', self._errors),
+                    ('payload_bytes_total', 'Size of the results of the spans.', self._payload_bytes)):
+                lines.append(f'# HELP {self.PREFIX}_{metric} {help_text}')
+                lines.append(f'# TYPE {self.PREFIX}_{metric} counter')
+                for (kind, name), value in sorted(values.items()):
+                    lines.append(f'{self.PREFIX}_{metric}{{kind="{_escape(kind)}",name="{_escape(name)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,300 @@
+import functools
+import inspect
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from telemetry.metrics import MetricsRegistry, metrics
+
+# The span the code running in this thread or task belongs to, the parent of the spans it starts
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+def payload_size(value: Any) -> int:
+    """Approximate size in bytes of a result: its length for text, its JSON encoding for the rest."""
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return len(str(value))
+
+
+class Span:
+    """A timed operation: a Flask request, a graph node, an LLM call, a tool call or a Gmail call."""
+
+    def __init__(self, kind: str, name: str, parent: Optional['Span'] = None, attributes: Optional[Dict] = None):
+        self.kind = kind
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+        self.payload_bytes = 0
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes) -> None:
+        """Add attributes to the span, e.g. span.set(thread_id=..., status=200)."""
+        self.attributes.update(attributes)
+
+    def set_payload(self, value: Any) -> None:
+        """Record the size of the result of the operation."""
+        self.payload_bytes = payload_size(value)
+
+    def fail(self, error: Any) -> None:
+        """Mark the span as failed, e.g. with an exception or a GmailError."""
+        self.error = str(error) or type(error).__name__
+
+    @property
+    def end_ns(self) -> int:
+        return self.start_ns + int((self.duration or 0.0) * 1e9)
+
+    def to_dict(self) -> Dict:
+        return {'kind': self.kind, 'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                'parent_id': self.parent_id, 'duration': self.duration, 'error': self.error,
+                'payload_bytes': self.payload_bytes, 'attributes': self.attributes}
+
+
+class Tracer:
+    """
+    Starts spans, nests them under the span of the calling code, and records every finished span in
+    the metrics registry and the exporter (if any).
+
+    The parent is kept in a context variable, so the spans of the tool calls run by the scheduler's
+    worker threads (which copy the context) nest under the tools node of the same turn.
+    """
+
+    def __init__(self, registry: MetricsRegistry = metrics, exporter: Optional['OTLPExporter'] = None):
+        """
+        Initializes the Tracer object.
+
+        Args:
+            registry (MetricsRegistry): Aggregates the finished spans for /metrics.
+            exporter (OTLPExporter): Optional exporter sending the finished spans to a collector.
+        """
+        self.registry = registry
+        self.exporter = exporter
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time the block as a span. An exception raised by the block marks the span as failed and is re-raised.
+
+        Usage:
+            with tracer.span('llm', 'gemini', thread_id=thread_id) as span:
+                response = model.invoke(messages)
+                span.set_payload(response.content)
+        """
+        span = self.start(kind, name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.fail(error)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def start(self, kind: str, name: str, **attributes) -> Span:
+        """Start a span under the current one, without making it current (see span() for a block)."""
+        return Span(kind, name, _current_span.get(), attributes)
+
+    def finish(self, span: Span) -> None:
+        """End a span and record it."""
+        span.duration = time.perf_counter() - span._start
+        self.registry.observe(span.kind, span.name, span.duration, span.error, span.payload_bytes)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current_span.get()
+
+    @staticmethod
+    def activate(span: Optional[Span]) -> None:
+        """Make a span started with start() the parent of the spans started afterwards in this context."""
+        _current_span.set(span)
+
+
+def traced(kind: str, name: Optional[str] = None, failure: Optional[Callable[[Any], bool]] = None) -> Callable:
+    """
+    Decorator timing every call of a function (or coroutine function) as a span.
+
+    Args:
+        kind (str): Kind of the span, e.g. 'gmail'.
+        name (str): Name of the span, defaults to the function name.
+        failure (Callable[[Any], bool]): Tells whether a returned value is a failure, for functions
+            that return their errors instead of raising them.
+    """
+    def decorator(function: Callable) -> Callable:
+        span_name = name or function.__name__
+
+        def finish(span: Span, result: Any) -> Any:
+            span.set_payload(result)
+            if failure is not None and failure(result):
+                span.fail(result)
+            return result
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(kind, span_name) as span:
+                    return finish(span, await function(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with tracer.span(kind, span_name) as span:
+                return finish(span, function(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def traced_methods(kind: str, failure: Optional[Callable[[Any], bool]] = None, exclude=()) -> Callable:
+    """
+    Class decorator tracing every public method of a class with `traced`.
+
+    Generators are left out (their span would end before they run), the requests they make are traced
+    where they are executed.
+    """
+    def decorator(cls):
+        for attribute, value in list(vars(cls).items()):
+            if (attribute.startswith('_') or attribute in exclude or not inspect.isfunction(value)
+                    or inspect.isgeneratorfunction(value) or inspect.isasyncgenfunction(value)):
+                continue
+            setattr(cls, attribute, traced(kind, attribute, failure)(value))
+        return cls
+    return decorator
+
+
+class OTLPExporter:
+    """
+    Sends the finished spans to an OpenTelemetry collector with OTLP/HTTP (JSON encoding), in batches,
+    from a background thread. Spans are dropped, oldest first, while the collector is unreachable.
+    """
+
+    KINDS = {'http': 2, 'gmail_request': 3, 'llm': 3}  # SERVER, CLIENT; anything else is INTERNAL (1)
+
+    def __init__(self, endpoint: str, service_name: str = 'gmail-agent', headers: Optional[Dict[str, str]] = None,
+                 interval: float = 2.0, max_batch: int = 512, max_queue: int = 10000, timeout: float = 5.0):
+        """
+        Initializes the OTLPExporter object.
+
+        Args:
+            endpoint (str): The traces endpoint of the collector, e.g. http://localhost:4318/v1/traces.
+            service_name (str): The service.name resource attribute.
+            headers (Dict[str, str]): Extra HTTP headers, e.g. for authentication.
+            interval (float): Seconds between two exports.
+            max_batch (int): Maximum number of spans sent in one request.
+            max_queue (int): Maximum number of spans waiting to be sent.
+            timeout (float): Seconds before an export request is abandoned.
+        """
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        self.interval = interval
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.exported = 0
+        self.failures = 0
+        self._queue: Deque[Span] = deque(maxlen=max_queue)
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='otlp-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        with self._condition:
+            self._queue.append(span)
+            if len(self._queue) >= self.max_batch:
+                self._condition.notify()
+
+    def flush(self) -> None:
+        """Send every queued span now."""
+        while True:
+            with self._condition:
+                batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            if not batch:
+                return
+            self._send(batch)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait(self.interval)
+            self.flush()
+
+    def _send(self, spans: List[Span]) -> None:
+        body = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'gmail-agent'}, 'spans': [self._encode(span) for span in spans]}]
+        }]}).encode()
+        request = urllib.request.Request(self.endpoint, data=body, headers=self.headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+            self.exported += len(spans)
+        except Exception as error:
+            # Only the first failure is logged, the collector may be down for a while
+            if not self.failures:
+                print(f'An error occurred: {error}')
+            self.failures += 1
+
+    def _encode(self, span: Span) -> Dict:
+        encoded = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': f'{span.kind} {span.name}',
+            'kind': self.KINDS.get(span.kind, 1),
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [_attribute(key, value) for key, value in
+                           dict(span.attributes, **{'span.kind': span.kind, 'payload.bytes': span.payload_bytes}).items()
+                           if value is not None],
+            'status': {'code': 2, 'message': span.error} if span.error is not None else {'code': 1}
+        }
+        if span.parent_id is not None:
+            encoded['parentSpanId'] = span.parent_id
+        return encoded
+
+
+def _attribute(key: str, value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def exporter_from_env() -> Optional[OTLPExporter]:
+    """
+    The OTLP exporter configured with the standard OpenTelemetry variables, None if none is set:
+    OTEL_EXPORTER_OTLP_TRACES_ENDPOINT (full URL) or OTEL_EXPORTER_OTLP_ENDPOINT (base URL),
+    OTEL_EXPORTER_OTLP_HEADERS (key=value,...) and OTEL_SERVICE_NAME.
+    """
+    endpoint = os.getenv('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT')
+    if not endpoint and os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT'):
+        endpoint = os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT').rstrip('/') + '/v1/traces'
+    if not endpoint:
+        return None
+    headers = dict(pair.split('=', 1) for pair in os.getenv('OTEL_EXPORTER_OTLP_HEADERS', '').split(',') if '=' in pair)
+    return OTLPExporter(endpoint, service_name=os.getenv('OTEL_SERVICE_NAME', 'gmail-agent'), headers=headers)
+
+
+tracer = Tracer(metrics, exporter_from_env())
@@ -0,0 +1,118 @@
+"""
+Parsing of the Gmail search syntax (gmail_api/search_query.py) and its evaluation over a local
+MessageStore by the FilterMatcher used by preview_filter.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.filter_matcher import FilterMatcher, MessageMetadata, MessageStore
+from gmail_api.search_query import criteria_to_query, parse_query
+
+MESSAGES = [
+    MessageMetadata('m0', sender='Alice <alice@example.com>', subject='Weekly digest #1', label_ids=['INBOX', 'Label_1']),
+    MessageMetadata('m1', sender='news@newsletter.example', subject='Big sale this week', label_ids=['INBOX', 'UNREAD']),
+    MessageMetadata('m2', sender='bob@shop.example', subject='Your order has shipped', label_ids=['INBOX']),
+    MessageMetadata('m3', sender='alice@example.com', subject='Meeting notes', label_ids=['Label_1', 'UNREAD']),
+    MessageMetadata('m4', sender='billing@invoices.example', subject='Invoice 42 is available', label_ids=['INBOX']),
+]
+
+
+@pytest.fixture
+def matcher():
+    store = MessageStore(MESSAGES)
+    store.set_labels([{'id': 'Label_1', 'name': 'Work/Projects'}, {'id': 'INBOX', 'name': 'INBOX'}])
+    return FilterMatcher(store)
+
+
+def matching(matcher, query):
+    return [matcher.store.messages[row].id for row in matcher.store.rows(matcher.match(query))]
+
+
+# region PARSING
+def test_parse_implicit_and_negation_and_or():
+    assert parse_query('from:alice -subject:meeting') == ('and', [('term', 'from', 'alice', False),
+                                                                 ('not', ('term', 'subject', 'meeting', False))])
+    assert parse_query('from:alice OR from:bob') == ('or', [('term', 'from', 'alice', False),
+                                                            ('term', 'from', 'bob', False)])
+
+
+def test_parse_field_applies_to_every_term_of_a_group():
+    assert parse_query('from:(alice OR bob)') == ('or', [('term', 'from', 'alice', False),
+                                                         ('term', 'from', 'bob', False)])
+    assert parse_query('subject:{sale "order shipped"}') == ('or', [('term', 'subject', 'sale', False),
+                                                                    ('term', 'subject', 'order shipped', True)])
+
+
+def test_parse_unknown_field_is_a_word_and_empty_query_matches_everything():
+    assert parse_query('foo:bar') == ('term', None, 'foo:bar', False)
+    assert parse_query('') == ('and', [])
+
+
+def test_criteria_to_query():
+    assert criteria_to_query({'from': 'alice', 'negatedQuery': 'meeting', 'hasAttachment': True,
+                              'size': 1000, 'sizeComparison': 'larger'}) == \
+        'from:(alice) -(meeting) has:attachment larger:1000'
+# endregion
+
+
+# region MATCHING
+def test_negation(matcher):
+    assert matching(matcher, 'from:alice') == ['m0', 'm3']
+    assert matching(matcher, '-from:alice') == ['m1', 'm2', 'm4']
+    assert matching(matcher, 'from:alice -subject:meeting') == ['m0']
+
+
+def test_or_and_grouping(matcher):
+    assert matching(matcher, 'from:bob OR from:billing') == ['m2', 'm4']
+    assert matching(matcher, 'from:(bob | billing)') == ['m2', 'm4']
+    assert matching(matcher, 'in:inbox (from:alice OR subject:sale)') == ['m0', 'm1']
+    assert matching(matcher, '-(from:alice OR is:unread)') == ['m2', 'm4']
+
+
+def test_words_and_phrases_match_whole_words(matcher):
+    assert matching(matcher, 'subject:week') == ['m1']
+    assert matching(matcher, 'subject:"order has shipped"') == ['m2']
+    assert matching(matcher, 'invoice 42') == ['m4']
+
+
+def test_labels_are_resolved_by_name(matcher):
+    assert matching(matcher, 'label:work-projects') == ['m0', 'm3']
+    assert matching(matcher, 'label:"Work/Projects" is:unread') == ['m3']
+    assert matching(matcher, 'is:read -in:inbox') == []
+
+
+def test_unsupported_operator_never_matches(matcher):
+    assert matching(matcher, 'has:attachment') == []
+    assert matching(matcher, 'from:alice has:attachment') == []
+    assert matching(matcher, 'from:alice OR has:attachment') == ['m0', 'm3']
+    assert matcher.unsupported('from:alice has:attachment') == ['has:attachment']
+
+
+def test_unsupported_operator_is_left_out_of_negated_matches(matcher):
+    assert matching(matcher, '-has:attachment') == []
+    assert matching(matcher, '-(from:alice has:attachment)') == ['m1', 'm2', 'm4']
+    assert matching(matcher, '-(from:alice OR has:attachment)') == []
+    assert matching(matcher, 'from:alice -has:attachment') == []
+
+
+def test_preview_counts_the_messages_depending_on_unsupported_operators(matcher):
+    preview = matcher.preview({'query': '-has:attachment'})
+    assert (preview['matches'], preview['uncertain'], preview['total']) == (0, 5, 5)
+    assert preview['unsupported'] == ['has:attachment']
+
+    preview = matcher.preview({'from': 'alice', 'negatedQuery': 'has:attachment'}, sample_size=1)
+    assert (preview['matches'], preview['uncertain']) == (0, 2)
+
+    preview = matcher.preview({'from': 'alice'}, sample_size=1)
+    assert (preview['matches'], preview['uncertain'], preview['unsupported']) == (2, 0, [])
+    assert [message.id for message in preview['samples']] == ['m0']
+
+
+def test_store_growth_invalidates_the_cached_masks(matcher):
+    assert matching(matcher, 'from:carol') == []
+    matcher.store.extend([MessageMetadata('m5', sender='carol@example.org', subject='Hello')])
+    assert matching(matcher, 'from:carol') == ['m5']
+# endregion
@@ -0,0 +1,77 @@
+"""
+The checkpointed thread of a chat grows linearly: every /chat turn adds the user message and the
+agent reply, never a replay of the conversation (see HISTORY_VERSION in frontend/app.py).
+"""
+import os
+import sys
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+os.environ["AGENT_WARMUP"] = "0"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import frontend.app as frontend
+from agent.agent_langgraph import Agent
+from benchmarks.scripted_model import ScriptedChatModel
+from gmail_api.client_pool import GmailClientPool
+
+TURNS = 5
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    # The scripted model answers every turn without tool calls, so no Gmail client is ever built
+    pool = GmailClientPool(credentials_path=None, factory=lambda account: None)
+    agent = Agent(ScriptedChatModel(turns=[["Done."]]), checkpointer=InMemorySaver(), client_pool=pool)
+    monkeypatch.setattr(frontend, "global_agent", agent)
+    return agent
+
+
+@pytest.fixture
+def client(agent):
+    return frontend.app.test_client()
+
+
+def thread_messages(client, agent):
+    with client.session_transaction() as session:
+        thread_id = session["thread_id"]
+    return agent.graph.get_state({"configurable": {"thread_id": thread_id}}).values.get("messages", [])
+
+
+def chat(client, text):
+    response = client.post("/chat", json={"user_input": text})
+    assert response.get_json()["success"]
+
+
+def test_thread_grows_by_two_messages_per_turn(client, agent):
+    client.get("/")
+    counts = [len(thread_messages(client, agent))]
+    for turn in range(TURNS):
+        chat(client, f"Message {turn}")
+        counts.append(len(thread_messages(client, agent)))
+
+    assert [after - before for before, after in zip(counts, counts[1:])] == [2] * TURNS
+    assert [message.content for message in thread_messages(client, agent)[::2]] == [f"Message {turn}" for turn in range(TURNS)]
+
+
+def test_version_1_session_is_seeded_once(client, agent):
+    history = [{"type": "user", "content": "Hello"}, {"type": "agent", "content": "Hi, how can I help?"},
+               {"type": "user", "content": "List my labels"}, {"type": "agent", "content": "You have 3 labels."}]
+    with client.session_transaction() as session:
+        session["messages"] = list(history)
+        session["thread_id"] = "legacy-thread"
+        session["history_version"] = 1
+
+    chat(client, "Thanks")
+    with client.session_transaction() as session:
+        assert session["thread_id"] != "legacy-thread"
+        assert session["history_version"] == frontend.HISTORY_VERSION
+    messages = thread_messages(client, agent)
+    assert [message.content for message in messages[:len(history)]] == [entry["content"] for entry in history]
+    assert len(messages) == len(history) + 2
+
+    # Later turns append to the migrated thread instead of seeding it again
+    for turn in range(TURNS):
+        chat(client, f"Message {turn}")
+        assert len(thread_messages(client, agent)) == len(history) + 2 * (turn + 2)
+    assert not agent.graph.get_state({"configurable": {"thread_id": "legacy-thread"}}).values
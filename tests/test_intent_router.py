@@ -0,0 +1,165 @@
+"""
+The IntentRouter answering trivial commands without the model: parsing of the patterns, and the
+confirmation of the commands changing data through the pending action of the thread.
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.agent_langgraph import Agent
+from agent.utils.intent_router import IntentRouter, is_routed, markdown_table
+from benchmarks.fake_gmail_server import FakeGmailServer
+from benchmarks.scripted_model import ScriptedChatModel
+from gmail_api.client_pool import GmailClientPool
+
+LABELS = [{'id': 'INBOX', 'name': 'INBOX', 'type': 'system'},
+          {'id': 'Label_1', 'name': 'Trips', 'type': 'user'},
+          {'id': 'Label_2', 'name': 'Work Stuff', 'type': 'user'}]
+
+
+@pytest.fixture
+def router():
+    return IntentRouter(SimpleNamespace(gmail_api=SimpleNamespace(list_labels=lambda: LABELS)))
+
+
+class ToolCalls:
+    """Records the tool calls of the router and answers them with a fixed result."""
+
+    def __init__(self, result='done'):
+        self.calls = []
+        self.result = result
+
+    def __call__(self, tool_call):
+        self.calls.append(tool_call)
+        return ToolMessage(tool_call_id=tool_call['id'], name=tool_call['name'], content=self.result)
+
+
+# region PARSING
+@pytest.mark.parametrize('text, tool, args', [
+    ('list my labels', 'list_labels', {}),
+    ('Show me all of my filters', 'list_filters', {}),
+    ('what labels do i have', 'list_labels', {}),
+    ('find emails from alice@example.com', 'search_messages', {'query': 'from:alice@example.com'}),
+    ('create label Receipts', 'create_label', {'label_content': {'name': 'Receipts'}}),
+    ('add a new label called "Made in Italy"', 'create_label', {'label_content': {'name': 'Made in Italy'}}),
+    ('create label Urgent in red', 'create_label', {'label_content': {
+        'name': 'Urgent', 'color': {'backgroundColor': '#fb4c2f', 'textColor': '#000000'}}}),
+    ('delete the label trips', 'delete_label', {'label_id': 'Label_1'}),
+    ('rename label "Work Stuff" to Work', 'update_label', {'label_id': 'Label_2', 'label_content': {'name': 'Work'}}),
+    ('color label Trips #4A86E8', 'update_label', {'label_id': 'Label_1', 'label_content': {
+        'color': {'backgroundColor': '#4a86e8', 'textColor': '#000000'}}}),
+    ('change the colour of label Trips to blue', 'update_label', {'label_id': 'Label_1', 'label_content': {
+        'color': {'backgroundColor': '#4a86e8', 'textColor': '#000000'}}}),
+])
+def test_parse(router, text, tool, args):
+    command = router.parse(text)
+    assert (command.tool, command.args) == (tool, args)
+
+
+@pytest.mark.parametrize('text', [
+    'list my labels and delete the empty ones',  # Only whole messages are routed
+    'delete label Holidays',  # Unknown label
+    'delete label INBOX',  # System labels cannot be changed
+    'create label Urgent in salmon',  # Unknown color
+    'how do filters work?',
+])
+def test_uncertain_messages_are_left_to_the_model(router, text):
+    assert router.parse(text) is None
+    assert router.handle(text, None, ToolCalls()) is None
+# endregion
+
+
+# region CONFIRMATION
+def test_reads_run_at_once(router):
+    tool_calls = ToolCalls('Labels 1-1 of 1 (id|name)\nLabel_1|Trips')
+    update = router.handle('Please list my labels.', None, tool_calls)
+
+    assert [call['name'] for call in tool_calls.calls] == ['list_labels']
+    assert update['pending_action'] is None
+    call, result, reply = update['messages']
+    assert call.tool_calls[0]['id'] == tool_calls.calls[0]['id'] == result.tool_call_id
+    assert reply.content == '**Labels** (1)\n\n| Name |\n|---|\n| Trips |'
+    assert all(is_routed(message) for message in (call, reply))
+
+
+def test_changes_wait_for_a_confirmation(router):
+    tool_calls = ToolCalls()
+    question = router.handle('delete label Trips', None, tool_calls)
+    assert tool_calls.calls == []
+    assert question['messages'][0].content.startswith('Delete the label **Trips**?')
+    pending = question['pending_action']
+    assert pending['tool'] == 'delete_label' and pending['args'] == {'label_id': 'Label_1'}
+
+    update = router.handle('yes', pending, tool_calls)
+    assert [(call['name'], call['args']) for call in tool_calls.calls] == [('delete_label', {'label_id': 'Label_1'})]
+    assert update['messages'][-1].content == 'Label **Trips** deleted.'
+    assert update['pending_action'] is None
+
+
+def test_changes_can_be_cancelled(router):
+    tool_calls = ToolCalls()
+    pending = router.handle('rename label Trips to Travel', None, tool_calls)['pending_action']
+
+    update = router.handle('no', pending, tool_calls)
+    assert tool_calls.calls == []
+    assert update['pending_action'] is None
+    assert [message.content for message in update['messages']] == ['Cancelled, nothing was changed.']
+
+
+def test_failed_change_is_answered_with_the_tool_result(router):
+    tool_calls = ToolCalls('Label Trips could not be deleted. Not found')
+    pending = router.handle('delete label Trips', None, tool_calls)['pending_action']
+    assert router.handle('ok', pending, tool_calls)['messages'][-1].content == tool_calls.result
+
+
+def test_another_command_replaces_the_pending_action(router):
+    tool_calls = ToolCalls()
+    pending = router.handle('delete label Trips', None, tool_calls)['pending_action']
+    update = router.handle('list my filters', pending, tool_calls)
+    assert [call['name'] for call in tool_calls.calls] == ['list_filters']
+    assert update['pending_action'] is None
+
+
+def test_stats(router):
+    pending = router.handle('delete label Trips', None, ToolCalls())['pending_action']
+    router.handle('yes', pending, ToolCalls())
+    router.handle('tell me a joke', None, ToolCalls())
+    stats = router.stats()
+    assert (stats['messages'], stats['fast_path'], stats['confirmed']) == (3, 1, 1)
+    assert stats['by_intent'] == {'delete_label': 1}
+    assert stats['hit_rate'] == pytest.approx(2 / 3)
+# endregion
+
+
+def test_markdown_table_keeps_other_results():
+    assert markdown_table('No filters found.') == 'No filters found.'
+    table = markdown_table('Found 3 messages\nMessages 1-2 of 3 (id|from|subject)\nm1|a@b.com|Hi\nm2|c@d.com|A \\| B')
+    assert table.splitlines() == ['Found 3 messages', '', '**Messages** (3)', '', '| From | Subject |', '|---|---|',
+                                  '| a@b.com | Hi |', '| c@d.com | A \\| B |', '', '1 more, ask to see the next ones.']
+
+
+def test_agent_drops_the_pending_action_when_the_user_answers_something_else():
+    with FakeGmailServer() as server:
+        gmail_api = server.client()
+        gmail_api.create_label({'name': 'Trips'})
+        pool = GmailClientPool(credentials_path=None, factory=lambda account: gmail_api)
+        agent = Agent(ScriptedChatModel(turns=[['Answered by the model.']]), checkpointer=InMemorySaver(),
+                      client_pool=pool, fast_path=True)
+        thread = {'configurable': {'thread_id': 'thread'}}
+
+        def send(text):
+            return agent.graph.invoke({'messages': [HumanMessage(content=text)]}, thread)
+
+        assert send('delete label Trips')['pending_action']['intent'] == 'delete_label'
+        state = send('actually, what is a filter?')
+        assert state['pending_action'] is None
+        assert state['messages'][-1].content == 'Answered by the model.'
+        # The yes no longer confirms anything, the label is kept
+        state = send('yes')
+        assert state['messages'][-1].content == 'Answered by the model.'
+        assert 'Trips' in [label['name'] for label in gmail_api.list_labels(refresh=True)]
@@ -0,0 +1,110 @@
+"""
+The naive Bayes LabelClassifier and the label suggestions built on it (suggest_labels).
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.utils.tools.gmail_tools import GmailToolkit
+from benchmarks.fake_gmail_server import FakeGmailServer
+from gmail_api.client_pool import GmailClientPool
+from gmail_api.filter_matcher import MessageMetadata
+from gmail_api.label_classifier import LabelClassifier, criteria_from_features
+
+
+def message(sender, subject, *label_ids):
+    return MessageMetadata(f'{sender}/{subject}', sender=sender, subject=subject, label_ids=list(label_ids))
+
+
+TRAINING = (
+    [message(f'billing@shop{n % 2}.example.com', f'Invoice {n} for your order', 'Label_bills') for n in range(8)]
+    + [message(f'alice{n}@team.example.org', f'Sprint planning notes week {n}', 'Label_work') for n in range(8)]
+    + [message('bob@team.example.org', 'Quarterly invoice review', 'Label_work', 'Label_bills')]
+    + [message('rare@elsewhere.example', 'Hello there', 'Label_rare') for _ in range(2)]
+)
+
+
+@pytest.fixture
+def classifier():
+    return LabelClassifier().fit(TRAINING, ['Label_bills', 'Label_work', 'Label_rare'])
+
+
+def test_tokens():
+    assert sorted(LabelClassifier.tokens(message('Shop <News@Mail.Shop.com>', 'Your invoice, 2024'))) == [
+        'domain:mail.shop.com', 'domain:shop.com', 'from:news@mail.shop.com', 'subject:invoice', 'subject:your']
+
+
+def test_labels_below_min_examples_are_not_learned(classifier):
+    assert classifier.labels == ['Label_bills', 'Label_work']
+    assert list(classifier.label_counts) == [9, 9]
+
+
+def test_predict(classifier):
+    unlabeled = [message('billing@shop1.example.com', 'Invoice 99 for your order'),
+                 message('carol@team.example.org', 'Sprint planning notes'),
+                 message('stranger@unknown.example', 'Lunch?')]
+    probabilities = classifier.predict_proba(unlabeled)
+    assert probabilities.shape == (3, 2)
+    assert probabilities.sum(axis=1) == pytest.approx([1.0, 1.0, 1.0])
+
+    bills, work, stranger = classifier.predict(unlabeled, min_confidence=0.8)
+    assert bills[0] == 'Label_bills' and bills[1] > 0.8
+    assert work[0] == 'Label_work' and work[1] > 0.8
+    assert stranger is None
+
+
+def test_background_leaves_messages_unlike_every_label_without_one():
+    training = TRAINING[:8] + [message(f'friend{n}@mail.example', f'Dinner on day {n}') for n in range(8)]
+    unlabeled = [message('billing@shop0.example.com', 'Invoice 99 for your order'),
+                 message('friend3@mail.example', 'Dinner tomorrow')]
+
+    # A single label always gets all of the probability, unless the background takes its share
+    assert LabelClassifier().fit(training, ['Label_bills']).predict(unlabeled) == [('Label_bills', 1.0)] * 2
+    classifier = LabelClassifier().fit(training, ['Label_bills'], background=True)
+    assert classifier.labels == ['Label_bills']
+    probabilities = classifier.predict_proba(unlabeled)
+    assert probabilities.shape == (2, 1)
+    assert probabilities[0, 0] > 0.9 and probabilities[1, 0] < 0.1
+    assert [prediction and prediction[0] for prediction in classifier.predict(unlabeled, min_confidence=0.5)] == \
+        ['Label_bills', None]
+    assert 'subject:dinner' not in classifier.top_features('Label_bills')
+
+
+def test_top_features_and_criteria(classifier):
+    features = classifier.top_features('Label_bills')
+    invoice_tokens = {token for example in TRAINING[:8] for token in LabelClassifier.tokens(example)}
+    work_tokens = {token for example in TRAINING[8:16] for token in LabelClassifier.tokens(example)}
+    assert len(features) == 5 and set(features) <= invoice_tokens - work_tokens
+    assert classifier.top_features('Label_rare') == []
+
+    assert criteria_from_features(['from:a@shop.com', 'domain:shop.com', 'subject:invoice']) == {'from': 'shop.com'}
+    assert criteria_from_features(['subject:invoice', 'subject:order']) == {'subject': 'invoice'}
+    assert criteria_from_features([]) == {}
+
+
+def test_untrained_classifier_predicts_nothing():
+    classifier = LabelClassifier().fit(TRAINING[:3], ['Label_bills'])
+    assert classifier.labels == []
+    assert classifier.predict([message('a@b.com', 'Invoice')]) == [None]
+    assert classifier.top_features('Label_bills') == []
+
+
+def test_suggest_labels_tool():
+    with FakeGmailServer() as server:
+        gmail_api = server.client()
+        label_id = gmail_api.create_label({'name': 'Receipts'})['id']
+        for n in range(6):
+            server.add_message('orders@store.example', f'Your receipt {n}', [label_id])
+        for n in range(6):
+            server.add_message(f'friend{n}@mail.example', f'Dinner on day {n}', ['INBOX'])
+        for n in range(3):
+            server.add_message('orders@store.example', f'Your receipt {n + 10}', ['INBOX'])
+        toolkit = GmailToolkit(GmailClientPool(credentials_path=None, factory=lambda account: gmail_api))
+
+        summary = toolkit.suggest_labels(min_confidence=0.9)
+
+    assert summary.startswith('Suggestions for 3 of the 9 unlabeled messages:')
+    assert f"Label 'Receipts' (ID {label_id}): 3 messages" in summary
+    assert 'Proposed filter criteria: {"from": "store.example"}' in summary
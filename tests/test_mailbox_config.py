@@ -0,0 +1,232 @@
+"""
+The declarative mailbox config: the minimal plan diffing it against the current labels and
+filters, and the order of the phases applying the plan.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.fake_gmail_server import FakeGmailServer
+from gmail_api.gmail_api import RetryPolicy
+from gmail_api.mailbox_config import MailboxConfig
+
+LABELS = [
+    {'id': 'INBOX', 'name': 'INBOX', 'type': 'system'},
+    {'id': 'STARRED', 'name': 'STARRED', 'type': 'system'},
+    {'id': 'Label_1', 'name': 'Work', 'type': 'user', 'color': {'backgroundColor': '#4A86E8', 'textColor': '#000000'}},
+    {'id': 'Label_2', 'name': 'Trips', 'type': 'user'},
+    {'id': 'Label_3', 'name': 'Old', 'type': 'user'},
+]
+FILTERS = [
+    {'id': 'f_boss', 'criteria': {'from': 'boss@example.com'}, 'action': {'addLabelIds': ['Label_1']}},
+    {'id': 'f_shop', 'criteria': {'from': 'shop.example', 'hasAttachment': False},
+     'action': {'addLabelIds': 'STARRED', 'removeLabelIds': 'INBOX'}},
+    {'id': 'f_old', 'criteria': {'subject': 'old'}, 'action': {'addLabelIds': ['Label_3']}},
+]
+
+
+def config(text):
+    return MailboxConfig.from_yaml(text)
+
+
+# region PLAN
+def test_exported_config_plans_no_change():
+    exported = MailboxConfig.export(LABELS, FILTERS)
+    assert [label['name'] for label in exported.labels] == ['Old', 'Trips', 'Work']
+    assert exported.labels[2] == {'name': 'Work', 'color': {'backgroundColor': '#4a86e8', 'textColor': '#000000'}}
+
+    plan = config(exported.to_yaml()).plan(LABELS, FILTERS)
+    assert len(plan) == 0 and plan.errors == []
+    assert plan.unchanged == {'labels': 3, 'filters': 3}
+
+
+def test_plan_is_minimal():
+    plan = config("""
+labels:
+  - {name: Work, color: {backgroundColor: '#4a86e8', textColor: '#000000'}}
+  - {name: Travel, renamed_from: Trips}
+  - {name: VIP}
+filters:
+  - {criteria: {from: boss@example.com}, action: {addLabels: [Work]}}
+  - {criteria: {from: shop.example}, action: {addLabels: [STARRED]}}
+  - {criteria: {from: vip@example.com}, action: {addLabels: [VIP, IMPORTANT]}}
+  - {criteria: {subject: trip}, action: {addLabels: [Travel]}}
+""").plan(LABELS, FILTERS)
+
+    assert plan.create_labels == [{'name': 'VIP'}]
+    assert plan.update_labels == [{'label_id': 'Label_2', 'name': 'Trips', 'label_content': {'name': 'Travel'}}]
+    assert plan.delete_labels == [] and plan.delete_filters == []  # Nothing is pruned by default
+    assert plan.unchanged == {'labels': 1, 'filters': 1}
+    # The shop filter changed its actions, so it replaces the current one
+    assert [(gmail_filter['criteria'], (gmail_filter.get('replaces') or {}).get('filter_id'))
+            for gmail_filter in plan.create_filters] == [
+        ({'from': 'shop.example'}, 'f_shop'), ({'from': 'vip@example.com'}, None), ({'subject': 'trip'}, None)]
+    assert plan.errors == []
+    assert '~ filter from:shop.example -> +STARRED -INBOX replaced by from:shop.example -> +STARRED' \
+        in plan.summary().splitlines()
+
+
+def test_prune_deletes_what_the_config_does_not_declare():
+    plan = config("""
+prune: true
+labels: [{name: Work}, {name: Trips}]
+filters:
+  - {criteria: {from: boss@example.com}, action: {addLabels: [Work]}}
+""").plan(LABELS, FILTERS)
+
+    assert plan.delete_labels == [{'label_id': 'Label_3', 'name': 'Old'}]
+    assert [gmail_filter['filter_id'] for gmail_filter in plan.delete_filters] == ['f_shop', 'f_old']
+    assert plan.create_filters == []
+
+
+def test_unknown_and_system_labels():
+    plan = config("""
+prune: true
+labels: [{name: INBOX, color: {backgroundColor: '#fb4c2f', textColor: '#000000'}}]
+filters:
+  - {criteria: {from: a@example.com}, action: {addLabels: [TODO]}}
+  - {criteria: {from: b@example.com}, action: {addLabels: [Old]}}
+  - {criteria: {from: c@example.com}, action: {addLabels: [CATEGORY_UPDATES], removeLabels: [INBOX, UNREAD]}}
+""").plan(LABELS, FILTERS)
+
+    # An upper case name is not a system label, and a pruned label cannot be used
+    assert plan.errors == ['INBOX is a system label, it cannot be changed.',
+                           'Filter from:a@example.com -> +TODO uses unknown label(s) TODO.',
+                           'Filter from:b@example.com -> +Old uses unknown label(s) Old.']
+    assert [gmail_filter['criteria'] for gmail_filter in plan.create_filters] == [{'from': 'c@example.com'}]
+
+
+@pytest.mark.parametrize('text, error', [
+    ('- a list', 'must be a mapping'),
+    ('labels: [{color: red}]', 'needs a name'),
+    ('labels: [{name: A}, {name: A}]', 'declared twice'),
+    ('filters: [{action: {addLabels: [A]}}]', 'needs criteria'),
+    ('filters: [{criteria: {from: a}, action: {markRead: true}}]', r'Unknown filter action\(s\) markRead'),
+    ('labels: [', 'Invalid YAML'),
+])
+def test_invalid_configs(text, error):
+    with pytest.raises(ValueError, match=error):
+        config(text)
+# endregion
+
+
+# region APPLY
+class RecordingBatch:
+    """Records the operations of a batch, the ones targeting `failing` fail."""
+
+    def __init__(self, gmail, failing):
+        self.gmail = gmail
+        self.failing = failing
+        self.operations = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.gmail.batches.append(self.operations)
+        self.results = [{'operation': operation, 'target': target, 'ok': target not in self.failing}
+                        for operation, target in self.operations]
+        for operation, target in self.operations:
+            if operation == 'create_label' and target not in self.failing:
+                self.gmail.labels.append({'id': f'Label_{target}', 'name': target, 'type': 'user'})
+
+    def _add(self, operation, target):
+        self.operations.append((operation, target))
+        return len(self.operations) - 1
+
+    def create_label(self, label_content):
+        return self._add('create_label', label_content['name'])
+
+    def update_label(self, label_id, label_content):
+        return self._add('update_label', label_id)
+
+    def delete_label(self, label_id):
+        return self._add('delete_label', label_id)
+
+    def create_filter(self, criteria, actions):
+        return self._add('create_filter', criteria['from'])
+
+    def delete_filter(self, filter_id):
+        return self._add('delete_filter', filter_id)
+
+
+class RecordingGmail:
+    def __init__(self, failing=()):
+        self.labels = list(LABELS)
+        self.batches = []
+        self.failing = set(failing)
+
+    def batch(self):
+        return RecordingBatch(self, self.failing)
+
+    def list_labels(self, refresh=False):
+        return list(self.labels)
+
+
+PRUNING_CONFIG = """
+prune: true
+labels: [{name: Work}, {name: Trips}, {name: VIP}]
+filters:
+  - {criteria: {from: boss@example.com}, action: {addLabels: [Work, STARRED]}}
+  - {criteria: {from: shop.example}, action: {addLabels: [STARRED], removeLabels: [INBOX]}}
+  - {criteria: {from: vip@example.com}, action: {addLabels: [VIP]}}
+"""
+
+
+def test_apply_runs_the_phases_in_order():
+    gmail = RecordingGmail()
+    plan = config(PRUNING_CONFIG).plan(LABELS, FILTERS)
+    results = plan.apply(gmail)
+
+    assert gmail.batches == [
+        [('create_label', 'VIP')],
+        # Pruned filters are deleted along with the creations, the replaced ones only afterwards
+        [('delete_filter', 'f_old'), ('create_filter', 'boss@example.com'), ('create_filter', 'vip@example.com')],
+        [('delete_filter', 'f_boss')],
+        [('delete_label', 'Label_3')],
+    ]
+    assert all(result['ok'] for result in results) and len(results) == 6
+
+
+def test_replaced_filter_is_kept_when_its_replacement_fails():
+    gmail = RecordingGmail(failing={'boss@example.com'})
+    results = config(PRUNING_CONFIG).plan(LABELS, FILTERS).apply(gmail)
+
+    assert gmail.batches[2] == []
+    assert [result['target'] for result in results if not result['ok']] == ['boss@example.com']
+
+
+def test_filters_using_a_label_that_could_not_be_created_are_not_sent():
+    gmail = RecordingGmail(failing={'VIP'})
+    results = config(PRUNING_CONFIG).plan(LABELS, FILTERS).apply(gmail)
+
+    assert ('create_filter', 'vip@example.com') not in gmail.batches[1]
+    assert {'operation': 'create_filter', 'target': {'from': 'vip@example.com'}, 'ok': False,
+            'error': 'Unknown label(s): VIP'} in results
+
+
+def test_apply_against_gmail():
+    with FakeGmailServer() as server:
+        gmail_api = server.client(retry_policy=RetryPolicy(max_attempts=1))
+        work = gmail_api.create_label({'name': 'Work'})['id']
+        old = gmail_api.create_filter({'from': 'boss@example.com'}, {'addLabelIds': [work]})
+        desired = config("""
+labels: [{name: Work}, {name: VIP}]
+filters:
+  - {criteria: {from: boss@example.com}, action: {addLabels: [Work, VIP]}}
+""")
+
+        # The creation of the replacement fails: the current filter is kept
+        plan = desired.plan(gmail_api.list_labels(refresh=True), gmail_api.list_filters())
+        server.inject_errors(1, 503, r'/filters$')
+        plan.apply(gmail_api)
+        assert [gmail_filter['id'] for gmail_filter in gmail_api.list_filters()] == [old['id']]
+
+        desired.plan(gmail_api.list_labels(refresh=True), gmail_api.list_filters()).apply(gmail_api)
+        filters = gmail_api.list_filters()
+        assert len(filters) == 1 and filters[0]['id'] != old['id']
+        assert len(desired.plan(gmail_api.list_labels(refresh=True), filters)) == 0
+# endregion
@@ -0,0 +1,108 @@
+"""
+The inverted header index answering search_messages locally (gmail_api/search_index.py).
+"""
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from gmail_api.filter_matcher import MessageMetadata
+from gmail_api.search_index import SearchIndex, UnsupportedQueryError
+
+
+def day(text):
+    return datetime.strptime(text, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+
+MESSAGES = [
+    MessageMetadata('old', sender='Jane Doe <jane@mail.shop.com>', subject='Your order has shipped',
+                    label_ids=['INBOX'], date=day('2024-01-10')),
+    MessageMetadata('mid', sender='newsletters@news.example', to='me@example.com', cc='team@company.example',
+                    subject='Weekly digest', label_ids=['INBOX', 'UNREAD', 'Label_7'], date=day('2024-03-05')),
+    MessageMetadata('new', sender='bob@company.example', to='me@example.com', subject='Order review',
+                    label_ids=['Label_7'], date=day('2024-06-20')),
+]
+
+
+@pytest.fixture
+def index():
+    return SearchIndex(MESSAGES, labels=[{'id': 'Label_7', 'name': 'Work/Reports'}])
+
+
+def ids(index, query, **kwargs):
+    return [message.id for message in index.search(query, **kwargs)[1]]
+
+
+def test_messages_are_returned_newest_first(index):
+    assert ids(index, '') == ['new', 'mid', 'old']
+
+
+def test_address_operators(index):
+    assert ids(index, 'from:jane@mail.shop.com') == ['old']
+    assert ids(index, 'from:newsletters@') == ['mid']
+    assert ids(index, 'from:@shop.com') == ids(index, 'from:shop.com') == ['old']
+    assert ids(index, 'from:"Jane Doe"') == ['old']
+    assert ids(index, 'to:team@company.example') == ['mid']
+    assert ids(index, 'from:company.example') == ['new']
+
+
+def test_subject_words_and_phrases(index):
+    assert ids(index, 'subject:order') == ['new', 'old']
+    assert ids(index, 'subject:"order shipped"') == ['old']
+    assert ids(index, 'digest') == ['mid']
+    assert ids(index, 'jane') == ['old']
+
+
+def test_labels(index):
+    assert ids(index, 'label:work-reports') == ids(index, 'label:"Work/Reports"') == ['new', 'mid']
+    assert ids(index, 'in:inbox is:unread') == ['mid']
+    assert ids(index, 'is:read') == ['new', 'old']
+    assert ids(index, 'label:missing') == []
+
+
+def test_dates(index):
+    assert ids(index, 'after:2024/03/05') == ['new', 'mid']
+    assert ids(index, 'before:2024/03/05') == ['old']
+    assert ids(index, 'after:2024/02/01 before:2024/06/01') == ['mid']
+
+
+def test_negation_or_and_grouping(index):
+    assert ids(index, '-in:inbox') == ['new']
+    assert ids(index, 'subject:order -from:bob') == ['old']
+    assert ids(index, 'from:bob OR from:jane') == ['new', 'old']
+    assert ids(index, 'label:work-reports (digest OR review) -is:unread') == ['new']
+    assert ids(index, '-(from:bob OR in:inbox)') == []
+
+
+def test_pagination_and_count(index):
+    assert index.search('', limit=1, offset=1) == (3, [MESSAGES[1]])
+    assert index.count('subject:order') == 2
+
+
+@pytest.mark.parametrize('query', ['has:attachment', 'larger:10M', 'after:yesterday', 'is:starred has:drive'])
+def test_unsupported_operators_raise(index, query):
+    with pytest.raises(UnsupportedQueryError):
+        index.search(query)
+
+
+def test_dense_and_sparse_postings_agree_with_a_scan():
+    # Enough messages for the frequent terms to be stored as bitmaps
+    messages = [MessageMetadata(f'm{n}', sender=f'user{n % 7}@domain{n % 3}.example', subject=f'report {n % 5}',
+                                label_ids=['INBOX'] if n % 2 else ['UNREAD'], date=float(n))
+                for n in range(5000)]
+    index = SearchIndex(messages)
+
+    def scan(predicate):
+        return sum(1 for message in messages if predicate(message))
+
+    assert index.count('in:inbox') == scan(lambda m: 'INBOX' in m.label_ids)
+    assert index.count('from:domain1.example in:inbox') == \
+        scan(lambda m: '@domain1.' in m.sender and 'INBOX' in m.label_ids)
+    assert index.count('from:user3@domain0.example -is:unread') == \
+        scan(lambda m: m.sender == 'user3@domain0.example' and 'UNREAD' not in m.label_ids)
+    assert index.count('subject:"report 2" OR from:user1@') == \
+        scan(lambda m: m.subject == 'report 2' or m.sender.startswith('user1@'))
+    assert index.count('-(in:inbox OR subject:4)') == \
+        scan(lambda m: 'INBOX' not in m.label_ids and m.subject != 'report 4')
@@ -0,0 +1,76 @@
+"""
+The Server-Sent Events of /chat/stream: a turn answered by the intent router sends its tool events
+before its reply, and the reply once (see stream_agent_events in frontend/app.py).
+"""
+import json
+import os
+import re
+import sys
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+os.environ["AGENT_WARMUP"] = "0"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import frontend.app as frontend
+from agent.agent_langgraph import Agent
+from benchmarks.fake_gmail_server import FakeGmailServer
+from benchmarks.scripted_model import ScriptedChatModel
+from gmail_api.client_pool import GmailClientPool
+
+
+@pytest.fixture
+def server():
+    with FakeGmailServer(messages=10) as server:
+        yield server
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    gmail_api = server.client()
+    pool = GmailClientPool(credentials_path=None, factory=lambda account: gmail_api)
+    agent = Agent(ScriptedChatModel(turns=[["Answered by the model."]]), checkpointer=InMemorySaver(),
+                  client_pool=pool, fast_path=True)
+    monkeypatch.setattr(frontend, "global_agent", agent)
+    client = frontend.app.test_client()
+    client.get("/")
+    return client
+
+
+def stream(client, text):
+    """The (event, data) pairs streamed in answer to a message."""
+    body = client.post("/chat/stream", json={"user_input": text}).get_data(as_text=True)
+    return [(event, json.loads(data)) for event, data in re.findall(r"event: (\w+)\ndata: (.*)\n\n", body)]
+
+
+def names(events):
+    return [event for event, _ in events]
+
+
+def test_routed_listing_sends_tool_events_before_the_reply(client):
+    events = stream(client, "list my labels")
+
+    assert names(events) == ["tool_start", "tool_result", "render", "done"]
+    assert events[0][1]["name"] == "list_labels"
+    assert "INBOX" in events[2][1]["html"]
+    assert events[3][1]["html"] == events[2][1]["html"]
+
+
+def test_routed_confirmation_flow_sends_every_reply_once(client):
+    question = stream(client, "create label Trips in red")
+    assert names(question) == ["render", "done"]
+    assert "Create the label <strong>Trips</strong>" in question[0][1]["html"]
+
+    confirmed = stream(client, "yes")
+    assert names(confirmed) == ["tool_start", "tool_result", "render", "done"]
+    assert confirmed[0][1] == {"name": "create_label", "args": {"label_content": {
+        "name": "Trips", "color": {"backgroundColor": "#fb4c2f", "textColor": "#000000"}}}}
+    assert "Label <strong>Trips</strong> created." in confirmed[2][1]["html"]
+
+
+def test_model_reply_is_streamed_token_by_token(client):
+    events = stream(client, "What is the weather like?")
+
+    assert names(events)[0] == "token"
+    assert names(events)[-1] == "done"
+    assert "".join(data["text"] for event, data in events if event == "token") == "Answered by the model."
@@ -0,0 +1,111 @@
+"""
+The ToolScheduler running the independent tool calls of an agent step concurrently, with the
+resource accesses declared by GmailToolkit.resource_access.
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from agent.utils.tools.gmail_tools import GmailToolkit
+from agent.utils.tools.tool_scheduler import EVERYTHING, ToolScheduler, conflicts
+from gmail_api.client_pool import GmailClientPool
+
+
+@pytest.fixture
+def toolkit():
+    # resource_access never calls Gmail, so no client is ever built
+    return GmailToolkit(GmailClientPool(credentials_path=None, factory=lambda account: None))
+
+
+@pytest.fixture
+def scheduler(toolkit):
+    scheduler = ToolScheduler(toolkit.resource_access, max_workers=4)
+    yield scheduler
+    scheduler._executor.shutdown()
+
+
+def call(name, **args):
+    return {'name': name, 'args': args, 'id': f'call_{name}'}
+
+
+def test_conflicts():
+    assert not conflicts({('labels', 'r')}, {('labels', 'r')})
+    assert conflicts({('labels', 'r')}, {('labels/Label_1', 'w')})
+    assert conflicts({('labels/Label_1', 'w')}, {('labels/Label_1', 'w')})
+    assert not conflicts({('labels/Label_1', 'w')}, {('labels/Label_10', 'w')})
+    assert not conflicts({('labels/Label_1', 'w')}, {('filters/f1', 'w')})
+    assert conflicts(EVERYTHING, {('messages', 'r')})
+
+
+def test_reads_run_in_one_wave(scheduler):
+    assert scheduler.plan([call('list_labels'), call('list_filters'), call('search_messages', query='from:a')]) == \
+        [[0, 1, 2]]
+
+
+def test_writes_wait_for_the_reads_and_writes_they_conflict_with(scheduler):
+    tool_calls = [
+        call('list_labels'),
+        call('delete_label', label_id='Label_1'),
+        call('delete_label', label_id='Label_2'),
+        call('delete_filter', filter_id='f1'),
+        call('list_labels'),
+    ]
+    assert scheduler.plan(tool_calls) == [[0, 3], [1, 2], [4]]
+
+
+def test_filter_waits_for_the_label_created_in_the_same_step(scheduler):
+    tool_calls = [
+        call('create_label', label_content={'name': 'Work'}),
+        call('create_label', label_content={'name': 'Home'}),
+        call('create_filter', criteria={'from': 'boss'}, actions={'addLabelIds': ['Label_9']}),
+        call('create_filter', criteria={'from': 'shop'}, actions={'addLabelIds': ['STARRED']}),
+    ]
+    assert scheduler.plan(tool_calls) == [[0, 1, 3], [2]]
+
+
+def test_unknown_tools_and_access_errors_are_serialized(scheduler):
+    tool_calls = [call('list_labels'), call('unknown_tool'), call('list_filters'),
+                  call('delete_labels'), call('list_labels')]
+    # delete_labels without its label_ids argument cannot say what it touches, so it runs alone too
+    assert scheduler.plan(tool_calls) == [[0], [1], [2], [3], [4]]
+    assert scheduler.plan([]) == []
+
+
+def test_run_keeps_the_order_of_the_calls(scheduler):
+    delays = {'list_labels': 0.05, 'list_filters': 0.0, 'search_messages': 0.02}
+    tool_calls = [call('list_labels'), call('list_filters'), call('search_messages', query='x')]
+
+    def invoke(tool_call):
+        time.sleep(delays[tool_call['name']])
+        return tool_call['name']
+
+    assert scheduler.run(tool_calls, invoke) == ['list_labels', 'list_filters', 'search_messages']
+
+
+def test_run_runs_a_wave_concurrently_and_the_waves_in_order(scheduler):
+    tool_calls = [call('list_labels'), call('list_filters'), call('delete_label', label_id='Label_1')]
+    # The two reads only pass the barrier if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    finished = []
+
+    def invoke(tool_call):
+        if tool_call['name'] != 'delete_label':
+            barrier.wait()
+        else:
+            assert sorted(finished) == ['list_filters', 'list_labels']
+        finished.append(tool_call['name'])
+        return tool_call['name']
+
+    assert scheduler.run(tool_calls, invoke) == ['list_labels', 'list_filters', 'delete_label']
+
+
+def test_run_passes_the_context_to_the_workers(scheduler):
+    account = contextvars.ContextVar('account')
+    account.set('work@example.com')
+    results = scheduler.run([call('list_labels'), call('list_filters')], lambda tool_call: account.get(None))
+    assert results == ['work@example.com', 'work@example.com']